@@ -0,0 +1,438 @@
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from src.logger import logFile
+from src.config import config_path, cpu_count, total_memory, host_profile, max_workers_by_memory, default_config, \
+    save_profile
+from src.tokenizer_convert import form_texts, sample_texts
+
+
+# Настройки калибровки
+calibration_cells = 48                      # число ячеек для замеров
+spell_batch_candidates = [1, 4, 8, 16, 32]  # ячеек в одном вызове исправления орфографии
+ner_batch_candidates = [1, 8, 32, 64]       # текстов в одном вызове NER для имен
+packs_candidates = [1, 4, 8, 16]            # упакованных последовательностей в одном вызове NER для адресов
+max_latency = None                          # ограничение задержки пакета (95-й перцентиль), с; None - без ограничения
+throughput_tolerance = 0.03                 # варианты, отличающиеся по пропускной способности меньше, считаются равными
+memory_margin = 1.1                         # запас к памяти процесса, измеренной при калибровке
+
+# Строки обмена между процессом калибровки и замеряющими процессами
+message_prefix = "AUTOTUNE "
+
+
+def thread_candidates(n_cpu: int) -> list:
+
+    "Число потоков torch: степени двойки до числа ядер и само число ядер"
+
+    return sorted({2 ** i for i in range(n_cpu.bit_length()) if 2 ** i <= n_cpu} | {n_cpu})
+
+
+def process_layouts(n_cpu: int, max_workers: int) -> list:
+
+    """
+    Варианты распределения ядер: (число процессов, потоков torch на процесс),
+    процессы занимают все ядра и помещаются в памяти
+    """
+
+    layouts = [(n_cpu // threads, threads) for threads in thread_candidates(n_cpu)]
+
+    return sorted({(n_workers, threads) for n_workers, threads in layouts if 1 <= n_workers <= max_workers})
+
+
+def calibration_data(check_dir: str = "data/raw", n_cells: int = calibration_cells, seed: int = 0) -> dict:
+
+    """
+    Ячейки для замеров: случайная выборка текстов анкет (или встроенные примеры),
+    слова - для NER имен, тексты с запятыми - для NER адресов
+
+    Возвращает:
+    data : dict
+        cells, names, addresses - списки строк
+    """
+
+    texts = form_texts(check_dir) if os.path.isdir(check_dir) else []
+    texts = texts if len(texts) > 0 else sample_texts
+
+    rng = random.Random(seed)
+    cells = [rng.choice(texts) for _ in range(n_cells)]
+
+    names = [" ".join(re.findall("[а-яА-ЯЁё\-]+", cell)[:3]) for cell in cells]
+
+    return {"cells": cells,
+            "names": [name for name in names if name != ""],
+            "addresses": [cell for cell in cells if ", " in cell] or cells}
+
+
+def time_batches(fn, items: list, batch_size: int) -> dict:
+
+    """
+    Замер пакетной функции: пропускная способность и задержка пакета
+
+    Возвращает:
+    summary : dict
+        items_per_second, latency_p50, latency_p95 (с)
+    """
+
+    latencies = []
+    start = time.perf_counter()
+
+    for i in range(0, len(items), batch_size):
+
+        batch_start = time.perf_counter()
+        fn(items[i:i+batch_size])
+        latencies.append(time.perf_counter() - batch_start)
+
+    seconds = time.perf_counter() - start
+    latencies = pd.Series(latencies)
+
+    return {"items_per_second": len(items) / max(seconds, 1e-9),
+            "latency_p50": float(latencies.quantile(0.5)),
+            "latency_p95": float(latencies.quantile(0.95))}
+
+
+def _best(rows: list, max_latency: float = max_latency, prefer: str = None) -> dict:
+
+    """
+    Выбор варианта: наибольшая пропускная способность среди вариантов с допустимой задержкой
+    (если таких нет - с наименьшей задержкой). Среди почти равных по пропускной способности
+    выбирается вариант с наименьшим значением prefer (например, меньше процессов - меньше памяти)
+    """
+
+    allowed = [row for row in rows if max_latency is None or row["latency_p95"] <= max_latency]
+
+    if len(allowed) == 0: return min(rows, key=lambda row: row["latency_p95"])
+
+    best = max(row["items_per_second"] for row in allowed)
+    close = [row for row in allowed if row["items_per_second"] >= best * (1 - throughput_tolerance)]
+
+    if prefer is None: return max(close, key=lambda row: row["items_per_second"])
+
+    return min(close, key=lambda row: (row[prefer], -row["items_per_second"]))
+
+
+def _send(message: dict):
+
+    print(message_prefix + json.dumps(message), flush=True)
+
+
+def _receive(process: subprocess.Popen) -> dict:
+
+    "Чтение сообщения замеряющего процесса (прочий вывод пропускается)"
+
+    while True:
+
+        line = process.stdout.readline()
+
+        if line == "": raise RuntimeError(f"Процесс калибровки завершился с кодом {process.wait()}")
+
+        if line.startswith(message_prefix): return json.loads(line[len(message_prefix):])
+
+
+def _load_models(threads: int):
+
+    "Загрузка моделей в замеряющем процессе с заданным числом потоков torch"
+
+    from src import spellcheck
+
+    spellcheck.init_threads(threads)
+
+    return spellcheck
+
+
+def sweep(data: dict, threads: int, max_latency: float = max_latency) -> dict:
+
+    """
+    Замеры размеров пакетов и режима декодирования в одном процессе (запускается в отдельном процессе
+    командой sweep, чтобы модели не оставались в памяти процесса калибровки во время замеров процессов)
+
+    Возвращает:
+    results : dict
+        Замеры по вариантам (spell, names, addresses, decoding), выбранные значения и память процесса
+    """
+
+    from src import metrics
+
+    spellcheck = _load_models(threads)
+
+    # прогрев: первые вызовы моделей заметно медленнее
+    spellcheck.correct_errors_batch(data["cells"][:2])
+    spellcheck.name_reconstruct_batch(data["names"][:2])
+    spellcheck.address_reconstruct_batch(data["addresses"][:2])
+
+    spell_rows = []
+
+    for batch_size in spell_batch_candidates:
+        spellcheck.spell_batch_size = batch_size
+        spell_rows.append(dict(time_batches(spellcheck.correct_errors_batch, data["cells"], batch_size), batch_size=batch_size))
+
+    spell_batch_size = _best(spell_rows, max_latency)["batch_size"]
+    spellcheck.spell_batch_size = spell_batch_size
+
+    names_rows = []
+
+    for batch_size in ner_batch_candidates:
+        spellcheck.ner_batch_size = batch_size
+        names_rows.append(dict(time_batches(spellcheck.name_reconstruct_batch, data["names"], batch_size), batch_size=batch_size))
+
+    # адреса приходят пакетами сервиса (service_batch_size = spell_batch_size), упаковка - внутри пакета
+    addresses_rows = []
+
+    for packs in packs_candidates:
+        spellcheck.packs_per_batch = packs
+        addresses_rows.append(dict(time_batches(spellcheck.address_reconstruct_batch, data["addresses"], spell_batch_size), packs_per_batch=packs))
+
+    from src.speculative import unsupported_settings
+
+    # спекулятивное декодирование дает тот же результат только при жадном декодировании модели без обработчиков логитов
+    with spellcheck.registry.acquire("spellcheck") as spell:
+        greedy = len(unsupported_settings(spell["model"])) == 0
+
+    decoding_rows = []
+
+    for decoding in (["generate", "speculative"] if greedy else ["generate"]):
+        spellcheck.spell_decoding = decoding
+        decoding_rows.append(dict(time_batches(spellcheck.correct_errors_batch, data["cells"], spell_batch_size), decoding=decoding))
+
+    return {"spell": spell_rows,
+            "names": names_rows,
+            "addresses": addresses_rows,
+            "decoding": decoding_rows,
+            "spell_batch_size": spell_batch_size,
+            "ner_batch_size": _best(names_rows)["batch_size"],
+            "packs_per_batch": _best(addresses_rows)["packs_per_batch"],
+            "spell_decoding": _best(decoding_rows, max_latency)["decoding"],
+            "rss": metrics.get_rss()}
+
+
+def probe(data: dict, threads: int, batch_size: int, decoding: str):
+
+    """
+    Замеряющий процесс для сочетания процессов и потоков: модели загружаются, процесс сообщает
+    о готовности и ждет команды, чтобы все процессы сочетания начали замер одновременно
+    """
+
+    from src import metrics
+
+    spellcheck = _load_models(threads)
+    spellcheck.spell_batch_size = batch_size
+    spellcheck.spell_decoding = decoding
+
+    spellcheck.correct_errors_batch(data["cells"][:2])
+
+    _send({"ready": True, "rss": metrics.get_rss()})
+
+    sys.stdin.readline()
+
+    _send(time_batches(spellcheck.correct_errors_batch, data["cells"], batch_size))
+
+
+def _start(command: str, data_path: str, threads: int, extra: tuple = ()) -> subprocess.Popen:
+
+    # библиотеки OpenMP/MKL читают число потоков при загрузке - задается и переменными окружения
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+
+    return subprocess.Popen([sys.executable, "-m", "src.autotune", command, "--data", data_path, "--threads", str(threads), *extra],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env)
+
+
+def measure_layouts(data_path: str, n_cells: int, layouts: list, batch_size: int, decoding: str,
+                    log: logFile = None, verbose: bool = False) -> list:
+
+    """
+    Замер сочетаний числа процессов и потоков torch: процессы сочетания обрабатывают ячейки одновременно,
+    пропускная способность - общее число ячеек всех процессов за время от старта до завершения последнего
+
+    Возвращает:
+    rows : list of dict
+        n_workers, torch_threads, items_per_second, latency_p50, latency_p95, rss
+    """
+
+    rows = []
+
+    for n_workers, threads in layouts:
+
+        processes = [_start("probe", data_path, threads, ["--batch-size", str(batch_size), "--decoding", decoding])
+                     for _ in range(n_workers)]
+
+        try:
+
+            ready = [_receive(process) for process in processes]
+
+            start = time.perf_counter()
+
+            for process in processes:
+                process.stdin.write("go\n")
+                process.stdin.flush()
+
+            results = [_receive(process) for process in processes]
+            seconds = time.perf_counter() - start
+
+        except RuntimeError as e:
+
+            msg = f"{n_workers} x {threads}: замер не выполнен - {e}"
+            if log is not None: log.write_log(msg, content = "ERR")
+            if verbose: print(msg)
+
+            for process in processes: process.kill()
+
+            continue
+
+        finally:
+
+            for process in processes: process.wait()
+
+        row = {"n_workers": n_workers,
+               "torch_threads": threads,
+               "items_per_second": n_workers * n_cells / seconds,
+               "latency_p50": max(result["latency_p50"] for result in results),
+               "latency_p95": max(result["latency_p95"] for result in results),
+               "rss": max(message["rss"] for message in ready)}
+        rows.append(row)
+
+        msg = (f"{n_workers} x {threads}: {row['items_per_second']:.2f} ячеек/с, "
+               f"задержка p95 {row['latency_p95']:.2f} с, память процесса {row['rss'] / 1024 ** 3:.1f} ГБ")
+        if log is not None: log.write_log(msg)
+        if verbose: print(msg)
+
+    return rows
+
+
+def autotune(check_dir: str = "data/raw", n_cells: int = calibration_cells, max_latency: float = max_latency,
+             path: str = config_path, save: bool = True, verbose: bool = False) -> dict:
+
+    """
+    Подбор настроек для текущего хоста:
+    1. в отдельном процессе - размеры пакетов для исправления орфографии и NER, режим декодирования
+       (потоков torch - как в настройках по умолчанию для хоста);
+    2. сочетания числа процессов-исполнителей и потоков torch, занимающие все ядра и помещающиеся
+       в памяти (по памяти процесса из шага 1): процессы сочетания работают одновременно.
+    Настройки записываются в файл config_path по профилю оборудования (см. модуль config)
+    и применяются модулями spellcheck, jobqueue, scheduler и service при запуске
+
+    Параметры:
+    check_dir : str
+        Папка с анкетами - источник ячеек для замеров
+    n_cells : int
+        Число ячеек для замеров
+    max_latency : float
+        Ограничение задержки пакета (95-й перцентиль), с
+    save : bool
+        Записать настройки в файл
+
+    Возвращает:
+    settings : dict
+        Подобранные настройки и результаты замеров
+    """
+
+    log = logFile(operation = "Подбор настроек производительности")
+
+    n_cpu = cpu_count()
+    profile = host_profile()
+
+    msg = f"Профиль хоста {profile}: ядер {n_cpu}, памяти {total_memory() / 1024 ** 3:.1f} ГБ"
+    log.write_log(msg)
+    if verbose: print(msg)
+
+    data = calibration_data(check_dir, n_cells)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        data_path = f.name
+
+    try:
+
+        # Шаг 1: размеры пакетов
+        threads = default_config()["torch_threads"]
+        process = _start("sweep", data_path, threads, [] if max_latency is None else ["--max-latency", str(max_latency)])
+        batches = _receive(process)
+        process.wait()
+
+        for name in ["spell", "names", "addresses", "decoding"]:
+            msg = f"Пакеты ({name}, {threads} потоков):\n{pd.DataFrame(batches[name]).to_string(index=False)}"
+            log.write_log(msg)
+            if verbose: print(msg)
+
+        # Шаг 2: процессы и потоки
+        worker_memory = int(batches["rss"] * memory_margin)
+        layouts = process_layouts(n_cpu, max_workers_by_memory(worker_memory))
+
+        layout_rows = measure_layouts(data_path, len(data["cells"]), layouts, batches["spell_batch_size"],
+                                      batches["spell_decoding"], log, verbose)
+
+    finally:
+        os.remove(data_path)
+
+    if len(layout_rows) == 0:
+        raise RuntimeError("Ни одно сочетание процессов и потоков не удалось замерить")
+
+    best = _best(layout_rows, max_latency, prefer="n_workers")
+
+    settings = {"torch_threads": best["torch_threads"],
+                "n_workers": best["n_workers"],
+                "spell_batch_size": batches["spell_batch_size"],
+                "service_batch_size": batches["spell_batch_size"],
+                "ner_batch_size": batches["ner_batch_size"],
+                "packs_per_batch": batches["packs_per_batch"],
+                "spell_decoding": batches["spell_decoding"],
+                "worker_memory": max(worker_memory, int(best["rss"] * memory_margin)),
+                "tuned_at": datetime.now().isoformat(timespec="seconds"),
+                "measured": {"cells_per_second": round(best["items_per_second"], 3),
+                             "latency_p95": round(best["latency_p95"], 3),
+                             "layouts": layout_rows}}
+
+    msg = (f"Настройки {profile}: {best['n_workers']} исполнителей x {best['torch_threads']} потоков, "
+           f"пакет {settings['spell_batch_size']}, NER {settings['ner_batch_size']}, упаковка {settings['packs_per_batch']}, "
+           f"декодирование {settings['spell_decoding']} - {best['items_per_second']:.2f} ячеек/с")
+    log.write_log(msg)
+    if verbose: print(msg)
+
+    if save:
+        save_profile(settings, path, profile)
+        log.write_log(f"Настройки записаны в {path}")
+
+    log.close()
+
+    return settings
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="Подбор числа потоков, процессов и размеров пакетов для хоста")
+    arg_parser.add_argument("command", nargs="?", choices=["run", "sweep", "probe"], default="run",
+                            help="run - подбор настроек; sweep и probe - замеряющие процессы (запускаются командой run)")
+    arg_parser.add_argument("--check-dir", default="data/raw", help="Папка с анкетами - источник ячеек для замеров")
+    arg_parser.add_argument("--cells", type=int, default=calibration_cells, help="Число ячеек для замеров")
+    arg_parser.add_argument("--max-latency", type=float, default=max_latency, help="Ограничение задержки пакета (p95), с")
+    arg_parser.add_argument("--config", default=config_path)
+    arg_parser.add_argument("--dry-run", action="store_true", help="Не записывать настройки")
+    arg_parser.add_argument("--data", default="")
+    arg_parser.add_argument("--threads", type=int, default=1)
+    arg_parser.add_argument("--batch-size", type=int, default=1)
+    arg_parser.add_argument("--decoding", default="generate")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    if args.command == "run":
+
+        settings = autotune(args.check_dir, args.cells, args.max_latency, args.config, not args.dry_run, args.verbose)
+        print(json.dumps({key: value for key, value in settings.items() if key != "measured"}, ensure_ascii=False, indent=2))
+
+    else:
+
+        with open(args.data, encoding="utf-8") as f:
+            data = json.load(f)
+
+        if args.command == "sweep":
+            _send(sweep(data, args.threads, args.max_latency))
+        else:
+            probe(data, args.threads, args.batch_size, args.decoding)
@@ -0,0 +1,145 @@
+import time
+import threading
+
+from src import metrics
+from src.logger import logFile
+from src.router import route_cell, ROUTE_NEURAL
+from src.rules import last_surnames, sort_address
+
+
+# Уровни деградации обработки анкеты
+LEVEL_FULL = 0          # все этапы
+LEVEL_SKIP_LOW = 1      # без проверки орфографии в колонках низкого приоритета
+LEVEL_RULES = 2         # имена и адреса - только правилами (last_surnames, sort_address)
+LEVEL_GIVE_UP = 3       # обработка прекращается
+
+# Доли бюджета времени, после которых включается уровень
+skip_low_share = 0.5
+rules_share = 0.75
+
+# Виды деградации ячейки (метка метрики и сообщение лога)
+degradation_messages = {"skip_spellcheck": "орфография пропущена",
+                        "rule_names": "имя исправлено правилами",
+                        "rule_addresses": "адрес исправлен правилами"}
+
+# Способ обработки ячейки для файла изменений (см. changeset.CellTrace)
+degradation_paths = {"skip_spellcheck": "skipped (budget)",
+                     "rule_names": "last_surnames (budget)",
+                     "rule_addresses": "sort_address (budget)"}
+
+# Колонки, в которых проверка орфографии отключается первой
+low_priority_columns = {"Должность с указанием наименования организации",
+                        "Число, месяц, год и место рождения, гражданство",
+                        "Место работы, должность"}
+
+
+class BudgetExceeded(Exception):
+
+    "Время обработки анкеты вышло за бюджет"
+
+
+class FormBudget:
+
+    """
+    Бюджет времени на обработку анкеты. Функции исправления оборачиваются методом wrap:
+    перед каждой ячейкой проверяется прошедшее время и выбирается уровень деградации
+
+    1. после skip_low_share бюджета - пропуск проверки орфографии в колонках low_priority_columns;
+    2. после rules_share бюджета - имена и адреса исправляются только правилами, без NER;
+    3. после всего бюджета - исключение BudgetExceeded.
+
+    Каждая ячейка, обработанная с деградацией, записывается в лог (и в trace - changeset.CellTrace, если он задан)
+    """
+
+    def __init__(self, seconds: float, filename: str, log: logFile = None, verbose: bool = False, trace = None):
+
+        self.seconds = seconds
+        self.filename = filename
+        self.log = log
+        self.verbose = verbose
+        self.trace = trace
+        self.start = time.perf_counter()
+        self.degraded = []
+        self.lock = threading.Lock()
+
+    def elapsed(self) -> float:
+
+        return time.perf_counter() - self.start
+
+    def level(self) -> int:
+
+        share = self.elapsed() / self.seconds
+
+        if share >= 1: return LEVEL_GIVE_UP
+        if share >= rules_share: return LEVEL_RULES
+        if share >= skip_low_share: return LEVEL_SKIP_LOW
+
+        return LEVEL_FULL
+
+    def _record(self, stage: str, sheet: str, column: str, value, action: str):
+
+        with self.lock:
+            self.degraded.append({"sheet": sheet, "column": column, "stage": stage, "value": value, "action": action})
+
+        metrics.cells_degraded.inc(action=action)
+
+        if self.trace is not None: self.trace.path(degradation_paths[action])
+
+        msg = f"{self.filename}: {sheet}: {column}: {degradation_messages[action]} ({self.elapsed():.1f} с из {self.seconds:g} с): {value!r}"
+        if self.log is not None: self.log.write_log(msg, content = "ERR")
+        if self.verbose: print(msg)
+
+    def wrap(self, stage: str, fn, sheet: str, column: str):
+
+        """
+        Обертка функции исправления ячеек колонки с учетом бюджета
+
+        Параметры:
+        stage : str
+            "spellcheck", "names" или "addresses"
+        fn : callable
+            Функция исправления значения ячейки
+        sheet, column : str
+            Этап (лист) и колонка - для выбора деградации и записи в лог
+
+        Возвращает:
+        wrapped : callable
+            Функция с той же сигнатурой
+        """
+
+        def wrapped(value):
+
+            level = self.level()
+
+            if level >= LEVEL_GIVE_UP:
+                raise BudgetExceeded(f"{self.filename}: бюджет {self.seconds:g} с исчерпан ({sheet}, {column})")
+
+            if stage == "spellcheck" and level >= LEVEL_SKIP_LOW and column in low_priority_columns \
+                    and route_cell(value) == ROUTE_NEURAL:
+                self._record(stage, sheet, column, value, "skip_spellcheck")
+                return value
+
+            if stage == "names" and level >= LEVEL_RULES:
+                self._record(stage, sheet, column, value, "rule_names")
+                return last_surnames(value)
+
+            if stage == "addresses" and level >= LEVEL_RULES:
+                self._record(stage, sheet, column, value, "rule_addresses")
+                return sort_address(value)
+
+            return fn(value)
+
+        return wrapped
+
+    def degraded_sheets(self) -> set:
+
+        "Этапы (листы), в которых была деградация"
+
+        with self.lock:
+            return {cell["sheet"] for cell in self.degraded}
+
+    def report(self) -> str:
+
+        "Строка для лога: число ячеек с деградацией и прошедшее время"
+
+        return f"ячеек с деградацией - {len(self.degraded)}, время {self.elapsed():.1f} с из {self.seconds:g} с"
@@ -0,0 +1,332 @@
+import os
+import json
+import argparse
+import threading
+import pandas as pd
+from openpyxl.utils import get_column_letter
+
+from src.form import read_form, split_form, save_to_excel
+
+
+# Форматы записи результата обработки анкеты
+OUTPUT_XLSX = "xlsx"           # полная книга _check.xlsx по шаблону
+OUTPUT_JSONL = "jsonl"         # только изменения: _changes.jsonl
+OUTPUT_PARQUET = "parquet"     # только изменения: _changes.parquet
+
+changeset_columns = ["file", "sheet", "cell", "table", "row", "column", "old", "new", "rule", "models"]
+
+# Правила, применяемые к колонкам таблиц (номер таблицы - как в split_form);
+# используются, если путь обработки ячейки не записан (например, лист восстановлен из промежуточных результатов)
+table_rules = {1: {"Ответ": "spellcheck, condition_1"},
+               2: {"Месяц и год поступления": "condition_2",
+                   "Месяц и год увольнения": "condition_2",
+                   "Должность с указанием наименования организации": "spellcheck",
+                   "Адрес организации": "spellcheck, condition_4"},
+               3: {"Степень родства": "condition_3.1",
+                   "Фамилия, имя и отчество": "condition_3.2",
+                   "Число, месяц, год и место рождения, гражданство": "spellcheck",
+                   "Место работы, должность": "spellcheck",
+                   "Адрес места жительства": "spellcheck, condition_4"},
+               4: {"Степень родства": "condition_3.1",
+                   "Фамилия, имя и отчество": "condition_3.2"},
+               5: {"Период проживания начало": "condition_2",
+                   "Период проживания конец": "condition_2",
+                   "Адрес проживания и регистрации": "spellcheck, condition_4"}}
+
+
+# Способы обработки ячейки на шаге по умолчанию (см. CellTrace); обертки функций исправления сообщают свои:
+# router - "passthrough", "latin_rules"; budget - см. budget.degradation_paths
+PATH_MODEL = "model"           # функция исправления (модель или сервис)
+PATH_RULES = "rules"           # правила модуля rules
+
+
+class CellTrace:
+
+    """
+    Пути обработки ячеек анкеты для файла изменений: какой шаг и каким способом изменил ячейку.
+
+    Колонка обрабатывается методом map; обертки функций исправления (CellRouter, FormBudget) 
+    сообщают способ обработки текущей ячейки методом path - он запоминается для потока, в котором
+    вызвана функция. Записываются только шаги, изменившие значение ячейки (потокобезопасно: листы 
+    обрабатываются одновременно)
+    """
+
+    def __init__(self):
+
+        self.paths = {}
+        self.lock = threading.Lock()
+        self.current = threading.local()
+
+    def path(self, path: str):
+
+        "Способ обработки текущей ячейки (вызывается обертками функции исправления)"
+
+        self.current.path = path
+
+    def map(self, form_table, table: int, column: str, step: str, fn, path: str = PATH_MODEL):
+
+        """
+        Применение функции к колонке таблицы (FormTable.map) с записью шага для измененных ячеек
+
+        Параметры:
+        form_table : FormTable
+            Таблица
+        table : int
+            Номер таблицы (как в split_form)
+        column : str
+            Имя колонки
+        step : str
+            Шаг обработки ("spellcheck", "condition_2" и т.д.)
+        fn : callable
+            Функция исправления значения ячейки
+        path : str
+            Способ обработки по умолчанию (если обертка функции не сообщила другой)
+        """
+
+        values = form_table[column]
+        old_values = list(values)
+        cell_paths = []
+
+        def traced(value):
+
+            self.current.path = path
+            result = fn(value)
+            cell_paths.append(self.current.path)
+
+            return result
+
+        form_table.map(column, traced)
+
+        for row, (old, new, cell_path) in enumerate(zip(old_values, values, cell_paths)):
+            if not _same(old, new): self.note(table, column, row, step, cell_path)
+
+    def note(self, table: int, column: str, row: int, step: str, path: str = PATH_RULES):
+
+        "Запись шага, изменившего ячейку (для изменений вне map)"
+
+        with self.lock:
+            self.paths.setdefault((table, column, row), []).append(f"{step}: {path}")
+
+    def rule(self, table: int, column: str, row: int) -> str:
+
+        "Шаги, изменившие ячейку (None, если не записаны)"
+
+        with self.lock:
+            steps = self.paths.get((table, column, row))
+
+        return ", ".join(steps) if steps is not None else None
+
+
+def changeset_path(filename: str, workdir: str = "data/", output_format: str = OUTPUT_JSONL) -> str:
+
+    return workdir + "processed/" + filename.replace(".xlsx", "") + "_changes." + output_format
+
+
+def check_path(filename: str, workdir: str = "data/") -> str:
+
+    return workdir + "processed/" + filename.replace(".xlsx", "") + "_check.xlsx"
+
+
+def output_cell(tables: list, table: int, row: int, column: str) -> tuple:
+
+    """
+    Лист и адрес ячейки в книге _check.xlsx, куда save_to_excel записывает значение таблицы
+
+    Параметры:
+    tables : list of FormTable
+        Шесть таблиц анкеты (нужна длина п. 16 - от нее зависит смещение п. 17)
+    table : int
+        Номер таблицы
+    row : int
+        Позиция строки в таблице
+    column : str
+        Имя колонки
+
+    Возвращает:
+    sheet, cell : str
+        Имя листа и адрес ячейки (например, "Лист4", "C12")
+    """
+
+    if table in [0, 1]:
+        return "Лист1", f"B{row + (4 if table == 0 else 8)}"
+
+    column_letter = get_column_letter(list(tables[table].columns).index(column) + 1)
+
+    if table == 2: return "Лист2", f"{column_letter}{row + 4}"
+    if table == 3: return "Лист3", f"{column_letter}{row + 3}"
+    if table == 4: return "Лист4", f"{column_letter}{row + 4}"
+
+    rows_to_add1 = max(0, len(tables[4]) - 4)
+
+    return "Лист4", f"{column_letter}{row + 10 + rows_to_add1}"
+
+
+def _json_value(value):
+
+    "Значение ячейки для записи в JSON (пропуски - None, даты - строкой)"
+
+    if isinstance(value, float) and pd.isna(value): return None
+    if value is None or isinstance(value, (str, int, float, bool)): return value
+
+    return str(value)
+
+
+def _same(old, new) -> bool:
+
+    if isinstance(old, str) or isinstance(new, str): return old == new
+    if pd.isna(old) and pd.isna(new): return True
+
+    return old == new
+
+
+def diff_tables(filename: str, original_tables: list, processed_tables: list, model_versions: str = "",
+                trace: CellTrace = None) -> list:
+
+    """
+    Изменения, внесенные обработкой: ячейки, значение которых отличается от исходного
+
+    Параметры:
+    filename : str
+        Имя файла анкеты
+    original_tables, processed_tables : list of FormTable
+        Шесть таблиц анкеты до и после обработки (см. split_form)
+    model_versions : str
+        Версии моделей, обработавших анкету (см. registry.format_versions)
+    trace : CellTrace
+        Пути обработки ячеек; для ячеек без записанного пути правило берется из table_rules
+
+    Возвращает:
+    changes : list of dict
+        Изменения: файл, лист и ячейка книги _check.xlsx, таблица, строка, колонка, старое и новое значения, 
+        правило (шаги и способы обработки, изменившие ячейку), версии моделей
+    """
+
+    changes = []
+
+    for table, (original, processed) in enumerate(zip(original_tables, processed_tables)):
+
+        columns = ["Ответ"] if table in [0, 1] else list(processed.columns)
+
+        for column in columns:
+
+            for row, (old, new) in enumerate(zip(original[column], processed[column])):
+
+                if _same(old, new): continue
+
+                sheet, cell = output_cell(processed_tables, table, row, column)
+
+                rule = trace.rule(table, column, row) if trace is not None else None
+                if rule is None: rule = table_rules.get(table, {}).get(column, "-")
+
+                changes.append({"file": filename, "sheet": sheet, "cell": cell, "table": table, "row": row,
+                                "column": column, "old": _json_value(old), "new": _json_value(new),
+                                "rule": rule, "models": model_versions})
+
+    return changes
+
+
+def save_changes(changes: list, filename: str, workdir: str = "data/", output_format: str = OUTPUT_JSONL) -> str:
+
+    """
+    Запись изменений анкеты в _changes.jsonl (по строке на ячейку) или _changes.parquet
+
+    Возвращает:
+    output_file : str
+        Путь к записанному файлу
+    """
+
+    output_file = changeset_path(filename, workdir, output_format)
+
+    if output_format == OUTPUT_PARQUET:
+
+        # в колонке parquet значения одного типа: старое и новое значения хранятся в JSON
+        changes_df = pd.DataFrame(changes, columns=changeset_columns)
+        changes_df["old"] = changes_df["old"].map(lambda value: json.dumps(value, ensure_ascii=False))
+        changes_df["new"] = changes_df["new"].map(lambda value: json.dumps(value, ensure_ascii=False))
+        changes_df.to_parquet(output_file, index=False)
+
+    else:
+
+        with open(output_file, "w", encoding="utf-8") as f:
+            for change in changes:
+                f.write(json.dumps(change, ensure_ascii=False) + "\n")
+
+    return output_file
+
+
+def read_changes(path: str) -> list:
+
+    "Чтение изменений анкеты из _changes.jsonl или _changes.parquet"
+
+    if path.endswith(".parquet"):
+
+        changes = pd.read_parquet(path).to_dict("records")
+
+        for change in changes:
+            change["old"], change["new"] = json.loads(change["old"]), json.loads(change["new"])
+
+        return changes
+
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+
+def materialize(filename: str, workdir: str = "data/") -> str:
+
+    """
+    Построение книги _check.xlsx по исходной анкете и ее изменениям (без вызова моделей):
+    исходные таблицы + изменения -> save_to_excel
+
+    Параметры:
+    filename : str
+        Имя файла анкеты
+    workdir : str
+        Рабочая директория (анкета - в workdir/raw, изменения - в workdir/processed)
+
+    Возвращает:
+    output_file : str
+        Путь к записанному файлу _check.xlsx
+    """
+
+    path = changeset_path(filename, workdir, OUTPUT_JSONL)
+
+    if not os.path.exists(path): path = changeset_path(filename, workdir, OUTPUT_PARQUET)
+
+    tables = split_form(read_form(workdir + "raw/" + filename))
+    changes = read_changes(path)
+
+    for change in changes:
+        tables[change["table"]][change["column"]][change["row"]] = change["new"]
+
+    # файлы изменений, записанные до появления версий моделей, колонки models не содержат
+    model_versions = changes[0].get("models", "") if len(changes) > 0 else ""
+
+    return save_to_excel(tables, filename, workdir, model_versions)
+
+
+def get_check_file(filename: str, workdir: str = "data/") -> str:
+
+    "Путь к _check.xlsx; книга строится по изменениям при первом обращении"
+
+    output_file = check_path(filename, workdir)
+
+    if not os.path.exists(output_file): output_file = materialize(filename, workdir)
+
+    return output_file
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="Построение _check.xlsx по изменениям анкеты")
+    arg_parser.add_argument("filenames", nargs="*", help="Имена файлов анкет (по умолчанию - все анкеты с изменениями)")
+    arg_parser.add_argument("--workdir", default="data/")
+    args = arg_parser.parse_args()
+
+    file_names = args.filenames
+
+    if len(file_names) == 0:
+        file_names = sorted({name.rsplit("_changes.", 1)[0] + ".xlsx" for name in os.listdir(args.workdir + "processed")
+                             if "_changes." in name})
+
+    for filename in file_names:
+        print(get_check_file(filename, args.workdir))
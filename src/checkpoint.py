@@ -0,0 +1,113 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+
+from src import metrics
+
+
+# Папка для промежуточных результатов обработки анкет (file_processor использует <workdir>/checkpoints/)
+checkpoint_dir = "data/checkpoints/"
+
+
+def file_hash(path: str) -> str:
+
+    """
+    Хэш содержимого файла (sha256). Используется как ключ промежуточных результатов:
+    при обновлении анкеты (новое содержимое) сохраненные результаты не используются
+
+    Параметры:
+    path : str
+        Путь к файлу
+
+    Возвращает:
+    digest : str
+        Хэш в шестнадцатеричном виде
+    """
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def versions_hash(model_versions: dict) -> str:
+
+    "Короткий хэш версий моделей (часть ключа промежуточных результатов)"
+
+    return hashlib.sha256(json.dumps(model_versions, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+class StageCheckpoint:
+
+    """
+    Класс для сохранения результатов этапов обработки анкеты.
+
+    Результат каждого этапа (обработанные таблицы листа) сохраняется в pickle-файл
+    <checkpoint_dir>/<хэш файла>-<хэш версий моделей>/<этап>.pkl. При повторной обработке анкеты после сбоя
+    завершенные этапы не выполняются заново - результат считывается из файла.
+    Результаты, полученные другими версиями моделей (до замены версии, см. registry), не используются.
+    После успешной записи анкеты промежуточные результаты удаляются методом clear().
+    """
+
+    def __init__(self, file_path: str, checkpoint_dir: str = checkpoint_dir, model_versions: dict = None):
+
+        self.file_key = file_hash(file_path)
+        self.model_versions = dict(model_versions or {})
+        self.key = self.file_key + "-" + versions_hash(self.model_versions)
+        self.checkpoint_dir = checkpoint_dir
+        self.dir = os.path.join(checkpoint_dir, self.key)
+
+    def _path(self, stage: str) -> str:
+
+        return os.path.join(self.dir, stage + ".pkl")
+
+    def stages(self) -> list:
+
+        "Список сохраненных этапов"
+
+        if not os.path.isdir(self.dir): return []
+
+        return sorted(filename[:-4] for filename in os.listdir(self.dir) if filename.endswith(".pkl"))
+
+    def load(self, stage: str):
+
+        "Чтение результата этапа; None, если этап не сохранен или файл поврежден"
+
+        try:
+            with open(self._path(stage), "rb") as f:
+                result = pickle.load(f)
+
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        metrics.cache_hits.inc(cache="checkpoint")
+
+        return result
+
+    def save(self, stage: str, result):
+
+        "Сохранение результата этапа (атомарно: через временный файл и переименование)"
+
+        os.makedirs(self.dir, exist_ok=True)
+
+        tmp_path = self._path(stage) + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, self._path(stage))
+
+    def clear(self):
+
+        "Удаление всех промежуточных результатов анкеты (в том числе полученных другими версиями моделей)"
+
+        if not os.path.isdir(self.checkpoint_dir): return
+
+        for name in os.listdir(self.checkpoint_dir):
+            if name.startswith(self.file_key + "-"):
+                shutil.rmtree(os.path.join(self.checkpoint_dir, name), ignore_errors=True)
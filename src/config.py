@@ -0,0 +1,198 @@
+import os
+import json
+
+
+# Файл настроек, подобранных модулем autotune (по профилям оборудования)
+config_path = "config/tuned.json"
+
+# Память, которую нельзя отдавать исполнителям (система, кэш файлов), доля от общего объема
+reserved_memory_share = 0.2
+
+# Оценка памяти одного процесса с загруженными моделями, байт (до первой калибровки)
+default_worker_memory = 6 * 1024 ** 3
+
+
+def cpu_count() -> int:
+
+    "Число ядер, доступных процессу (с учетом ограничений контейнера через привязку к ядрам)"
+
+    if hasattr(os, "sched_getaffinity"): return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def total_memory() -> int:
+
+    "Объем оперативной памяти, байт"
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def host_profile(n_cpu: int = None, memory: int = None) -> str:
+
+    """
+    Профиль оборудования - ключ настроек: хосты с одинаковым числом ядер и объемом памяти
+    используют одни и те же настройки (например, "16cpu-64gb")
+    """
+
+    n_cpu = cpu_count() if n_cpu is None else n_cpu
+    memory = total_memory() if memory is None else memory
+
+    return f"{n_cpu}cpu-{round(memory / 1024 ** 3)}gb"
+
+
+def max_workers_by_memory(worker_memory: int = default_worker_memory, memory: int = None) -> int:
+
+    "Число процессов-исполнителей, помещающихся в памяти"
+
+    memory = total_memory() if memory is None else memory
+
+    if memory == 0: return 1
+
+    return max(1, int(memory * (1 - reserved_memory_share) // max(1, worker_memory)))
+
+
+def threads_per_worker(n_workers: int, n_cpu: int = None) -> int:
+
+    "Число потоков torch на процесс: ядра делятся между n_workers процессами поровну"
+
+    n_cpu = cpu_count() if n_cpu is None else n_cpu
+
+    return max(1, n_cpu // max(1, n_workers))
+
+
+def default_config(n_cpu: int = None, memory: int = None) -> dict:
+
+    """
+    Настройки без калибровки: один исполнитель на 4 ядра (в пределах памяти),
+    ядра делятся между исполнителями поровну
+
+    Возвращает:
+    config : dict
+        torch_threads, n_workers, spell_batch_size, ner_batch_size, packs_per_batch, spell_decoding, service_batch_size
+    """
+
+    n_cpu = cpu_count() if n_cpu is None else n_cpu
+
+    n_workers = max(1, min(n_cpu // 4, max_workers_by_memory(memory=memory)))
+
+    return {"torch_threads": threads_per_worker(n_workers, n_cpu),
+            "n_workers": n_workers,
+            "spell_batch_size": 16,
+            "ner_batch_size": 32,
+            "packs_per_batch": 8,
+            "spell_decoding": "generate",
+            "service_batch_size": 16}
+
+
+def _profile_cpu(profile: str) -> int:
+
+    return int(profile.split("cpu-")[0])
+
+
+def load_config(path: str = config_path, profile: str = None) -> dict:
+
+    """
+    Настройки для текущего хоста: профиль с тем же числом ядер и памятью, иначе - откалиброванный
+    профиль с тем же числом ядер (число исполнителей ограничивается памятью, потоки torch делятся
+    между оставшимися исполнителями), иначе - default_config.
+    Отсутствующие в файле параметры берутся из default_config; файл с ошибкой не используется
+
+    Параметры:
+    path : str
+        Путь к файлу настроек
+    profile : str
+        Профиль оборудования (по умолчанию - текущий хост)
+
+    Возвращает:
+    config : dict
+        Настройки (ключ "profile" - профиль, по которому они подобраны, или "default")
+    """
+
+    config = dict(default_config(), profile="default")
+    profile = host_profile() if profile is None else profile
+
+    if not os.path.exists(path): return config
+
+    try:
+
+        with open(path, encoding="utf-8") as f:
+            profiles = json.load(f).get("profiles", {})
+
+        return _select_profile(profiles, profile, config)
+
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+
+        # настройки читаются при импорте модулей: файл с ошибкой не должен останавливать запуск
+        print(f"Файл настроек {path} не прочитан, используются настройки по умолчанию: {e!r}")
+
+        return config
+
+
+def _check_types(tuned: dict, config: dict) -> dict:
+
+    "Проверка типов настроек профиля: те же, что у настроек по умолчанию (TypeError при несовпадении)"
+
+    types = dict({name: type(value) for name, value in config.items()}, worker_memory=int)
+
+    for name, value_type in types.items():
+        if name in tuned and type(tuned[name]) is not value_type:
+            raise TypeError(f"Параметр {name}: ожидается {value_type.__name__}, в файле {tuned[name]!r}")
+
+    return tuned
+
+
+def _select_profile(profiles: dict, profile: str, config: dict) -> dict:
+
+    "Выбор настроек профиля (см. load_config)"
+
+    if profile in profiles:
+        return _check_types({**config, **profiles[profile], "profile": profile}, config)
+
+    same_cpu = [name for name in profiles if _profile_cpu(name) == _profile_cpu(profile)]
+
+    if len(same_cpu) == 0: return config
+
+    tuned = _check_types({**config, **profiles[same_cpu[0]], "profile": same_cpu[0]}, config)
+
+    # памяти на хосте может быть меньше, чем на откалиброванном
+    worker_memory = tuned.get("worker_memory", default_worker_memory)
+    n_workers = min(tuned["n_workers"], max_workers_by_memory(worker_memory))
+
+    # освободившиеся ядра делятся между оставшимися исполнителями
+    if n_workers != tuned["n_workers"]:
+        tuned["n_workers"] = n_workers
+        tuned["torch_threads"] = threads_per_worker(n_workers)
+
+    return tuned
+
+
+def save_profile(settings: dict, path: str = config_path, profile: str = None):
+
+    "Запись настроек профиля в файл (настройки других профилей сохраняются)"
+
+    profile = host_profile() if profile is None else profile
+
+    profiles = {}
+
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            profiles = json.load(f).get("profiles", {})
+
+    profiles[profile] = settings
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"profiles": profiles}, f, ensure_ascii=False, indent=2)
+
+    os.replace(tmp_path, path)
+
+
+# Настройки текущего хоста (читаются один раз при запуске)
+tuned = load_config()
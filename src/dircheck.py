@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import os
+import re
 from datetime import datetime
 from src.logger import logFile
 
@@ -30,7 +31,9 @@ def get_new_file_names(dir_in: str, dir_out: str, verbose: bool = False) -> list
 
     # Получить список файлов
     files_in = set([filename for filename in os.listdir(dir_in) if filename.split(".")[-1] in ["xls", "xlsx"]])
-    files_out = set([filename.replace("_check", "") for filename in os.listdir(dir_out)])
+    # обработанными считаются анкеты с книгой _check.xlsx или с файлом изменений _changes.jsonl / _changes.parquet
+    files_out = set([re.sub(r"_changes\.(jsonl|parquet)$", ".xlsx", filename.replace("_check", "")) 
+                     for filename in os.listdir(dir_out)])
 
     # Очистить список входящих файлов от открытых Экселей (в начале названия которых есть "~$")
     for filename in list(files_in):
@@ -0,0 +1,308 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+import time
+import torch
+from torch.optim import AdamW
+from transformers import M2M100Config, M2M100ForConditionalGeneration, M2M100Tokenizer, get_scheduler
+
+from src.logger import logFile
+from src.tokenizer_convert import form_texts, sample_texts
+
+
+# Пути
+path_to_tokenizer = "model/M2M100_tokenizer/"
+path_to_student = "model/M2M100_student/"
+path_to_pairs = "data/distill/pairs.jsonl"
+
+# Размер модели-ученика (small - для работы, tiny - для проверки на CPU)
+student_sizes = {"small": {"d_model": 256, "encoder_layers": 3, "decoder_layers": 3,
+                           "encoder_attention_heads": 4, "decoder_attention_heads": 4,
+                           "encoder_ffn_dim": 1024, "decoder_ffn_dim": 1024},
+                 "tiny": {"d_model": 64, "encoder_layers": 1, "decoder_layers": 1,
+                          "encoder_attention_heads": 2, "decoder_attention_heads": 2,
+                          "encoder_ffn_dim": 128, "decoder_ffn_dim": 128}}
+
+# Настройки обучения
+num_train_epochs = 5
+batch_size = 16
+learning_rate = 5e-04
+noise_rate = 0.05          # доля символов, искажаемых при аугментации
+noisy_copies = 2           # число искаженных копий исправленного текста
+max_length = 128
+
+cyrillic_letters = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+
+
+def add_noise(text: str, rate: float = noise_rate, rng: random.Random = random) -> str:
+
+    """
+    Искажение текста, похожее на опечатки в анкетах: замена, пропуск, удвоение буквы и перестановка соседних букв
+
+    Параметры:
+    text : str
+        Исходный (исправленный) текст
+    rate : float
+        Доля искажаемых символов
+
+    Возвращает:
+    noisy : str
+        Текст с опечатками
+    """
+
+    chars = list(text)
+    i = 0
+
+    while i < len(chars):
+
+        if chars[i].lower() in cyrillic_letters and rng.random() < rate:
+
+            kind = rng.choice(["replace", "delete", "double", "swap"])
+
+            if kind == "replace":
+                chars[i] = rng.choice(cyrillic_letters)
+            elif kind == "delete":
+                del chars[i]
+                continue
+            elif kind == "double":
+                chars.insert(i, chars[i])
+                i += 1
+            elif i + 1 < len(chars):
+                chars[i], chars[i + 1] = chars[i + 1], chars[i]
+                i += 1
+
+        i += 1
+
+    return "".join(chars)
+
+
+def build_pairs(texts: list, teacher_fn, noisy_copies: int = noisy_copies, rate: float = noise_rate,
+                batch_size: int = batch_size, seed: int = 0) -> list:
+
+    """
+    Обучающие пары для ученика: исходный текст и исправление учителя,
+    а также искаженные копии исправления (аугментация опечатками) с тем же ответом
+
+    Параметры:
+    texts : list of str
+        Тексты анкет и корпуса
+    teacher_fn : callable
+        Пакетная функция исправления учителя (list of str -> list of str)
+
+    Возвращает:
+    pairs : list of dict
+        Пары {"source": ..., "target": ...}
+    """
+
+    rng = random.Random(seed)
+    pairs = []
+
+    for i in range(0, len(texts), batch_size):
+
+        batch = texts[i:i+batch_size]
+
+        for source, target in zip(batch, teacher_fn(batch)):
+
+            pairs.append({"source": source, "target": target})
+            pairs += [{"source": add_noise(target, rate, rng), "target": target} for _ in range(noisy_copies)]
+
+    return pairs
+
+
+def make_student(tokenizer: M2M100Tokenizer, size: str = "small") -> M2M100ForConditionalGeneration:
+
+    "Модель-ученик M2M100 с тем же словарем, что и у учителя"
+
+    config = M2M100Config(vocab_size=len(tokenizer),
+                          max_position_embeddings=max_length * 2,
+                          pad_token_id=tokenizer.pad_token_id,
+                          bos_token_id=tokenizer.bos_token_id,
+                          eos_token_id=tokenizer.eos_token_id,
+                          decoder_start_token_id=tokenizer.eos_token_id,
+                          **student_sizes[size])
+
+    return M2M100ForConditionalGeneration(config)
+
+
+def _collate(pairs: list, tokenizer, lang_id: int) -> dict:
+
+    "Пакет для обучения: вход как при исправлении, метки - <код языка> исправление </s>"
+
+    encodings = tokenizer([pair["source"] for pair in pairs], return_tensors="pt", padding=True,
+                          truncation=True, max_length=max_length)
+
+    targets = [[lang_id] + tokenizer(pair["target"], add_special_tokens=False)["input_ids"][:max_length - 2]
+               + [tokenizer.eos_token_id] for pair in pairs]
+    length = max(len(target) for target in targets)
+
+    encodings["labels"] = torch.tensor([target + [-100] * (length - len(target)) for target in targets])
+
+    return encodings
+
+
+def train_student(model: M2M100ForConditionalGeneration, tokenizer, pairs: list,
+                  num_train_epochs: int = num_train_epochs, batch_size: int = batch_size,
+                  learning_rate: float = learning_rate, verbose: bool = False) -> M2M100ForConditionalGeneration:
+
+    """
+    Обучение ученика на парах (исходный текст, исправление учителя) - как в ноутбуке Model Training:
+    AdamW и косинусный планировщик
+
+    Возвращает:
+    model : M2M100ForConditionalGeneration
+        Обученная модель
+    """
+
+    lang_id = tokenizer.convert_tokens_to_ids("__ru__")
+
+    optimizer = AdamW(model.parameters(), lr=learning_rate, betas=(0.9, 0.999), eps=1e-08)
+
+    num_update_steps_per_epoch = math.ceil(len(pairs) / batch_size)
+    num_training_steps = num_train_epochs * num_update_steps_per_epoch
+
+    cos_scheduler = get_scheduler("cosine", optimizer=optimizer,
+                                  num_warmup_steps=int(0.1 * num_training_steps),
+                                  num_training_steps=num_training_steps)
+
+    rng = random.Random(0)
+
+    for epoch in range(num_train_epochs):
+
+        model.train()
+        order = list(range(len(pairs)))
+        rng.shuffle(order)
+        epoch_loss = 0
+
+        for i in range(0, len(order), batch_size):
+
+            batch = _collate([pairs[j] for j in order[i:i+batch_size]], tokenizer, lang_id)
+
+            loss = model(**batch).loss
+            loss.backward()
+
+            optimizer.step()
+            cos_scheduler.step()
+            optimizer.zero_grad()
+
+            epoch_loss += loss.item()
+
+        if verbose: print(f"epoch {epoch}: loss {epoch_loss / num_update_steps_per_epoch:.4f}")
+
+    model.eval()
+
+    return model
+
+
+@torch.no_grad()
+def agreement(model: M2M100ForConditionalGeneration, tokenizer, pairs: list, batch_size: int = batch_size) -> dict:
+
+    """
+    Доля исправлений ученика, совпадающих с исправлениями учителя, и время
+
+    Возвращает:
+    summary : dict
+        Доля совпадений и время исправления на текст
+    """
+
+    lang_id = tokenizer.convert_tokens_to_ids("__ru__")
+    n_equal = 0
+
+    start = time.perf_counter()
+
+    for i in range(0, len(pairs), batch_size):
+
+        batch = pairs[i:i+batch_size]
+        encodings = tokenizer([pair["source"] for pair in batch], return_tensors="pt", padding=True,
+                              truncation=True, max_length=max_length)
+
+        generated_tokens = model.generate(**encodings, forced_bos_token_id=lang_id, max_new_tokens=max_length, num_beams=1)
+        answers = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
+
+        n_equal += sum(re.sub('[a-zA-Z]+', '', answer).strip() == pair["target"] for answer, pair in zip(answers, batch))
+
+    return {"agreement": n_equal / max(1, len(pairs)),
+            "seconds_per_text": (time.perf_counter() - start) / max(1, len(pairs))}
+
+
+def read_pairs(path: str = path_to_pairs) -> list:
+
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+
+def write_pairs(pairs: list, path: str = path_to_pairs):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w", encoding="utf-8") as f:
+        for pair in pairs:
+            f.write(json.dumps(pair, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="Дистилляция модели исправления орфографии в компактную модель-ученика")
+    arg_parser.add_argument("command", choices=["pairs", "train", "all"],
+                            help="pairs - исправления учителя, train - обучение ученика, all - оба шага")
+    arg_parser.add_argument("--check-dir", default="data/raw", help="Папка с анкетами (тексты для дистилляции)")
+    arg_parser.add_argument("--corpus", default="", help="Текстовый файл с дополнительными текстами (по строке на текст)")
+    arg_parser.add_argument("--pairs", default=path_to_pairs)
+    arg_parser.add_argument("--tokenizer", default=path_to_tokenizer)
+    arg_parser.add_argument("--out", default=path_to_student)
+    arg_parser.add_argument("--size", choices=list(student_sizes), default="small")
+    arg_parser.add_argument("--epochs", type=int, default=num_train_epochs)
+    arg_parser.add_argument("--limit", type=int, default=0, help="Ограничение числа текстов (проверка на малом объеме)")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    log = logFile(operation = "Дистилляция модели исправления орфографии")
+
+    if args.command in ["pairs", "all"]:
+
+        # учитель загружается только для этого шага
+        from src.spellcheck import teacher_correct_batch
+
+        texts = sample_texts + (form_texts(args.check_dir) if os.path.isdir(args.check_dir) else [])
+
+        if args.corpus != "":
+            with open(args.corpus, encoding="utf-8") as f:
+                texts += [line.strip() for line in f if line.strip() != ""]
+
+        if args.limit > 0: texts = texts[:args.limit]
+
+        pairs = build_pairs(texts, teacher_correct_batch)
+        write_pairs(pairs, args.pairs)
+
+        msg = f"Исправления учителя: текстов {len(texts)}, пар {len(pairs)}, сохранены в {args.pairs}"
+        log.write_log(msg)
+        print(msg)
+
+    if args.command in ["train", "all"]:
+
+        tokenizer = M2M100Tokenizer.from_pretrained(args.tokenizer)
+        pairs = read_pairs(args.pairs)
+
+        if args.limit > 0: pairs = pairs[:args.limit * (noisy_copies + 1)]
+
+        # проверочная выборка - исходные тексты каждой десятой группы (текст и его искаженные копии) не участвуют в обучении
+        group = noisy_copies + 1
+        eval_pairs = [pairs[i] for i in range(0, len(pairs), group * 10)]
+        train_pairs = [pair for i, pair in enumerate(pairs) if (i // group) % 10 != 0] or pairs
+
+        model = make_student(tokenizer, args.size)
+        train_student(model, tokenizer, train_pairs, args.epochs, verbose = args.verbose)
+
+        model.save_pretrained(args.out)
+        tokenizer.save_pretrained(args.out)
+
+        summary = agreement(model, tokenizer, eval_pairs)
+
+        msg = (f"Ученик ({args.size}, {model.num_parameters() / 1e6:.1f} млн параметров) сохранен в {args.out}: "
+               f"совпадение с учителем {summary['agreement']:.0%}, {summary['seconds_per_text'] * 1000:.0f} мс на текст")
+        log.write_log(msg)
+        print(msg)
+
+    log.close()
@@ -0,0 +1,303 @@
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils.dataframe import dataframe_to_rows
+from copy import copy
+from concurrent.futures import Future
+
+
+# Шаблон анкеты для записи результатов
+template_file = "templates/form4.template.xlsx"
+
+# Имена колонок таблиц анкеты
+columns_sheet_1 = ["Вопрос", "Ответ"]
+
+columns_sheet_2 = ["Месяц и год поступления",
+                   "Месяц и год увольнения",
+                   "Должность с указанием наименования организации",
+                   "Адрес организации"]
+
+columns_sheet_3 = ["Степень родства",
+                   "Фамилия, имя и отчество",
+                   "Число, месяц, год и место рождения, гражданство",
+                   "Место работы, должность",
+                   "Адрес места жительства"]
+
+columns_sheet_4_1 = ["Степень родства",
+                     "Фамилия, имя и отчество",
+                     "Где проживает и период проживания за границей"]
+
+columns_sheet_4_2 = ["Период проживания начало",
+                     "Период проживания конец",
+                     "Адрес проживания и регистрации"]
+
+
+def read_form(path: str) -> list:
+
+    """
+    Чтение четырех листов анкеты
+
+    Параметры:
+    path : str
+        Путь к файлу анкеты
+
+    Возвращает:
+    data_sheets : list of pd.DataFrame
+        Листы анкеты без обработки
+    """
+
+    return [pd.read_excel(path, sheet_name=sheet_index) for sheet_index in range(4)]
+
+
+class FormTable:
+
+    """
+    Таблица раздела анкеты без pandas: имена колонок и списки значений по колонкам.
+
+    table[column] возвращает сам список значений колонки (без копирования): правила и модели
+    изменяют его на месте (table.map или запись table[column][row] = ...).
+    В pd.DataFrame таблица переводится только на границах (to_frame при записи в Excel)
+    """
+
+    __slots__ = ("columns", "data")
+
+    def __init__(self, columns: list, rows: list = ()):
+
+        self.columns = list(columns)
+
+        if len(rows) > 0 and len(rows[0]) != len(self.columns):
+            raise ValueError(f"Число колонок таблицы ({len(rows[0])}) не совпадает с числом имен ({len(self.columns)})")
+
+        self.data = [list(values) for values in zip(*rows)] if len(rows) > 0 else [[] for _ in self.columns]
+
+    def __len__(self) -> int:
+
+        return len(self.data[0]) if len(self.data) > 0 else 0
+
+    def __getitem__(self, column: str) -> list:
+
+        return self.data[self.columns.index(column)]
+
+    def __setitem__(self, column: str, values: list):
+
+        # замена содержимого, а не списка: ранее полученные представления колонки остаются актуальными
+        self.data[self.columns.index(column)][:] = values
+
+    def map(self, column: str, fn):
+
+        """
+        Применение функции к каждому значению колонки (на месте).
+        Функция может вернуть concurrent.futures.Future (ячейка поставлена в очередь, см. service):
+        результаты ожидаются после постановки всей колонки, поэтому ячейки колонки попадают в общие пакеты
+        """
+
+        values = self[column]
+        values[:] = [fn(value) for value in values]
+        values[:] = [value.result() if isinstance(value, Future) else value for value in values]
+
+    def rows(self) -> list:
+
+        return [list(row) for row in zip(*self.data)]
+
+    def to_frame(self) -> pd.DataFrame:
+
+        "Перевод в pd.DataFrame (значения - без приведения типов)"
+
+        return pd.DataFrame(dict(zip(self.columns, self.data)), columns=self.columns, dtype=object)
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> "FormTable":
+
+        return cls(frame.columns, frame.astype(object).values.tolist())
+
+    def __repr__(self) -> str:
+
+        return f"FormTable({len(self)} x {self.columns})"
+
+
+def as_table(table) -> FormTable:
+
+    "FormTable из pd.DataFrame (например, из промежуточных результатов, сохраненных до появления FormTable)"
+
+    return FormTable.from_frame(table) if isinstance(table, pd.DataFrame) else table
+
+
+def as_frame(table) -> pd.DataFrame:
+
+    return table.to_frame() if isinstance(table, FormTable) else table
+
+
+def _sheet_rows(sheet: pd.DataFrame) -> list:
+
+    "Строки листа списками значений (один перевод из pandas на лист)"
+
+    return sheet.astype(object).values.tolist()
+
+
+def _empty(value) -> bool:
+
+    return value is None or (not isinstance(value, str) and pd.isna(value))
+
+
+def split_sheet_1(sheet: pd.DataFrame) -> tuple:
+
+    "Лист 1: удаление пустот и разбиение на ФИО и ответы на пп. 2-13"
+
+    rows = [row for row in _sheet_rows(sheet)[2:] if not _empty(row[0])]
+
+    return FormTable(columns_sheet_1, rows[:3]), FormTable(columns_sheet_1, rows[3:])
+
+
+def split_sheet_2(sheet: pd.DataFrame) -> FormTable:
+
+    "Лист 2: удаление строк с пустотами"
+
+    return FormTable(columns_sheet_2, [row for row in _sheet_rows(sheet)[2:] if not any(map(_empty, row))])
+
+
+def split_sheet_3(sheet: pd.DataFrame) -> FormTable:
+
+    "Лист 3: удаление строк с пустотами"
+
+    return FormTable(columns_sheet_3, [row for row in _sheet_rows(sheet)[1:] if not any(map(_empty, row))])
+
+
+def split_sheet_4(sheet: pd.DataFrame) -> tuple:
+
+    "Лист 4: разбиение на таблицы п. 16 и п. 17 (до строки \"Дополнительные сведения\")"
+
+    rows = _sheet_rows(sheet)
+
+    stop_idx = [i for i, row in enumerate(rows) if isinstance(row[0], str) and "Дополнительные сведения" in row[0]][0]
+
+    return FormTable(columns_sheet_4_1, [row for row in rows[2:5] if not all(map(_empty, row))]), \
+           FormTable(columns_sheet_4_2, [row for row in rows[7:stop_idx] if not all(map(_empty, row))])
+
+
+def split_form(data_sheets: list) -> list:
+
+    """
+    Разбиение четырех листов анкеты на шесть таблиц (FormTable) в порядке записи в шаблон (см. save_to_excel):
+    ФИО, ответы на пп. 2-13, п. 14, п. 15, п. 16, п. 17
+    """
+
+    data_sheets_0_1, data_sheets_0_2 = split_sheet_1(data_sheets[0])
+    data_sheets_3_1, data_sheets_3_2 = split_sheet_4(data_sheets[3])
+
+    return [data_sheets_0_1, data_sheets_0_2, split_sheet_2(data_sheets[1]), split_sheet_3(data_sheets[2]),
+            data_sheets_3_1, data_sheets_3_2]
+
+
+def save_to_excel(df_list: list, filename: str, workdir: str = "data/", model_versions: str = "") -> str:
+
+    """
+    Функция для записи списка таблиц в шаблон Excel. 
+    На вход получает обработанный список из таблиц формы (FormTable или pd.DataFrame), список состоит из 6 элементов:
+     - 1-2 таблицы - Лист 1
+     - 3 таблица - Лист 2
+     - 4 таблица - Лист 3
+     - 5-6 таблицы - Лист 4
+    
+    Функция записывает данные таблицы в шаблон, хранящийся в директории templates
+    При необходимости, производится добавление строк (с копированием форматирования ячеек)
+    Версии моделей, обработавших анкету, записываются в свойства книги (Описание)
+
+    Возвращает:
+    output_file : str
+        Путь к записанному файлу
+    """
+
+    output_file = workdir + "processed/" + filename.replace(".xlsx", "") + "_check.xlsx"
+
+    df_list = [as_frame(table) for table in df_list]
+
+    wb = load_workbook(template_file)
+
+    # Запись первого листа
+    ws = wb['Лист1']
+
+    # Часть ФИО
+    rows = dataframe_to_rows(df_list[0][["Ответ"]], index=False, header=False)
+
+    for r_idx, row in enumerate(rows, 1):
+        for c_idx, value in enumerate(row, 1):
+            ws.cell(row=r_idx+3, column=c_idx+1, value=value)
+
+    # Часть ответа на вопросы
+    rows = dataframe_to_rows(df_list[1][["Ответ"]], index=False, header=False)
+
+    for r_idx, row in enumerate(rows, 1):
+        for c_idx, value in enumerate(row, 1):
+            ws.cell(row=r_idx+7, column=c_idx+1, value=value)
+
+    # Запись второго листа
+    ws = wb['Лист2']
+
+    rows = dataframe_to_rows(df_list[2], index=False, header=False)
+
+    for r_idx, row in enumerate(rows, 1):
+        for c_idx, value in enumerate(row, 1):
+            ws.cell(row=r_idx+3, column=c_idx, value=value)
+
+    # Запись третьего листа
+    ws = wb['Лист3']
+
+    rows = dataframe_to_rows(df_list[3], index=False, header=False)
+
+    for r_idx, row in enumerate(rows, 1):
+        for c_idx, value in enumerate(row, 1):
+            ws.cell(row=r_idx+2, column=c_idx, value=value)
+
+    # Запись четвертого листа
+    ws = wb['Лист4']
+
+    # определение количества строк в п. 17 - добавление строк при необходимости
+    if len(df_list[5]) > 11:
+        rows_to_add2 = len(df_list[5]) - 11
+        ws.insert_rows(20, rows_to_add2)
+    else:
+        rows_to_add2 = 0
+
+    # определение количества строк в п. 16 - добавление строк при необходимости
+    if len(df_list[4]) > 4:
+        rows_to_add1 = len(df_list[4]) - 4
+        ws.insert_rows(7, rows_to_add1)
+    else:
+        rows_to_add1 = 0
+
+    # сохранение стиля ячейки
+    cellstyle = {"fill": copy(ws.cell(4, 1).fill), 
+                "font": copy(ws.cell(4, 1).font), 
+                "number_format": copy(ws.cell(4, 1).number_format), 
+                "border": copy(ws.cell(4, 1).border)}
+
+    # запись п. 16
+    rows = dataframe_to_rows(df_list[4], index=False, header=False)
+
+    for r_idx, row in enumerate(rows, 1):
+        for c_idx, value in enumerate(row, 1):
+
+            # print(r_idx)
+
+            ws.cell(row=r_idx+3, column=c_idx).value = value
+            ws.cell(row=r_idx+3, column=c_idx).fill = (cellstyle['fill'])
+            ws.cell(row=r_idx+3, column=c_idx).font = (cellstyle['font'])
+            ws.cell(row=r_idx+3, column=c_idx).number_format = (cellstyle['number_format'])
+            ws.cell(row=r_idx+3, column=c_idx).border = (cellstyle['border'])
+
+    # запись п. 17
+    rows = dataframe_to_rows(df_list[5], index=False, header=False)
+
+    for r_idx, row in enumerate(rows, 1):
+        for c_idx, value in enumerate(row, 1):
+            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).value = value
+            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).fill = (cellstyle['fill'])
+            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).font = (cellstyle['font'])
+            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).number_format = (cellstyle['number_format'])
+            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).border = (cellstyle['border'])
+
+    if model_versions != "": wb.properties.description = "Версии моделей: " + model_versions
+
+    wb.save(output_file)
+    wb.close()
+
+    return output_file
@@ -0,0 +1,520 @@
+import os
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from abc import ABC, abstractmethod
+
+from src import metrics
+from src.logger import logFile
+from src.dircheck import get_new_file_names
+from src.scheduler import schedule, default_priority, aging_seconds
+from src.config import tuned, threads_per_worker
+
+
+# Настройки очереди
+queue_path = "data/queue.sqlite"
+lease_seconds = 600
+heartbeat_interval = 60
+poll_interval = 5
+max_attempts = 3
+
+# Статусы анкет в очереди (для метрик - с нулевыми значениями)
+job_statuses = ["queued", "leased", "done", "dead"]
+
+
+class JobQueue(ABC):
+
+    """
+    Интерфейс очереди анкет на обработку.
+
+    Анкета выдается исполнителю в аренду (lease) на lease_seconds секунд. Исполнитель продлевает
+    аренду (heartbeat), пока обрабатывает анкету. Если аренда истекла (исполнитель упал или завис),
+    анкета снова становится доступной другим исполнителям (visibility timeout). Анкета, обработка
+    которой завершилась ошибкой max_attempts раз, переводится в dead letter и больше не выдается.
+
+    Порядок выдачи: приоритет (0 - срочно) с повышением на 1 за каждые aging_seconds ожидания,
+    внутри приоритета - кратчайшая анкета первой (см. модуль scheduler).
+
+    Реализация хранилища подключается через наследование (см. SQLiteJobQueue): все методы абстрактные.
+    """
+
+    @abstractmethod
+    def enqueue(self, filename: str, priority: int = default_priority, cost: float = 0, submitted_at: float = None) -> bool:
+
+        """
+        Добавить анкету в очередь; False, если анкета уже есть в очереди.
+        Анкеты выдаются по приоритету с учетом ожидания (см. scheduler), внутри приоритета - по оценке времени cost
+        """
+
+    @abstractmethod
+    def lease(self, worker_id: str, lease_seconds: float = lease_seconds) -> dict:
+
+        "Взять следующую анкету в аренду; None, если очередь пуста"
+
+    @abstractmethod
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: float = lease_seconds) -> bool:
+
+        "Продлить аренду; False, если аренда потеряна (истекла и выдана другому исполнителю)"
+
+    @abstractmethod
+    def complete(self, job_id: int, worker_id: str) -> bool:
+
+        "Отметить анкету как обработанную; False, если аренда потеряна (анкета не отмечается)"
+
+    @abstractmethod
+    def fail(self, job_id: int, worker_id: str, error: str = "") -> str:
+
+        "Отметить ошибку обработки; возвращает новый статус анкеты (queued или dead), None - анкеты нет в очереди"
+
+    @abstractmethod
+    def counts(self) -> dict:
+
+        "Число анкет по статусам"
+
+    @abstractmethod
+    def dead_letters(self) -> list:
+
+        "Анкеты, переведенные в dead letter"
+
+
+class SQLiteJobQueue(JobQueue):
+
+    """
+    Очередь анкет в SQLite. Файл базы может лежать на общем томе, доступном нескольким хостам.
+    Все изменения выполняются в транзакциях BEGIN IMMEDIATE, поэтому одна анкета не может быть
+    выдана двум исполнителям одновременно. Режим WAL не используется: он не работает на сетевых
+    файловых системах.
+    """
+
+    def __init__(self, path: str = queue_path, max_attempts: int = max_attempts):
+
+        self.path = path
+        self.max_attempts = max_attempts
+
+        with self._connect() as conn:
+
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                filename TEXT NOT NULL UNIQUE,
+                                status TEXT NOT NULL DEFAULT 'queued',
+                                attempts INTEGER NOT NULL DEFAULT 0,
+                                worker TEXT,
+                                lease_until REAL,
+                                enqueued_at REAL NOT NULL,
+                                updated_at REAL NOT NULL,
+                                last_error TEXT,
+                                priority INTEGER NOT NULL DEFAULT 1,
+                                cost REAL NOT NULL DEFAULT 0,
+                                submitted_at REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+            # базы, созданные до появления приоритетов
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+
+            for column, definition in [("priority", "INTEGER NOT NULL DEFAULT 1"),
+                                       ("cost", "REAL NOT NULL DEFAULT 0"),
+                                       ("submitted_at", "REAL")]:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    def _connect(self) -> "_Transaction":
+
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+
+        return _Transaction(conn)
+
+    def enqueue(self, filename: str, priority: int = default_priority, cost: float = 0, submitted_at: float = None) -> bool:
+
+        now = time.time()
+
+        with self._connect() as conn:
+            cursor = conn.execute("""INSERT OR IGNORE INTO jobs (filename, enqueued_at, updated_at, priority, cost, submitted_at)
+                                     VALUES (?, ?, ?, ?, ?, ?)""",
+                                  (filename, now, now, priority, cost, submitted_at if submitted_at is not None else now))
+
+        return cursor.rowcount == 1
+
+    def _expire_leases(self, conn: sqlite3.Connection, now: float):
+
+        "Возврат в очередь анкет с истекшей арендой (или в dead letter, если попытки исчерпаны)"
+
+        conn.execute("""UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'queued' END,
+                                        worker = NULL, lease_until = NULL, updated_at = ?,
+                                        last_error = 'Аренда истекла'
+                        WHERE status = 'leased' AND lease_until < ?""", (self.max_attempts, now, now))
+
+    def lease(self, worker_id: str, lease_seconds: float = lease_seconds) -> dict:
+
+        now = time.time()
+
+        with self._connect() as conn:
+
+            self._expire_leases(conn, now)
+
+            row = conn.execute("""SELECT * FROM jobs WHERE status = 'queued'
+                                  ORDER BY MAX(0, priority - CAST((? - COALESCE(submitted_at, enqueued_at)) / ? AS INTEGER)),
+                                           cost, COALESCE(submitted_at, enqueued_at), id
+                                  LIMIT 1""", (now, aging_seconds)).fetchone()
+
+            if row is None: return None
+
+            conn.execute("""UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?,
+                                            attempts = attempts + 1, updated_at = ?
+                            WHERE id = ?""", (worker_id, now + lease_seconds, now, row["id"]))
+
+        job = dict(row)
+        job["attempts"] += 1
+
+        return job
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: float = lease_seconds) -> bool:
+
+        now = time.time()
+
+        with self._connect() as conn:
+            cursor = conn.execute("""UPDATE jobs SET lease_until = ?, updated_at = ?
+                                     WHERE id = ? AND worker = ? AND status = 'leased'""",
+                                  (now + lease_seconds, now, job_id, worker_id))
+
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str) -> bool:
+
+        with self._connect() as conn:
+            cursor = conn.execute("""UPDATE jobs SET status = 'done', lease_until = NULL, updated_at = ?
+                                     WHERE id = ? AND worker = ? AND status = 'leased'""",
+                                  (time.time(), job_id, worker_id))
+
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str = "") -> str:
+
+        with self._connect() as conn:
+
+            conn.execute("""UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'queued' END,
+                                            worker = NULL, lease_until = NULL, updated_at = ?, last_error = ?
+                            WHERE id = ? AND worker = ? AND status = 'leased'""",
+                         (self.max_attempts, time.time(), error, job_id, worker_id))
+
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        return None if row is None else row["status"]
+
+    def counts(self) -> dict:
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+
+        return {row["status"]: row["n"] for row in rows}
+
+    def dead_letters(self) -> list:
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE status = 'dead' ORDER BY id").fetchall()
+
+        return [dict(row) for row in rows]
+
+
+class _Transaction:
+
+    "Соединение SQLite как контекстный менеджер: BEGIN IMMEDIATE / COMMIT (ROLLBACK при ошибке) и закрытие"
+
+    def __init__(self, conn: sqlite3.Connection):
+
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+
+        self.conn.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        self.conn.close()
+
+
+def scan(queue: JobQueue, dir_in: str = "data/raw", dir_out: str = "data/processed", verbose: bool = False) -> int:
+
+    """
+    Добавление новых анкет из папки ввода в очередь с приоритетом и оценкой времени из scheduler
+
+    Параметры:
+    queue : JobQueue
+        Очередь
+    dir_in, dir_out : str
+        Папки ввода и вывода (см. get_new_file_names)
+
+    Возвращает:
+    n_added : int
+        Число добавленных анкет
+    """
+
+    plan = schedule(get_new_file_names(dir_in, dir_out, verbose), dir_in, n_workers = tuned["n_workers"])
+
+    # submitted - локальное время из имени файла: pd.Timestamp.timestamp() считал бы его UTC,
+    # а lease сравнивает submitted_at с time.time()
+    n_added = sum(queue.enqueue(row.filename, row.priority, row.est_seconds, row.submitted.to_pydatetime().timestamp())
+                  for row in plan.itertuples())
+
+    if verbose: print(f"Добавлено в очередь: {n_added}")
+
+    return n_added
+
+
+def export_counts(queue: JobQueue) -> dict:
+
+    "Число анкет по статусам в метрики: etl_jobs{status=...} и глубина очереди etl_queue_depth{queue=\"forms\"}"
+
+    counts = queue.counts()
+
+    for status in job_statuses:
+        metrics.jobs.set(counts.get(status, 0), status=status)
+
+    metrics.queue_depth.set(counts.get("queued", 0), queue="forms")
+
+    return counts
+
+
+def run_worker(queue: JobQueue,
+               workdir: str = "data/",
+               worker_id: str = "",
+               lease_seconds: float = lease_seconds,
+               heartbeat_interval: float = heartbeat_interval,
+               poll_interval: float = poll_interval,
+               exit_when_empty: bool = False,
+               budget_seconds: float = None,
+               output_format: str = "xlsx",
+               metrics_port: int = None,
+               metrics_textfile: str = "",
+               torch_threads: int = None,
+               verbose: bool = False) -> int:
+
+    """
+    Цикл исполнителя: взять анкету в аренду, обработать file_processor, отметить результат.
+    Пока анкета обрабатывается, аренда продлевается в фоновом потоке.
+    Несколько исполнителей (процессов или хостов) могут работать с одной очередью.
+
+    Параметры:
+    queue : JobQueue
+        Очередь
+    workdir : str
+        Рабочая директория (общая для всех исполнителей)
+    worker_id : str
+        Имя исполнителя (по умолчанию - хост и PID)
+    exit_when_empty : bool
+        Завершить работу, когда очередь пуста (иначе - ожидать новые анкеты)
+    budget_seconds : float
+        Бюджет времени на анкету (см. file_processor)
+    output_format : str
+        Формат результата: xlsx, jsonl или parquet (см. file_processor)
+    metrics_port : int
+        Порт HTTP-эндпоинта /metrics (None - не запускать)
+    metrics_textfile : str
+        Файл метрик для textfile-коллектора node_exporter, обновляется после каждой анкеты 
+        и при ожидании новых анкет ("" - не записывать)
+    torch_threads : int
+        Число потоков torch процесса (None - подобранное для хоста, см. модуль config)
+
+    Возвращает:
+    n_done : int
+        Число обработанных анкет
+    """
+
+    # модели загружаются только в процессе исполнителя
+    from src.processor import file_processor
+    from src.spellcheck import registry, init_threads
+
+    init_threads(torch_threads)
+
+    if worker_id == "": worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    log = logFile(operation = f"Исполнитель {worker_id}")
+
+    # новые версии моделей загружаются в фоне и подменяются без остановки исполнителя
+    registry.log = log
+    registry.watch()
+    n_done = 0
+
+    if metrics_port is not None: metrics.start_http_server(metrics_port)
+
+    def publish_metrics():
+        export_counts(queue)
+        if metrics_textfile != "": metrics.write_textfile(metrics_textfile)
+
+    while True:
+
+        job = queue.lease(worker_id, lease_seconds)
+        publish_metrics()
+
+        if job is None:
+
+            if exit_when_empty: break
+
+            time.sleep(poll_interval)
+            continue
+
+        msg = f"{job['filename']}: взята в обработку (попытка {job['attempts']})"
+        log.write_log(msg)
+        if verbose: print(msg)
+
+        # продление аренды во время обработки
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def keep_alive():
+            while not stop.wait(heartbeat_interval):
+                if not queue.heartbeat(job["id"], worker_id, lease_seconds):
+                    lost.set()
+                    log.write_log(f"{job['filename']}: аренда потеряна", content = "ERR")
+                    return
+
+        heartbeat_thread = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat_thread.start()
+
+        error = None
+
+        try:
+            file_processor(job["filename"], workdir = workdir, logfile = os.path.basename(log.log_filename),
+                           verbose = verbose, budget_seconds = budget_seconds, output_format = output_format)
+
+        except Exception as e:
+            error = e
+
+        stop.set()
+        heartbeat_thread.join()
+
+        # аренда потеряна - анкета выдана другому исполнителю: ни результат, ни ошибка этого исполнителя не учитываются
+        # (complete и fail для чужой аренды не меняют статус анкеты)
+        if lost.is_set() or (error is None and not queue.complete(job["id"], worker_id)):
+
+            msg = f"{job['filename']}: аренда потеряна во время обработки, результат не засчитан (анкету обрабатывает другой исполнитель)"
+            log.write_log(msg, content = "ERR")
+            if verbose: print(msg)
+
+        elif error is not None:
+
+            status = queue.fail(job["id"], worker_id, repr(error))
+
+            msg = f"{job['filename']}: ошибка обработки, статус {status}: {error!r}"
+            log.write_log(msg, content = "ERR")
+            if verbose: print(msg)
+
+        else:
+
+            n_done += 1
+
+            msg = f"{job['filename']}: обработана"
+            log.write_log(msg)
+            if verbose: print(msg)
+
+        publish_metrics()
+
+    registry.log = None
+    log.close()
+
+    return n_done
+
+
+def _worker_process(path: str, max_attempts: int, kwargs: dict):
+
+    "Процесс-исполнитель: собственное подключение к очереди и собственная копия моделей"
+
+    run_worker(SQLiteJobQueue(path, max_attempts), **kwargs)
+
+
+def _process_kwargs(kwargs: dict, i: int, worker_id: str) -> dict:
+
+    "Параметры run_worker для i-го процесса: свои имя исполнителя, порт и файл метрик"
+
+    process_kwargs = dict(kwargs, worker_id = f"{worker_id}-{i}" if worker_id != "" else "")
+
+    if kwargs.get("metrics_port") is not None:
+        process_kwargs["metrics_port"] = kwargs["metrics_port"] + i
+
+    if kwargs.get("metrics_textfile", "") != "":
+        root, ext = os.path.splitext(kwargs["metrics_textfile"])
+        process_kwargs["metrics_textfile"] = f"{root}-{i}{ext}"
+
+    return process_kwargs
+
+
+def run_workers(path: str = queue_path, n_workers: int = tuned["n_workers"], max_attempts: int = max_attempts,
+                worker_id: str = "", **kwargs):
+
+    """
+    Запуск n_workers процессов-исполнителей с одной очередью (число по умолчанию подбирается 
+    модулем autotune для хоста, см. модуль config). Процессы запускаются методом spawn: 
+    модели загружаются в каждом процессе, потоки torch делятся между процессами настройкой torch_threads
+    (при числе процессов, отличном от подобранного, - поровну между n_workers процессами)
+
+    Параметры:
+    path : str
+        Путь к базе очереди
+    n_workers : int
+        Число процессов
+    kwargs
+        Параметры run_worker (порт метрик i-го процесса - metrics_port + i, файл метрик - с суффиксом -i)
+    """
+
+    if n_workers != tuned["n_workers"]: kwargs.setdefault("torch_threads", threads_per_worker(n_workers))
+
+    if n_workers <= 1:
+        run_worker(SQLiteJobQueue(path, max_attempts), worker_id = worker_id, **kwargs)
+        return
+
+    context = multiprocessing.get_context("spawn")
+
+    processes = [context.Process(target=_worker_process,
+                                 args=(path, max_attempts, _process_kwargs(kwargs, i, worker_id)),
+                                 name=f"worker-{i}")
+                 for i in range(n_workers)]
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="Очередь анкет для нескольких исполнителей")
+    arg_parser.add_argument("command", choices=["scan", "work", "status"])
+    arg_parser.add_argument("--queue", default=queue_path, help="Путь к базе очереди")
+    arg_parser.add_argument("--workdir", default="data/")
+    arg_parser.add_argument("--worker-id", default="")
+    arg_parser.add_argument("--workers", type=int, default=tuned["n_workers"], help="Число процессов-исполнителей")
+    arg_parser.add_argument("--max-attempts", type=int, default=max_attempts)
+    arg_parser.add_argument("--lease-seconds", type=float, default=lease_seconds)
+    arg_parser.add_argument("--exit-when-empty", action="store_true")
+    arg_parser.add_argument("--budget", type=float, default=None, help="Бюджет времени на анкету, с")
+    arg_parser.add_argument("--output-format", choices=["xlsx", "jsonl", "parquet"], default="xlsx")
+    arg_parser.add_argument("--metrics-port", type=int, default=None, help="Порт эндпоинта /metrics исполнителя")
+    arg_parser.add_argument("--metrics-textfile", default="", help="Файл метрик для textfile-коллектора node_exporter")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    queue = SQLiteJobQueue(args.queue, args.max_attempts)
+
+    if args.command == "scan":
+        scan(queue, args.workdir + "raw", args.workdir + "processed", args.verbose)
+
+    elif args.command == "work":
+        run_workers(args.queue, args.workers, args.max_attempts, args.worker_id, 
+                    workdir = args.workdir, lease_seconds = args.lease_seconds,
+                    exit_when_empty = args.exit_when_empty, budget_seconds = args.budget,
+                    output_format = args.output_format, metrics_port = args.metrics_port,
+                    metrics_textfile = args.metrics_textfile, verbose = args.verbose)
+
+    else:
+        print(export_counts(queue))
+
+        if args.metrics_textfile != "": metrics.write_textfile(args.metrics_textfile)
+
+        for job in queue.dead_letters():
+            print(f"dead: {job['filename']} ({job['attempts']} попыток): {job['last_error']}")
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import os
+import threading
 from datetime import datetime
 
 log_dir = "logs/"
@@ -38,6 +39,9 @@ class logFile:
         
         self.logfile = open(self.log_filename, mode, encoding = "utf-8")
 
+        # запись в лог возможна из нескольких потоков (листы анкеты обрабатываются одновременно)
+        self.lock = threading.Lock()
+
         # print(os.path.abspath(self.log_filename))
         
         self.operation = operation
@@ -50,7 +54,8 @@ class logFile:
         
         now_string = "[" + datetime.now().strftime("%d-%m-%Y %H:%M:%S") + f"][{content}]: "
 
-        self.logfile.write(now_string + message + "\n")
+        with self.lock:
+            self.logfile.write(now_string + message + "\n")
 
     def close(self):
 
@@ -0,0 +1,285 @@
+import os
+import time
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Настройки
+metrics_port = 9108
+textfile_path = "logs/metrics.prom"
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+tokens_buckets = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _format_labels(labels: tuple) -> str:
+
+    if len(labels) == 0: return ""
+
+    escaped = [(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels]
+
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Metric:
+
+    """
+    Базовый класс метрики: хранит значения по наборам меток, потокобезопасен
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, description: str):
+
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def header(self) -> list:
+
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+
+    "Монотонно растущий счетчик"
+
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+
+        key = tuple(sorted(labels.items()))
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def expose(self) -> list:
+
+        with self.lock:
+            return self.header() + [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+
+    "Значение, которое может как расти, так и уменьшаться"
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+
+        key = tuple(sorted(labels.items()))
+
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+
+    "Гистограмма наблюдений с накопительными корзинами (как в Prometheus)"
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: tuple = latency_buckets):
+
+        super().__init__(name, description)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+
+        key = tuple(sorted(labels.items()))
+
+        with self.lock:
+
+            counts, total, n = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: counts[i] += 1
+
+            self.values[key] = (counts, total + value, n + 1)
+
+    def time(self, **labels):
+
+        "Контекстный менеджер для замера длительности блока кода"
+
+        return _Timer(self, labels)
+
+    def expose(self) -> list:
+
+        lines = self.header()
+
+        with self.lock:
+
+            for key, (counts, total, n) in self.values.items():
+
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {n}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+
+        return lines
+
+
+class _Timer:
+
+    def __init__(self, histogram: Histogram, labels: dict):
+
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+# Метрики ETL
+
+forms_processed = Counter("etl_forms_processed_total", "Число успешно обработанных анкет")
+forms_failed = Counter("etl_forms_failed_total", "Число анкет, обработка которых завершилась ошибкой")
+cells_spellchecked = Counter("etl_cells_spellchecked_total", "Число ячеек, прошедших проверку орфографии (ячейка - один раз, даже если разбита на части)")
+ner_calls = Counter("etl_ner_calls_total", "Число вызовов NER-моделей")
+cache_hits = Counter("etl_cache_hits_total", "Число попаданий в кэш")
+cells_routed = Counter("etl_cells_routed_total", "Число ячеек по маршрутам перед проверкой орфографии")
+cells_escalated = Counter("etl_cells_escalated_total", "Число ячеек, переданных от модели-ученика исходной модели")
+cells_degraded = Counter("etl_cells_degraded_total", "Число ячеек, обработанных с деградацией из-за бюджета времени")
+model_reloads = Counter("etl_model_reloads_total", "Число замен версии модели без остановки процесса")
+
+stage_latency = Histogram("etl_stage_latency_seconds", "Длительность этапов обработки анкеты")
+model_latency = Histogram("etl_model_latency_seconds", "Длительность вызова модели")
+tokens_generated = Histogram("etl_tokens_generated", "Число сгенерированных токенов на ячейку", tokens_buckets)
+
+model_loaded = Gauge("etl_model_loaded", "Признак загрузки модели в память (1 - загружена)")
+model_version = Gauge("etl_model_version", "Текущая версия модели (1 - используется)")
+process_rss = Gauge("etl_process_resident_memory_bytes", "Резидентная память процесса")
+queue_depth = Gauge("etl_queue_depth", "Число элементов в очереди на обработку")
+jobs = Gauge("etl_jobs", "Число анкет в очереди исполнителей по статусам")
+
+registry = [forms_processed, forms_failed, cells_spellchecked, ner_calls, cache_hits, cells_routed, cells_escalated,
+            cells_degraded, model_reloads, stage_latency, model_latency, tokens_generated, model_loaded, model_version,
+            process_rss, queue_depth, jobs]
+
+
+def get_rss() -> int:
+
+    "Текущий объем резидентной памяти процесса в байтах"
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    except (OSError, ValueError):
+
+        # не Linux: пиковое значение (в Linux - КБ, в macOS - байты)
+        import resource
+        import sys
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+def expose() -> str:
+
+    """
+    Формирование всех метрик в текстовом формате Prometheus
+
+    Возвращает:
+    text : str
+        Текст для отдачи по HTTP или записи в файл textfile-коллектора
+    """
+
+    process_rss.set(get_rss())
+
+    lines = []
+
+    for metric in registry:
+        lines += metric.expose()
+
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str = textfile_path):
+
+    """
+    Запись метрик в файл для textfile-коллектора node_exporter.
+    Файл записывается атомарно (через временный файл и переименование)
+    """
+
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(expose())
+
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        content = expose().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int = metrics_port, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+
+    """
+    Запуск HTTP-эндпоинта /metrics в фоновом потоке
+
+    Параметры:
+    port : int
+        Порт
+    host : str
+        Адрес
+
+    Возвращает:
+    server : ThreadingHTTPServer
+        Сервер (для остановки через server.shutdown())
+    """
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+
+    return server
+
+
+def track_form(func):
+
+    "Декоратор для обработчика анкеты: учет успешно обработанных и упавших анкет и общей длительности"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+
+        try:
+            with stage_latency.time(stage="form"):
+                result = func(*args, **kwargs)
+
+        except Exception:
+            forms_failed.inc()
+            raise
+
+        forms_processed.inc()
+
+        return result
+
+    return wrapper
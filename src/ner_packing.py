@@ -0,0 +1,222 @@
+import argparse
+import time
+import numpy as np
+import torch
+import pandas as pd
+
+
+# Настройки
+packed_max_length = 512      # длина упакованной последовательности (не больше max_position_embeddings модели)
+packs_per_batch = 8          # число упакованных последовательностей в одном вызове модели
+
+
+def pack_segments(lengths: list, max_length: int = packed_max_length) -> list:
+
+    """
+    Распределение частей по упакованным последовательностям: части добавляются по порядку,
+    пока суммарная длина не превышает max_length
+
+    Параметры:
+    lengths : list of int
+        Длины частей в токенах (со служебными токенами [CLS] и [SEP])
+    max_length : int
+        Максимальная длина упакованной последовательности
+
+    Возвращает:
+    packs : list of list of int
+        Номера частей в каждой упакованной последовательности
+    """
+
+    packs = []
+    pack_length = max_length
+
+    for i, length in enumerate(lengths):
+
+        if pack_length + length > max_length:
+            packs.append([])
+            pack_length = 0
+
+        packs[-1].append(i)
+        pack_length += length
+
+    return packs
+
+
+def _pack_inputs(encodings: dict, packs: list, pad_token_id: int) -> dict:
+
+    """
+    Входы модели для упакованных последовательностей: части записываются подряд,
+    маска внимания - блочно-диагональная (токен видит только токены своей части),
+    позиции в каждой части начинаются с нуля - как при отдельном вызове для каждой части
+    """
+
+    length = max(sum(len(encodings["input_ids"][i]) for i in pack) for pack in packs)
+
+    input_ids = torch.full((len(packs), length), pad_token_id, dtype=torch.long)
+    position_ids = torch.zeros((len(packs), length), dtype=torch.long)
+    attention_mask = torch.zeros((len(packs), length, length), dtype=torch.long)
+
+    for row, pack in enumerate(packs):
+
+        start = 0
+
+        for i in pack:
+
+            end = start + len(encodings["input_ids"][i])
+
+            input_ids[row, start:end] = torch.tensor(encodings["input_ids"][i])
+            position_ids[row, start:end] = torch.arange(end - start)
+            attention_mask[row, start:end, start:end] = 1
+
+            start = end
+
+    inputs = {"input_ids": input_ids, "attention_mask": attention_mask, "position_ids": position_ids}
+
+    # у всех частей один сегмент (token_type_ids = 0), как при отдельном вызове
+    if "token_type_ids" in encodings:
+        inputs["token_type_ids"] = torch.zeros_like(input_ids)
+
+    return inputs
+
+
+@torch.no_grad()
+def packed_token_classification(token_classifier, texts: list, max_length: int = packed_max_length,
+                                packs_per_batch: int = packs_per_batch) -> list:
+
+    """
+    Замена вызова token_classifier(texts) для множества коротких текстов: тексты упаковываются
+    в общие последовательности (pack_segments, _pack_inputs), модель вызывается для нескольких
+    упакованных последовательностей сразу, затем логиты каждого текста разбираются тем же
+    кодом пайплайна (gather_pre_entities, aggregate), что и при обычном вызове.
+    Сущности, их границы start/end и слова совпадают с обычным вызовом; score - с точностью до округления
+
+    Параметры:
+    token_classifier : TokenClassificationPipeline
+        NER-пайплайн с быстрым токенизатором (нужны границы токенов в тексте)
+    texts : list of str
+        Тексты (части адресов)
+    max_length : int
+        Максимальная длина упакованной последовательности
+
+    Возвращает:
+    entities : list of list of dict
+        Сущности для каждого текста - как у token_classifier(texts)
+    """
+
+    tokenizer = token_classifier.tokenizer
+    model = token_classifier.model
+
+    # без границ токенов в тексте сущности не сопоставить с частями - обычный вызов
+    if not tokenizer.is_fast: return token_classifier(list(texts))
+
+    aggregation_strategy = token_classifier._postprocess_params.get("aggregation_strategy")
+    ignore_labels = token_classifier._postprocess_params.get("ignore_labels") or ["O"]
+
+    max_length = min(max_length, tokenizer.model_max_length, model.config.max_position_embeddings)
+
+    # тексты токенизируются так же, как в пайплайне, но без дополнения до общей длины
+    encodings = tokenizer(list(texts), truncation=True, max_length=max_length,
+                          return_special_tokens_mask=True, return_offsets_mapping=True)
+
+    packs = pack_segments([len(input_ids) for input_ids in encodings["input_ids"]], max_length)
+
+    entities = [None] * len(texts)
+
+    for i in range(0, len(packs), packs_per_batch):
+
+        batch_packs = packs[i:i+packs_per_batch]
+
+        inputs = _pack_inputs(encodings, batch_packs, tokenizer.pad_token_id or 0)
+        logits = model(**{key: value.to(model.device) for key, value in inputs.items()})[0].float().cpu().numpy()
+
+        for row, pack in enumerate(batch_packs):
+
+            start = 0
+
+            for j in pack:
+
+                end = start + len(encodings["input_ids"][j])
+
+                # вероятности - как в TokenClassificationPipeline.postprocess
+                segment_logits = logits[row, start:end]
+                shifted_exp = np.exp(segment_logits - np.max(segment_logits, axis=-1, keepdims=True))
+                scores = shifted_exp / shifted_exp.sum(axis=-1, keepdims=True)
+
+                pre_entities = token_classifier.gather_pre_entities(texts[j],
+                                                                    torch.tensor(encodings["input_ids"][j]),
+                                                                    scores,
+                                                                    torch.tensor(encodings["offset_mapping"][j]),
+                                                                    np.array(encodings["special_tokens_mask"][j]),
+                                                                    aggregation_strategy)
+
+                entities[j] = [entity for entity in token_classifier.aggregate(pre_entities, aggregation_strategy)
+                               if entity.get("entity", None) not in ignore_labels
+                               and entity.get("entity_group", None) not in ignore_labels]
+
+                start = end
+
+    return entities
+
+
+def _entity_keys(entities: list) -> list:
+
+    return [(entity.get("entity_group", entity.get("entity")), entity["word"], entity["start"], entity["end"])
+            for entity in entities]
+
+
+def compare(token_classifier, texts: list, max_length: int = packed_max_length) -> dict:
+
+    """
+    Сравнение упакованного вызова NER с обычным: время, доля дополняющих токенов и совпадение сущностей
+
+    Возвращает:
+    summary : dict
+        Время обоих вызовов, доля дополняющих токенов, число различающихся текстов и наибольшее расхождение score
+    """
+
+    start = time.perf_counter()
+    plain = token_classifier(list(texts))
+    time_plain = time.perf_counter() - start
+
+    start = time.perf_counter()
+    packed = packed_token_classification(token_classifier, texts, max_length)
+    time_packed = time.perf_counter() - start
+
+    lengths = [len(input_ids) for input_ids in token_classifier.tokenizer(list(texts), truncation=True)["input_ids"]]
+    packs = pack_segments(lengths, max_length)
+
+    # упакованные последовательности одного вызова модели дополняются до самой длинной из них
+    padded = sum(max(sum(lengths[j] for j in pack) for pack in packs[i:i+packs_per_batch]) * len(packs[i:i+packs_per_batch])
+                 for i in range(0, len(packs), packs_per_batch))
+
+    score_diff = [abs(a["score"] - b["score"]) for plain_entities, packed_entities in zip(plain, packed)
+                  for a, b in zip(plain_entities, packed_entities)]
+
+    return {"texts": len(texts),
+            "packs": len(packs),
+            "time_plain": time_plain,
+            "time_packed": time_packed,
+            # в пайплайне части обрабатываются по одной: дополнения нет, но каждая часть - отдельный вызов модели
+            "padding_packed": 1 - sum(lengths) / max(1, padded),
+            "mismatched": sum(_entity_keys(a) != _entity_keys(b) for a, b in zip(plain, packed)),
+            "max_score_diff": max(score_diff, default=0.0)}
+
+
+if __name__ == "__main__":
+
+    from src.tokenizer_convert import form_texts
+
+    arg_parser = argparse.ArgumentParser(description="Сравнение упакованного вызова NER для адресов с обычным")
+    arg_parser.add_argument("--check-dir", default="data/raw", help="Папка с анкетами")
+    arg_parser.add_argument("--max-length", type=int, default=packed_max_length)
+    arg_parser.add_argument("--limit", type=int, default=500)
+    args = arg_parser.parse_args()
+
+    from src.spellcheck import registry
+
+    segments = [segment for text in form_texts(args.check_dir) for segment in text.strip().split(", ")][:args.limit]
+
+    with registry.acquire("ner_addresses") as token_classifier:
+        summary = compare(token_classifier, segments, args.max_length)
+
+    print(pd.Series(summary).to_string())
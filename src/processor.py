@@ -2,370 +2,365 @@ import pandas as pd
 import numpy as np
 import os
 import re
-import locale
-import pymorphy3
-from dateutil import parser
-from datetime import datetime
+import time
 from openpyxl import Workbook, load_workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
 from copy import copy
+from concurrent.futures import ThreadPoolExecutor
 
+from src import metrics, spellcheck
 from src.logger import logFile
-from src.utilities import RussianParserInfo
-from src.spellcheck import correct_errors, name_reconstruct, address_reconstruct
+from src.checkpoint import StageCheckpoint
+from src.budget import FormBudget, BudgetExceeded
+from src.form import FormTable, as_table, read_form, split_sheet_1, split_sheet_2, split_sheet_3, split_sheet_4, split_form, \
+    save_to_excel
+from src.changeset import OUTPUT_XLSX, CellTrace, PATH_MODEL, PATH_RULES, diff_tables, save_changes
+from src.router import CellRouter, template_texts
+from src.rules import correct_date_condition2, only_cyrillic, last_surnames, sort_address, \
+    case_corrector, date_guesser_corrector
+from src.spellcheck import correct_errors, name_reconstruct, address_reconstruct, thread_budget, registry
+from src.registry import stamp, format_versions
 
 
 # Настройки
 workdir = "data/"
-locale.setlocale(locale.LC_ALL, 'ru_RU')
-m = pymorphy3.MorphAnalyzer()
 
+# Пул потоков для одновременной обработки листов анкеты
+sheet_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sheet")
 
-def correct_date_condition2(datestring: str) -> str:
 
-    """
-    Функция для проверки и корректировки по условию 2: 
-    Графы «Поступление» и «Увольнение» пункта 14 даты должны содержать только цифры и точки.
-
-    Функция проверяет соответствие даты формату ДД.ММ.ГГГГ или ММ.ГГГГ.
-    Функция угадывает формат даты, если указана дата в читаемом формате и возвращает строку в формате ММ.ГГГГ.
-    В противном случае функция оставляет в строке только числа и точки. 
-    В случае, если указано "по настоящее время" - текст не меняется.
+def _budgeted(budget: FormBudget, stage: str, fn, sheet: str, column: str):
 
-    Параметры:
-    datestring : str
-        Дата для форматирования
+    "Функция исправления ячеек колонки с учетом бюджета времени (без бюджета - сама функция)"
 
-    Возвращает:
-    string_out : str
-        Строка с датой в формате ДД.ГГГГ
+    return fn if budget is None else budget.wrap(stage, fn, sheet, column)
 
-    """
 
-    if datestring.lower() == "по настоящее время": return datestring
-    
-    try:
+def _map(trace: CellTrace, form_table: FormTable, table: int, column: str, step: str, fn, path: str = PATH_MODEL):
 
-        dt = datetime.strptime(datestring, "%m.%Y")
-        return(datestring)
-    
-    except ValueError as e:
+    "Применение функции к колонке; с trace - с записью шага, изменившего ячейку (см. changeset.CellTrace)"
 
-        try:
+    if trace is None: form_table.map(column, fn)
+    else: trace.map(form_table, table, column, step, fn, path)
 
-            dt = datetime.strptime(datestring, "%d.%m.%Y")
-            return(dt.strftime("%m.%Y"))
-        
-        except ValueError as e:
 
-            try: 
-                
-                return(date_guesser_corrector(datestring, "%m.%Y"))
-            
-            except Exception as e:
-
-                # нечитаемый формат даты
-                pass
-
-    return("".join(re.findall(pattern = "[0-9.]+", string = datestring)))
-
-
-def only_cyrillic(textstring: str) -> str:
+def process_sheet_1(sheet: pd.DataFrame, filename: str, log: logFile, verbose: bool = False,
+                    correct_fn = correct_errors,
+                    budget: FormBudget = None, trace: CellTrace = None) -> tuple:
 
     """
-    Функция для проверки и корректировки по условию 3.1: 
-    1. Графа «Степень родства» пункта 15 должна содержать только буквы кириллицы
-
-    Параметры:
-    textstring : str
-        Текст для форматирования
+    Обработка листа 1: орфография в ответах на пп. 2-13 и условие 1
 
     Возвращает:
-    string_out : str
-        Строка, содержащая текст, состоящий только из символов кириллицы
-
+    data_sheets_0_1, data_sheets_0_2 : FormTable
+        Таблица ФИО и таблица ответов на вопросы
     """
 
-    return("".join(re.findall(pattern = "[а-яА-Я ]+", string = textstring)))
+    stage_start = time.perf_counter()
 
+    # Лог 3
+    msg = f"{filename}: Обработка первого листа"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-def last_surnames(textstring: str) -> str:
+    # Удаление пустот и разбиение на таблицы (далее лист обрабатывается без pandas, см. FormTable)
+    data_sheets_0_1, data_sheets_0_2 = split_sheet_1(sheet)
 
-    """
-    Функция для проверки и корректировки по условию 3.2: 
-    2. В графе «Фамилия, имя и отчество» предыдущие фамилии (девичьи, изменённые) указываются в скобках. 
-    Если у одного родственника несколько раз изменялась фамилия, то они указываются в скобках через запятую.
+    # Проверка орфографии
+    if verbose: print("Проверка орфографии... Лист 1")
+    _map(trace, data_sheets_0_2, 1, "Ответ", "spellcheck", _budgeted(budget, "spellcheck", correct_fn, "sheet1", "Ответ"))
+    
+    # Лог 4
+    msg = f"{filename}: Лист 1: орфография проверена"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-    Параметры:
-    textstring : str
-        Текст для форматирования
+    # Проверка условия 1: В пункте 3 год рождения указывается только цифрами, число – двумя цифрами 
+    date_place_parts = data_sheets_0_2['Ответ'][1].split(", ")
 
-    Возвращает:
-    string_out : str
-        Строка, содержащая имя в соответсвующем формате
+    # Проверка на вхождение паттерна
+    regex_matcher = re.search(pattern = r"\d{4},\s\d{2}\s\w+", 
+                              string = date_place_parts[0] + ", " + date_place_parts[1])
+    
+    if regex_matcher is None:
 
-    """
+        # Вычленение даты произвольного формата и переформативание в ГГГГ, ДД ММММ
+        try:
 
-    x = " ".join(re.findall(pattern = "[а-яА-Я- ]+", string = textstring)).split()
+            date_corrected = date_guesser_corrector(date_place_parts[0] + ", " + date_place_parts[1])
 
-    if len(x) > 3:
-        string_out = x[0] + " (" + ", ".join(x[1:-2]) + ") " + " ".join(x[-2:])
-    else:
-        string_out = " ".join(x)
+            date_place_corrected = " ".join([date_corrected, 
+                                             *date_place_parts[2:]])
+            
+            data_sheets_0_2['Ответ'][1] = date_place_corrected
+            if trace is not None: trace.note(1, "Ответ", 1, "condition_1", PATH_RULES)
 
-    return string_out
+        except Exception as e:
+            
+            # Лог error_1
+            msg = f"{filename}: Лист 1: ошибка в формате даты"
+            log.write_log(msg, content = "ERR")
+            log.write_log(str(e), content = "ERR")
 
+    else:
 
-def sort_address(adress_text: str) -> str:
+        # Нужно ли исправить падеж в дате при вхождении паттерна?
+        pass
 
-    """
-    Функция для проверки и корректировки по условию 4: 
-    При заполнении адресов проживания и работы сначала необходимо указывать регион: республику, край, область.
+    # Лог 5
+    msg = f"{filename}: Лист 1: Условие 1 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-    23.01.2024: DEPRECATED: Функция заменена на функцию address_reconstruct() из модуля spellcheck, 
-    данная функцию использует нейросеть для определения адресов.
+    metrics.stage_latency.observe(time.perf_counter() - stage_start, stage="sheet1")
+    if verbose: print(f"Обработка листа 1 завершена")
 
-    Параметры:
-    adress_text : str
-        Адрес для форматирования
+    return data_sheets_0_1, data_sheets_0_2
 
-    Возвращает:
-    adr_classes: numpy array of str
-        Массив из классов элементов адреса
 
-    string_out : str
-        Строка, содержащая адрес в необходимом формате
+def process_sheet_2(sheet: pd.DataFrame, filename: str, log: logFile, verbose: bool = False,
+                    correct_fn = correct_errors, address_fn = address_reconstruct,
+                    budget: FormBudget = None, trace: CellTrace = None) -> FormTable:
 
     """
+    Обработка листа 2: условие 2, орфография и условие 4
 
-    # инициализация паттернов
-    pattern_reg = "республика|респ\.|область|обл\.|край|кр\.|асср"
-    pattern_subreg = "район|р-н"
-    pattern_towncity = "г\.|гор\.|город|п\.|пос\.|поселок|гп|городское поселение|с\.|село"
-    pattern_street = "ул\.|улица|б-р|бульвар|пр\.|проезд"
-    pattern_house = "дом|д\."
-    pattern_flat = "квартира|кв\."
-
-    patterns = {"REGION": pattern_reg, 
-                "SUBREGION": pattern_subreg, 
-                "TOWNCITY": pattern_towncity, 
-                "STREET": pattern_street, 
-                "HOUSE": pattern_house,
-                "FLAT": pattern_flat,
-                "UNDEFINED": None}
-    
-    # создание словаря для сортировки элементов адреса
-    sort_dict = {key: elem for elem, key in list(enumerate(patterns.keys()))}
-
-    adr_tokens = adress_text.split(", ")
-    adr_classes = np.full(len(adr_tokens), "UNDEFINED")
-
-    # создание массива элементов адресов
-    for i, adr_token in enumerate(adr_tokens):
+    Возвращает:
+    sheet : FormTable
+        Обработанная таблица п. 14
+    """
 
-        for key, pattern in patterns.items():
+    stage_start = time.perf_counter()
 
-            if key == "UNDEFINED": continue
+    # Лог 6
+    msg = f"{filename}: Обработка второго листа"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-            # print(key)
+    sheet = split_sheet_2(sheet)
 
-            res = re.findall(pattern, adr_token.lower())
+    # Проверка условия 2: Графы «Поступление» и «Увольнение» пункта 14 даты должны содержать только цифры и точки.
+    _map(trace, sheet, 2, "Месяц и год поступления", "condition_2", correct_date_condition2, PATH_RULES)
+    _map(trace, sheet, 2, "Месяц и год увольнения", "condition_2", correct_date_condition2, PATH_RULES)
 
-            if len(res) > 0:
+    # Лог 7
+    msg = f"{filename}: Лист 2: Условие 2 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-                if adr_classes[i] != "UNDEFINED":
-                    
-                    adr_classes[i] += "|" + key
+    # Проверка орфографии
+    if verbose: print("Проверка орфографии Лист 2...")
+    _map(trace, sheet, 2, "Должность с указанием наименования организации", "spellcheck", _budgeted(budget, "spellcheck", correct_fn, "sheet2", "Должность с указанием наименования организации"))
+    _map(trace, sheet, 2, "Адрес организации", "spellcheck", _budgeted(budget, "spellcheck", correct_fn, "sheet2", "Адрес организации"))
+    
+    # Лог 8
+    msg = f"{filename}: Лист 2: орфография проверена"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-                else:
+    # Проверка условия 4: При заполнении адресов проживания и 
+    # работы сначала необходимо указывать регион: республику, край, область.
+    if verbose: print(f"Проверка условия 4")
 
-                    adr_classes[i] = key
+    # Переупорядочивание элементов адреса
+    _map(trace, sheet, 2, "Адрес организации", "condition_4", _budgeted(budget, "addresses", address_fn, "sheet2", "Адрес организации"))
 
-    # print(adr_classes)
-    # print(adr_tokens)
+    # Лог 9
+    msg = f"{filename}: Лист 2: Условие 4 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-    # переформирование адреса
-    string_out = ", ".join([x for _, x in sorted(zip(adr_classes, adr_tokens), key = lambda pair: sort_dict[pair[0]])])
+    metrics.stage_latency.observe(time.perf_counter() - stage_start, stage="sheet2")
+    if verbose: print(f"Обработка листа 2 завершена")
 
-    return string_out
+    return sheet
 
 
-def case_corrector(string_in: str, word: str, case: str = "nomn") -> str:
+def process_sheet_3(sheet: pd.DataFrame, filename: str, log: logFile, verbose: bool = False,
+                    correct_fn = correct_errors, name_fn = name_reconstruct, address_fn = address_reconstruct,
+                    budget: FormBudget = None, trace: CellTrace = None) -> FormTable:
 
     """
-    Функция для исправления падежа слова в предложении. 
-    Делается через подстановку заполняемого выражения в строку и форматирование.
-
-    Параметры:
-    string_in : str
-        Строка, в которой есть слово для форматирования
-    word : str
-        Слово, которое необходимо скорректировать (используется как паттерн)
-    case : str
-        Падеж, в который необходимо просклонять слово
+    Обработка листа 3: условия 3.1 и 3.2, орфография и условие 4
 
     Возвращает:
-    string_out : str
-        Строка, содержащая слово в желаемом падеже
+    sheet : FormTable
+        Обработанная таблица п. 15
     """
 
-    string_out = re.sub(word, "{replacement}", string_in)\
-            .format(replacement = m.parse(word)[0].inflect({case}).word.title())
-    
-    return string_out
+    stage_start = time.perf_counter()
 
+    # Лог 10
+    msg = f"{filename}: Обработка третьего листа"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-def date_guesser_corrector(datestring: str, target_format: str = "%Y, %d %B") -> str:
+    # Замена имен колонок
+    sheet = split_sheet_3(sheet)
 
-    """
-    Функция для определения datetime из произвольного формата даты и конвертации полученного
-    datetime в указанный формат.
+    # Проверка условия 3.1: Графа «Степень родства» пункта 15 должна содержать только буквы кириллицы.
+    if verbose: print(f"Проверка условия 3.1")
 
-    Параметры:
-    datestring : str
-        Строка, содержащая дату в произвольном формате (на русском)
-    target_format : str
-        Желаемый формат даты
+    _map(trace, sheet, 3, 'Степень родства', "condition_3.1", only_cyrillic, PATH_RULES)
 
-    Возвращает:
-    datestring_corrected : str
-        Строка, содержащая дату в желаемом формате
-    """
+    # Лог 11
+    msg = f"{filename}: Лист 3: Условие 3.1 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
+
+    # Проверка условия 3.2: 
+    # В графе «Фамилия, имя и отчество» предыдущие фамилии (девичьи, изменённые) указываются в скобках. 
+    # Если у одного родственника несколько раз изменялась фамилия, то они указываются в скобках через запятую.
+    if verbose: print(f"Проверка условия 3.2 (используется NER для имен)")
 
-    # Создание паттернов для поиска форматов и частей даты
-    date_pattern = "\%[a-zA-Z]"
-    pattern_split = "[0-9а-яА-Я]+"
+    # TO DO
+    _map(trace, sheet, 3, "Фамилия, имя и отчество", "condition_3.2", _budgeted(budget, "names", name_fn, "sheet3", "Фамилия, имя и отчество"))
 
-    formats = re.findall(date_pattern, target_format)
+    # Лог 12
+    msg = f"{filename}: Лист 3: Условие 3.2 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-    # Угадывание даты из строки
-    guessdate = parser.parse(datestring, 
-                             parserinfo = RussianParserInfo())                         
+    # Проверка орфографии
+    if verbose: print("Проверка орфографии Лист 3...")
+    _map(trace, sheet, 3, "Число, месяц, год и место рождения, гражданство", "spellcheck", _budgeted(budget, "spellcheck", correct_fn, "sheet3", "Число, месяц, год и место рождения, гражданство"))
+    _map(trace, sheet, 3, "Место работы, должность", "spellcheck", _budgeted(budget, "spellcheck", correct_fn, "sheet3", "Место работы, должность"))
+    _map(trace, sheet, 3, "Адрес места жительства", "spellcheck", _budgeted(budget, "spellcheck", correct_fn, "sheet3", "Адрес места жительства"))
     
-    # если в искомом формате присутствует месяц, необходимо применить верное склонение
-    if "%B" in formats: 
-        
-        guessdate_inner = guessdate.strftime("%d %B %Y")
-        dateparts_inner = re.findall(pattern_split, guessdate_inner)
+    # Лог 13
+    msg = f"{filename}: Лист 3: орфография проверена"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-        datestring_corrected = case_corrector(guessdate.strftime(target_format), dateparts_inner[1], 'gent')
-    
-    else:
+    # Проверка условия 4: При заполнении адресов проживания и 
+    # работы сначала необходимо указывать регион: республику, край, область.
+    if verbose: print(f"Проверка условия 4 (используется NER для имен)")
 
-        datestring_corrected = guessdate.strftime(target_format)
-    
-    return datestring_corrected
+    # Переупорядочивание элементов адреса (TO DO)
+    _map(trace, sheet, 3, "Адрес места жительства", "condition_4", _budgeted(budget, "addresses", address_fn, "sheet3", "Адрес места жительства"))
 
+    # Лог 14
+    msg = f"{filename}: Лист 3: Условие 4 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
+
+    metrics.stage_latency.observe(time.perf_counter() - stage_start, stage="sheet3")
+    if verbose: print(f"Обработка листа 3 завершена")
 
-def save_to_excel(df_list: list, filename: str):
+    return sheet
+
+
+def process_sheet_4(sheet: pd.DataFrame, filename: str, log: logFile, verbose: bool = False,
+                    correct_fn = correct_errors, name_fn = name_reconstruct, address_fn = address_reconstruct,
+                    budget: FormBudget = None, trace: CellTrace = None) -> tuple:
 
     """
-    Функция для записи списка таблиц в шаблон Excel. 
-    На вход получает обработанный список из таблиц формы, список состоит из 6 элементов:
-     - 1-2 таблицы - Лист 1
-     - 3 таблица - Лист 2
-     - 4 таблица - Лист 3
-     - 5-6 таблицы - Лист 4
-    
-    Функция записывает данные таблицы в шаблон, хранящийся в директории templates
-    При необходимости, производится добавление строк (с копированием форматирования ячеек)
+    Обработка листа 4: условия 3.1 и 3.2 в п. 16, условие 2, орфография и условие 4 в п. 17
 
-    Функция ничего не возвращает, отрабатывает как процедура.
+    Возвращает:
+    data_sheets_3_1, data_sheets_3_2 : FormTable
+        Таблицы п. 16 и п. 17
     """
 
-    template_file = "templates/form4.template.xlsx"
-    output_file = "data/processed/" + filename.replace(".xlsx", "") + "_check.xlsx"
+    stage_start = time.perf_counter()
 
-    wb = load_workbook(template_file)
+    # Лог 15
+    msg = f"{filename}: Обработка четвертого листа"
+    log.write_log(msg)
+    if verbose: print(msg)
+    
+    data_sheets_3_1, data_sheets_3_2 = split_sheet_4(sheet)
+    
+    # Проверка условия 3.1: Графа «Степень родства» пункта 16 должна содержать только буквы кириллицы.
+    if verbose: print(f"Проверка условия 3.1")
 
-    # Запись первого листа
-    ws = wb['Лист1']
+    _map(trace, data_sheets_3_1, 4, 'Степень родства', "condition_3.1", only_cyrillic, PATH_RULES)
 
-    # Часть ФИО
-    rows = dataframe_to_rows(df_list[0][["Ответ"]], index=False, header=False)
+    # Лог 16
+    msg = f"{filename}: Лист 4: Условие 3.1 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-    for r_idx, row in enumerate(rows, 1):
-        for c_idx, value in enumerate(row, 1):
-            ws.cell(row=r_idx+3, column=c_idx+1, value=value)
+    # Проверка условия 3.2: 
+    # В графе «Фамилия, имя и отчество» предыдущие фамилии (девичьи, изменённые) указываются в скобках. 
+    # Если у одного родственника несколько раз изменялась фамилия, то они указываются в скобках через запятую.
+    if verbose: print(f"Проверка условия 3.2")
 
-    # Часть ответа на вопросы
-    rows = dataframe_to_rows(df_list[1][["Ответ"]], index=False, header=False)
+    # TO DO
+    _map(trace, data_sheets_3_1, 4, "Фамилия, имя и отчество", "condition_3.2", _budgeted(budget, "names", name_fn, "sheet4", "Фамилия, имя и отчество"))
 
-    for r_idx, row in enumerate(rows, 1):
-        for c_idx, value in enumerate(row, 1):
-            ws.cell(row=r_idx+7, column=c_idx+1, value=value)
+    # Лог 17
+    msg = f"{filename}: Лист 4: Условие 3.2 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-    # Запись второго листа
-    ws = wb['Лист2']
+    # Проверка условия 2: Графы Периода проживания пункта 17 даты должны содержать только цифры и точки.
+    _map(trace, data_sheets_3_2, 5, "Период проживания начало", "condition_2", correct_date_condition2, PATH_RULES)
+    _map(trace, data_sheets_3_2, 5, "Период проживания конец", "condition_2", correct_date_condition2, PATH_RULES)
 
-    rows = dataframe_to_rows(df_list[2], index=False, header=False)
+    # Лог 18
+    msg = f"{filename}: Лист 4: Условие 2 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-    for r_idx, row in enumerate(rows, 1):
-        for c_idx, value in enumerate(row, 1):
-            ws.cell(row=r_idx+3, column=c_idx, value=value)
+    # Проверка орфографии
+    if verbose: print("Проверка орфографии Лист 4...")
+    _map(trace, data_sheets_3_2, 5, "Адрес проживания и регистрации", "spellcheck", _budgeted(budget, "spellcheck", correct_fn, "sheet4", "Адрес проживания и регистрации"))
+    
+    # Лог 19
+    msg = f"{filename}: Лист 4: орфография проверена"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-    # Запись третьего листа
-    ws = wb['Лист3']
+    # Проверка условия 4: При заполнении адресов проживания и 
+    # работы сначала необходимо указывать регион: республику, край, область.
+    if verbose: print(f"Проверка условия 4")
 
-    rows = dataframe_to_rows(df_list[3], index=False, header=False)
+    # Переупорядочивание элементов адреса
+    _map(trace, data_sheets_3_2, 5, "Адрес проживания и регистрации", "condition_4", _budgeted(budget, "addresses", address_fn, "sheet4", "Адрес проживания и регистрации"))
+
+    # Лог 20
+    msg = f"{filename}: Лист 4: Условие 4 исправлено"
+    log.write_log(msg)
+    if verbose: print(msg)
 
-    for r_idx, row in enumerate(rows, 1):
-        for c_idx, value in enumerate(row, 1):
-            ws.cell(row=r_idx+2, column=c_idx, value=value)
+    metrics.stage_latency.observe(time.perf_counter() - stage_start, stage="sheet4")
+    if verbose: print(f"Обработка листа 4 завершена")
 
-    # Запись четвертого листа
-    ws = wb['Лист4']
+    return data_sheets_3_1, data_sheets_3_2
 
-    # определение количества строк в п. 17 - добавление строк при необходимости
-    if len(df_list[5]) > 11:
-        rows_to_add2 = len(df_list[5]) - 11
-        ws.insert_rows(20, rows_to_add2)
-    else:
-        rows_to_add2 = 0
 
-    # определение количества строк в п. 16 - добавление строк при необходимости
-    if len(df_list[4]) > 4:
-        rows_to_add1 = len(df_list[4]) - 4
-        ws.insert_rows(7, rows_to_add1)
-    else:
-        rows_to_add1 = 0
+def _run_sheet(checkpoint: StageCheckpoint, stage: str, sheet_fn, *args, **kwargs):
 
-    # сохранение стиля ячейки
-    cellstyle = {"fill": copy(ws.cell(4, 1).fill), 
-                "font": copy(ws.cell(4, 1).font), 
-                "number_format": copy(ws.cell(4, 1).number_format), 
-                "border": copy(ws.cell(4, 1).border)}
+    """
+    Запуск обработки листа.
+    Если результат этапа уже сохранен - он считывается без повторного вызова моделей,
+    иначе результат сохраняется после завершения этапа (кроме этапов с деградацией из-за бюджета времени 
+    и этапов, во время которых сменилась версия модели: ключ результатов - версии на начало обработки)
+    """
 
-    # запись п. 16
-    rows = dataframe_to_rows(df_list[4], index=False, header=False)
+    if checkpoint is not None:
 
-    for r_idx, row in enumerate(rows, 1):
-        for c_idx, value in enumerate(row, 1):
+        result = checkpoint.load(stage)
 
-            # print(r_idx)
+        if result is not None: return result
 
-            ws.cell(row=r_idx+3, column=c_idx).value = value
-            ws.cell(row=r_idx+3, column=c_idx).fill = (cellstyle['fill'])
-            ws.cell(row=r_idx+3, column=c_idx).font = (cellstyle['font'])
-            ws.cell(row=r_idx+3, column=c_idx).number_format = (cellstyle['number_format'])
-            ws.cell(row=r_idx+3, column=c_idx).border = (cellstyle['border'])
+    result = sheet_fn(*args, **kwargs)
 
-    # запись п. 17
-    rows = dataframe_to_rows(df_list[5], index=False, header=False)
+    budget = kwargs.get("budget")
 
-    for r_idx, row in enumerate(rows, 1):
-        for c_idx, value in enumerate(row, 1):
-            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).value = value
-            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).fill = (cellstyle['fill'])
-            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).font = (cellstyle['font'])
-            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).number_format = (cellstyle['number_format'])
-            ws.cell(row=r_idx+9+rows_to_add1, column=c_idx).border = (cellstyle['border'])
+    if checkpoint is not None and (budget is None or stage not in budget.degraded_sheets()) \
+            and registry.versions() == checkpoint.model_versions: 
+        checkpoint.save(stage, result)
 
-    wb.save(output_file)
-    wb.close()
+    return result
 
 
-def file_processor(filename: str, workdir: str = workdir, logfile: str = "", verbose: bool = False):
+@metrics.track_form
+def file_processor(filename: str, workdir: str = workdir, logfile: str = "", verbose: bool = False,
+                   correct_fn = correct_errors, name_fn = name_reconstruct, address_fn = address_reconstruct,
+                   parallel: bool = True, checkpoint: bool = True, route_cells: bool = True,
+                   budget_seconds: float = None, output_format: str = OUTPUT_XLSX) -> str:
 
     """
     Чтение и предобработка данных для каждого листа анкеты. 
@@ -432,10 +427,33 @@ def file_processor(filename: str, workdir: str = workdir, logfile: str = "", ver
         Имя файла
     workdir : str
         Рабочая директория
+    correct_fn, name_fn, address_fn : callable
+        Функции исправления орфографии, имен и адресов (по умолчанию - из модуля spellcheck). 
+        Позволяют подменить вызовы моделей, например, на вызовы через микро-батчинг сервиса
+        (функция может вернуть Future - результаты колонки ожидаются после постановки всех ее ячеек, см. FormTable.map)
+    parallel : bool
+        Обрабатывать листы одновременно в пуле потоков (по умолчанию) или последовательно
+    checkpoint : bool
+        Сохранять результаты обработки листов, чтобы при повторном запуске после сбоя 
+        не выполнять заново вызовы моделей для уже обработанных листов 
+        (в workdir/checkpoints; результаты других версий моделей не используются)
+    route_cells : bool
+        Не отправлять в модель исправления орфографии ячейки, которым она не поможет 
+        (числа, даты, типовые ответы, текст шаблона, текст на латинице) - см. модуль router
+    budget_seconds : float
+        Бюджет времени на анкету, с. При приближении к бюджету обработка деградирует: 
+        сначала пропускается проверка орфографии в колонках низкого приоритета, затем имена и адреса 
+        исправляются только правилами, после исчерпания бюджета - исключение BudgetExceeded (см. модуль budget)
+    output_format : str
+        "xlsx" - книга _check.xlsx по шаблону; "jsonl" или "parquet" - только изменения ячеек (_changes.jsonl / 
+        _changes.parquet), книга _check.xlsx строится по ним при необходимости (см. модуль changeset).
+        Правило изменения - шаги и способы обработки ячейки: модель, router (passthrough, latin_rules), 
+        деградация по бюджету или правила (см. changeset.CellTrace).
+        В результат записываются версии моделей, обработавших анкету (см. модуль registry)
 
     Возвращает:
-    pd_list : str of pd.DataFrame
-        Список из таблиц для последующем сохранении в Excel
+    output_file : str
+        Путь к записанному файлу _check.xlsx (или файлу изменений)
     """
 
     if verbose: print(f"Обработка документа {filename}")
@@ -447,268 +465,127 @@ def file_processor(filename: str, workdir: str = workdir, logfile: str = "", ver
 
     log = logFile(mode = "a", filename = "logs/"+logfile, operation = "Обработка")
 
-    data_sheets = [pd.read_excel(workdir + "raw/" + filename,
-                                 sheet_name=sheet_index) for sheet_index in range(4)]
-    
-    # Лог 2
-    msg = f"{filename}: Листы считаны"
-    log.write_log(msg)
-    if verbose: print(msg)
-
-    
-    # Лист 1: обработка
-
-    # Лог 3
-    msg = f"{filename}: Обработка первого листа"
-    log.write_log(msg)
-    if verbose: print(msg)
-
-    # Переименование колонок и удаление пустот
-    data_sheets[0].columns = ["Вопрос", "Ответ"]
-    data_sheets[0] = data_sheets[0][2:].dropna(subset = ["Вопрос"]).reset_index(drop = True)
-
-    data_sheets_0_1 = data_sheets[0][:3].reset_index(drop = True)
-    data_sheets_0_2 = data_sheets[0][3:].reset_index(drop = True) 
-
-    # Проверка орфографии
-    if verbose: print("Проверка орфографии... Лист 1")
-    data_sheets_0_2["Ответ"] = data_sheets_0_2["Ответ"].map(correct_errors)
-    
-    # Лог 4
-    msg = f"{filename}: Лист 1: орфография проверена"
-    log.write_log(msg)
-    if verbose: print(msg)
-
-    # Проверка условия 1: В пункте 3 год рождения указывается только цифрами, число – двумя цифрами 
-    date_place_parts = data_sheets_0_2['Ответ'][1].split(", ")
-
-    # Проверка на вхождение паттерна
-    regex_matcher = re.search(pattern = r"\d{4},\s\d{2}\s\w+", 
-                              string = date_place_parts[0] + ", " + date_place_parts[1])
-    
-    if regex_matcher is None:
-
-        # Вычленение даты произвольного формата и переформативание в ГГГГ, ДД ММММ
-        try:
-
-            date_corrected = date_guesser_corrector(date_place_parts[0] + ", " + date_place_parts[1])
-
-            date_place_corrected = " ".join([date_corrected, 
-                                             *date_place_parts[2:]])
-            
-            data_sheets_0_2['Ответ'][1] = date_place_corrected
-
-        except Exception as e:
-            
-            # Лог error_1
-            msg = f"{filename}: Лист 1: ошибка в формате даты"
-            log.write_log(msg, content = "ERR")
-            log.write_log(str(e), content = "ERR")
-
-    else:
-
-        # Нужно ли исправить падеж в дате при вхождении паттерна?
-        pass
-
-    # Лог 5
-    msg = f"{filename}: Лист 1: Условие 1 исправлено"
-    log.write_log(msg)
-    if verbose: print(msg)
+    stage_start = time.perf_counter()
 
-    if verbose: print(f"Обработка листа 1 завершена")
-
-
-    # Лист 2: обработка
+    # версии моделей на начало обработки (могут смениться во время обработки, см. registry)
+    versions_start = registry.versions()
 
-    # Лог 6
-    msg = f"{filename}: Обработка второго листа"
-    log.write_log(msg)
-    if verbose: print(msg)
+    # пути обработки ячеек - для правила в файле изменений
+    trace = CellTrace() if output_format != OUTPUT_XLSX else None
 
-    data_sheets[1].columns = ["Месяц и год поступления", 
-                              "Месяц и год увольнения",
-                              "Должность с указанием наименования организации",
-                              "Адрес организации"]
+    # бюджет отсчитывается от начала обработки анкеты
+    budget = FormBudget(budget_seconds, filename, log, verbose, trace) if budget_seconds is not None else None
 
-    data_sheets[1] = data_sheets[1][2:].dropna().reset_index(drop = True)
+    data_sheets = read_form(workdir + "raw/" + filename)
 
-    # Проверка условия 2: Графы «Поступление» и «Увольнение» пункта 14 даты должны содержать только цифры и точки.
-    data_sheets[1]["Месяц и год поступления"] = data_sheets[1]["Месяц и год поступления"].map(correct_date_condition2)
-    data_sheets[1]["Месяц и год увольнения"] = data_sheets[1]["Месяц и год увольнения"].map(correct_date_condition2)
+    metrics.stage_latency.observe(time.perf_counter() - stage_start, stage="read")
 
-    # Лог 7
-    msg = f"{filename}: Лист 2: Условие 2 исправлено"
-    log.write_log(msg)
-    if verbose: print(msg)
-
-    # Проверка орфографии
-    if verbose: print("Проверка орфографии Лист 2...")
-    data_sheets[1]["Должность с указанием наименования организации"] = \
-        data_sheets[1]["Должность с указанием наименования организации"].map(correct_errors)
-    data_sheets[1]["Адрес организации"] = data_sheets[1]["Адрес организации"].map(correct_errors)
+    # исходные значения - для записи изменений (разбиение не изменяет листы)
+    original_tables = split_form(data_sheets) if output_format != OUTPUT_XLSX else None
     
-    # Лог 8
-    msg = f"{filename}: Лист 2: орфография проверена"
-    log.write_log(msg)
-    if verbose: print(msg)
-
-    # Проверка условия 4: При заполнении адресов проживания и 
-    # работы сначала необходимо указывать регион: республику, край, область.
-    if verbose: print(f"Проверка условия 4")
-
-    # Переупорядочивание элементов адреса
-    data_sheets[1]["Адрес организации"] = data_sheets[1]["Адрес организации"].map(address_reconstruct)
-
-    # Лог 9
-    msg = f"{filename}: Лист 2: Условие 4 исправлено"
+    # Лог 2
+    msg = f"{filename}: Листы считаны"
     log.write_log(msg)
     if verbose: print(msg)
 
-    if verbose: print(f"Обработка листа 2 завершена")
-    
 
-    # Лист 3: обработка
+    # Промежуточные результаты по листам (ключ - хэш файла анкеты и версии моделей)
+    if checkpoint:
 
-    # Лог 10
-    msg = f"{filename}: Обработка третьего листа"
-    log.write_log(msg)
-    if verbose: print(msg)
+        stage_checkpoint = StageCheckpoint(workdir + "raw/" + filename, workdir + "checkpoints/", versions_start)
+        done_stages = stage_checkpoint.stages()
 
-    # Замена имен колонок
-    data_sheets[2].columns = ["Степень родства", 
-                              "Фамилия, имя и отчество",
-                              "Число, месяц, год и место рождения, гражданство",
-                              "Место работы, должность",
-                              "Адрес места жительства"]
+        if len(done_stages) > 0:
 
-    data_sheets[2] = data_sheets[2][1:].dropna().reset_index(drop = True)
+            msg = f"{filename}: Восстановлены результаты этапов: {', '.join(done_stages)}"
+            log.write_log(msg)
+            if verbose: print(msg)
 
-    # Проверка условия 3.1: Графа «Степень родства» пункта 15 должна содержать только буквы кириллицы.
-    if verbose: print(f"Проверка условия 3.1")
+    else:
+        stage_checkpoint = None
 
-    data_sheets[2]['Степень родства'] = data_sheets[2]['Степень родства'].map(only_cyrillic)
 
-    # Лог 11
-    msg = f"{filename}: Лист 3: Условие 3.1 исправлено"
-    log.write_log(msg)
-    if verbose: print(msg)
-
-    # Проверка условия 3.2: 
-    # В графе «Фамилия, имя и отчество» предыдущие фамилии (девичьи, изменённые) указываются в скобках. 
-    # Если у одного родственника несколько раз изменялась фамилия, то они указываются в скобках через запятую.
-    if verbose: print(f"Проверка условия 3.2 (используется NER для имен)")
+    # Маршрутизация ячеек перед проверкой орфографии
+    if route_cells:
+        correct_fn = router = CellRouter(correct_fn, template_texts(), trace)
 
-    # TO DO
-    data_sheets[2]["Фамилия, имя и отчество"] = data_sheets[2]["Фамилия, имя и отчество"].map(name_reconstruct)
 
-    # Лог 12
-    msg = f"{filename}: Лист 3: Условие 3.2 исправлено"
-    log.write_log(msg)
-    if verbose: print(msg)
+    # Обработка листов
+    sheet_tasks = [("sheet1", process_sheet_1, data_sheets[0], {"correct_fn": correct_fn, "budget": budget, "trace": trace}),
+                   ("sheet2", process_sheet_2, data_sheets[1], {"correct_fn": correct_fn, "address_fn": address_fn, "budget": budget, "trace": trace}),
+                   ("sheet3", process_sheet_3, data_sheets[2], {"correct_fn": correct_fn, "name_fn": name_fn, "address_fn": address_fn, "budget": budget, "trace": trace}),
+                   ("sheet4", process_sheet_4, data_sheets[3], {"correct_fn": correct_fn, "name_fn": name_fn, "address_fn": address_fn, "budget": budget, "trace": trace})]
 
-    # Проверка орфографии
-    if verbose: print("Проверка орфографии Лист 3...")
-    data_sheets[2]["Число, месяц, год и место рождения, гражданство"] = \
-        data_sheets[2]["Число, месяц, год и место рождения, гражданство"].map(correct_errors)
-    data_sheets[2]["Место работы, должность"] = data_sheets[2]["Место работы, должность"].map(correct_errors)
-    data_sheets[2]["Адрес места жительства"] = data_sheets[2]["Адрес места жительства"].map(correct_errors)
-    
-    # Лог 13
-    msg = f"{filename}: Лист 3: орфография проверена"
-    log.write_log(msg)
-    if verbose: print(msg)
+    try:
 
-    # Проверка условия 4: При заполнении адресов проживания и 
-    # работы сначала необходимо указывать регион: республику, край, область.
-    if verbose: print(f"Проверка условия 4 (используется NER для имен)")
+        if parallel:
 
-    # Переупорядочивание элементов адреса (TO DO)
-    data_sheets[2]["Адрес места жительства"] = data_sheets[2]["Адрес места жительства"].map(address_reconstruct)
+            # листы независимы до записи в Excel: обрабатываются одновременно, 
+            # потоки torch делятся между листами, чтобы не было переподписки ядер 
+            # (ограничение действует на весь процесс и снимается после обработки листов)
+            with thread_budget(max(1, spellcheck.torch_threads // len(sheet_tasks))):
 
-    # Лог 14
-    msg = f"{filename}: Лист 3: Условие 4 исправлено"
-    log.write_log(msg)
-    if verbose: print(msg)
+                futures = [sheet_executor.submit(_run_sheet, stage_checkpoint, stage, sheet_fn, sheet, filename, log, verbose, **kwargs) 
+                           for stage, sheet_fn, sheet, kwargs in sheet_tasks]
+                
+                results = [future.result() for future in futures]
 
-    if verbose: print(f"Обработка листа 3 завершена")
+        else:
 
+            results = [_run_sheet(stage_checkpoint, stage, sheet_fn, sheet, filename, log, verbose, **kwargs) 
+                       for stage, sheet_fn, sheet, kwargs in sheet_tasks]
 
-    # Лист 4: обработка
+    except BudgetExceeded as e:
 
-    # Лог 15
-    msg = f"{filename}: Обработка четвертого листа"
-    log.write_log(msg)
-    if verbose: print(msg)
-    
-    data_sheets_3_1 = data_sheets[3][2:5].dropna(how="all")
+        # Лог error_3
+        msg = f"{filename}: Обработка прекращена - {budget.report()}"
+        log.write_log(msg, content = "ERR")
+        if verbose: print(msg)
 
-    data_sheets_3_1.columns = ["Степень родства", 
-                               "Фамилия, имя и отчество",
-                               "Где проживает и период проживания за границей"]
+        raise e
 
-    stop_idx = data_sheets[3][data_sheets[3].iloc[:, 0].str.contains("Дополнительные сведения", na=False)].index[0]
-    data_sheets_3_2 = data_sheets[3][7:stop_idx].dropna(how="all")
+    (data_sheets_0_1, data_sheets_0_2), data_sheets_1, data_sheets_2, (data_sheets_3_1, data_sheets_3_2) = results
 
-    data_sheets_3_2.columns = ["Период проживания начало",
-                               "Период проживания конец",
-                               "Адрес проживания и регистрации"]
-    
-    # Проверка условия 3.1: Графа «Степень родства» пункта 16 должна содержать только буквы кириллицы.
-    if verbose: print(f"Проверка условия 3.1")
+    if route_cells:
 
-    data_sheets_3_1['Степень родства'] = data_sheets_3_1['Степень родства'].map(only_cyrillic)
+        # Лог 21
+        msg = f"{filename}: Маршруты ячеек при проверке орфографии - {router.report()}"
+        log.write_log(msg)
+        if verbose: print(msg)
 
-    # Лог 16
-    msg = f"{filename}: Лист 4: Условие 3.1 исправлено"
-    log.write_log(msg)
-    if verbose: print(msg)
+    if budget is not None:
 
-    # Проверка условия 3.2: 
-    # В графе «Фамилия, имя и отчество» предыдущие фамилии (девичьи, изменённые) указываются в скобках. 
-    # Если у одного родственника несколько раз изменялась фамилия, то они указываются в скобках через запятую.
-    if verbose: print(f"Проверка условия 3.2")
+        # Лог 22
+        msg = f"{filename}: Бюджет времени - {budget.report()}"
+        log.write_log(msg)
+        if verbose: print(msg)
 
-    # TO DO
-    data_sheets_3_1["Фамилия, имя и отчество"] = data_sheets_3_1["Фамилия, имя и отчество"].map(name_reconstruct)
+    model_versions = format_versions(stamp(versions_start, registry.versions()))
 
-    # Лог 17
-    msg = f"{filename}: Лист 4: Условие 3.2 исправлено"
+    # Лог 24
+    msg = f"{filename}: Версии моделей - {model_versions}"
     log.write_log(msg)
     if verbose: print(msg)
 
-    # Проверка условия 2: Графы Периода проживания пункта 17 даты должны содержать только цифры и точки.
-    data_sheets_3_2["Период проживания начало"] = data_sheets_3_2["Период проживания начало"].map(correct_date_condition2)
-    data_sheets_3_2["Период проживания конец"] = data_sheets_3_2["Период проживания конец"].map(correct_date_condition2)
+    # объединим обработанные таблицы в список (промежуточные результаты прежних версий - pd.DataFrame)
+    tables = [as_table(table) for table in [data_sheets_0_1, data_sheets_0_2, data_sheets_1, data_sheets_2, 
+                                            data_sheets_3_1, data_sheets_3_2]]
 
-    # Лог 18
-    msg = f"{filename}: Лист 4: Условие 2 исправлено"
-    log.write_log(msg)
-    if verbose: print(msg)
-
-    # Проверка орфографии
-    if verbose: print("Проверка орфографии Лист 4...")
-    data_sheets_3_2["Адрес проживания и регистрации"] = data_sheets_3_2["Адрес проживания и регистрации"].map(correct_errors)
-    
-    # Лог 19
-    msg = f"{filename}: Лист 4: орфография проверена"
-    log.write_log(msg)
-    if verbose: print(msg)
+    with metrics.stage_latency.time(stage="save"):
 
-    # Проверка условия 4: При заполнении адресов проживания и 
-    # работы сначала необходимо указывать регион: республику, край, область.
-    if verbose: print(f"Проверка условия 4")
+        if output_format == OUTPUT_XLSX:
+            output_file = save_to_excel(tables, filename, workdir, model_versions)
 
-    # Переупорядочивание элементов адреса
-    data_sheets_3_2["Адрес проживания и регистрации"] = data_sheets_3_2["Адрес проживания и регистрации"].map(address_reconstruct)
+        else:
+            changes = diff_tables(filename, original_tables, tables, model_versions, trace)
+            output_file = save_changes(changes, filename, workdir, output_format)
 
-    # Лог 20
-    msg = f"{filename}: Лист 4: Условие 4 исправлено"
-    log.write_log(msg)
-    if verbose: print(msg)
-
-    if verbose: print(f"Обработка листа 4 завершена")
+            # Лог 23
+            msg = f"{filename}: Записано изменений - {len(changes)}"
+            log.write_log(msg)
+            if verbose: print(msg)
 
-    # объединим обработанные таблицы в список
-    pd_list = [data_sheets_0_1, data_sheets_0_2, data_sheets[1], data_sheets[2], data_sheets_3_1, data_sheets_3_2]
+    # анкета записана - промежуточные результаты больше не нужны
+    if stage_checkpoint is not None: stage_checkpoint.clear()
 
-    save_to_excel(pd_list, filename)
\ No newline at end of file
+    return output_file
\ No newline at end of file
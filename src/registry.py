@@ -0,0 +1,356 @@
+import argparse
+import gc
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from src import metrics
+from src.logger import logFile
+
+
+# Файл с активными версиями моделей: {"имя модели": {"version": ..., пути к файлам версии}}
+manifest_path = "model/registry.json"
+
+# Период проверки файла версий, с
+poll_interval = 10
+
+# Максимальное ожидание завершения пакетов, использующих старую версию, с
+drain_timeout = 600
+
+
+def read_manifest(path: str = manifest_path) -> dict:
+
+    "Чтение файла версий моделей (пустой словарь, если файла нет)"
+
+    if not os.path.exists(path): return {}
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(manifest: dict, path: str = manifest_path):
+
+    "Запись файла версий через временный файл: исполнители не прочитают его наполовину записанным"
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    os.replace(tmp_path, path)
+
+
+def stamp(before: dict, after: dict) -> dict:
+
+    """
+    Версии моделей для записи в результат анкеты: если за время обработки версия сменилась,
+    часть ячеек могла быть обработана старой версией - записываются обе ("старая->новая")
+
+    Параметры:
+    before, after : dict
+        Версии моделей (ModelRegistry.versions) до и после обработки анкеты
+
+    Возвращает:
+    versions : dict
+        Имя модели -> версия
+    """
+
+    return {name: version if before.get(name, version) == version else f"{before[name]}->{version}"
+            for name, version in after.items()}
+
+
+def format_versions(versions: dict) -> str:
+
+    "Версии моделей одной строкой для записи в результат: spellcheck=..., ner_names=..., ner_addresses=..."
+
+    return ", ".join(f"{name}={version}" for name, version in versions.items())
+
+
+class ModelVersion:
+
+    "Загруженная версия модели и число пакетов, которые ее сейчас используют"
+
+    def __init__(self, name: str, version: str, entry: dict, handles):
+
+        self.name = name
+        self.version = version
+        self.entry = entry
+        self.handles = handles
+        self.in_flight = 0
+        self.loaded_at = time.time()
+
+
+class ModelRegistry:
+
+    """
+    Реестр версий моделей с заменой без остановки процесса.
+
+    Пакет получает модель через acquire и работает с ней до конца, даже если в это время
+    версия сменилась. Новая версия загружается и прогревается в фоновом потоке, затем
+    подменяется одной операцией под блокировкой - следующие пакеты получают уже ее.
+    Старая версия освобождается, когда завершатся все пакеты, взявшие ее до замены.
+
+    Версии задаются файлом manifest_path; при его изменении (см. watch, check)
+    модели с новой версией перезагружаются.
+    """
+
+    def __init__(self, manifest_path: str = manifest_path, log: logFile = None):
+
+        self.manifest_path = manifest_path
+        self.log = log
+
+        self.loaders = {}
+        self.current = {}
+        self.condition = threading.Condition()
+
+        # версии загружаются по одной, чтобы в памяти было не больше двух копий модели
+        self.deploy_lock = threading.Lock()
+
+        self.listeners = []
+        self.manifest_mtime = None
+        self.watcher = None
+
+    def _write_log(self, msg: str, content: str = "MSG"):
+
+        if self.log is not None: self.log.write_log(msg, content = content)
+
+    def register(self, name: str, load_fn, warmup_fn, default_entry: dict) -> ModelVersion:
+
+        """
+        Регистрация модели и загрузка ее текущей версии (из файла версий или default_entry)
+
+        Параметры:
+        name : str
+            Имя модели ("spellcheck", "ner_names", "ner_addresses")
+        load_fn : callable
+            Загрузка версии по записи файла версий (dict -> объекты модели)
+        warmup_fn : callable
+            Прогрев загруженной версии несколькими вызовами (объекты модели -> None)
+        default_entry : dict
+            Версия и пути, если модели нет в файле версий
+
+        Возвращает:
+        model_version : ModelVersion
+            Загруженная версия
+        """
+
+        self.loaders[name] = (load_fn, warmup_fn)
+
+        entry = read_manifest(self.manifest_path).get(name, default_entry)
+
+        model_version = ModelVersion(name, entry["version"], entry, load_fn(entry))
+
+        with self.condition:
+            self.current[name] = model_version
+
+        metrics.model_loaded.set(1, model=name)
+        metrics.model_version.set(1, model=name, version=model_version.version)
+
+        return model_version
+
+    def add_listener(self, listener):
+
+        "Функция listener(name, model_version) вызывается после каждой замены версии"
+
+        self.listeners.append(listener)
+
+    @contextmanager
+    def acquire(self, name: str):
+
+        """
+        Текущая версия модели на время пакета: версия не освобождается, пока пакет не завершится
+
+        Пример:
+        with registry.acquire("ner_names") as token_classifier:
+            token_classifier(tokens)
+        """
+
+        with self.condition:
+            model_version = self.current[name]
+            model_version.in_flight += 1
+
+        try:
+            yield model_version.handles
+        finally:
+            with self.condition:
+                model_version.in_flight -= 1
+                self.condition.notify_all()
+
+    def versions(self) -> dict:
+
+        "Текущие версии моделей: имя модели -> версия"
+
+        with self.condition:
+            return {name: model_version.version for name, model_version in self.current.items()}
+
+    def loaded(self) -> bool:
+
+        "Все зарегистрированные модели загружены: у каждой есть текущая версия с объектами модели"
+
+        with self.condition:
+            return len(self.loaders) > 0 and all(name in self.current and self.current[name].handles is not None
+                                                 for name in self.loaders)
+
+    def deploy(self, name: str, entry: dict) -> bool:
+
+        """
+        Загрузка, прогрев и замена версии модели. Вызывается в фоновом потоке:
+        пока версия загружается, пакеты обрабатываются текущей версией.
+        При ошибке загрузки или прогрева остается текущая версия
+
+        Параметры:
+        name : str
+            Имя модели
+        entry : dict
+            Запись файла версий: версия и пути к файлам
+
+        Возвращает:
+        deployed : bool
+            Версия заменена
+        """
+
+        load_fn, warmup_fn = self.loaders[name]
+
+        with self.deploy_lock:
+
+            # версия могла быть загружена параллельной проверкой (watch и check)
+            if self.versions().get(name) == entry["version"]: return False
+
+            start = time.perf_counter()
+
+            try:
+                handles = load_fn(entry)
+                warmup_fn(handles)
+            except Exception as e:
+                metrics.model_reloads.inc(model=name, status="failed")
+                self._write_log(f"{name}: версия {entry.get('version')} не загружена, остается текущая: {e!r}", content = "ERR")
+                return False
+
+            new_version = ModelVersion(name, entry["version"], entry, handles)
+
+            with self.condition:
+                old_version = self.current[name]
+                self.current[name] = new_version
+
+            for listener in self.listeners:
+                listener(name, new_version)
+
+            metrics.model_reloads.inc(model=name, status="deployed")
+            metrics.model_version.set(0, model=name, version=old_version.version)
+            metrics.model_version.set(1, model=name, version=new_version.version)
+
+            self._write_log(f"{name}: версия {old_version.version} заменена на {new_version.version} "
+                            f"(загрузка и прогрев {time.perf_counter() - start:.1f} с)")
+
+            self._drain(old_version)
+
+        return True
+
+    def _drain(self, old_version: ModelVersion):
+
+        "Ожидание завершения пакетов, взявших старую версию, и освобождение памяти"
+
+        with self.condition:
+            drained = self.condition.wait_for(lambda: old_version.in_flight == 0, timeout=drain_timeout)
+
+        if not drained:
+            self._write_log(f"{old_version.name}: версия {old_version.version} используется "
+                            f"{old_version.in_flight} пакетами дольше {drain_timeout} с", content = "ERR")
+            return
+
+        old_version.handles = None
+        gc.collect()
+
+        self._write_log(f"{old_version.name}: версия {old_version.version} выгружена")
+
+    def check(self) -> list:
+
+        """
+        Сравнение файла версий с загруженными версиями и замена изменившихся моделей
+
+        Возвращает:
+        deployed : list of str
+            Имена моделей, версии которых заменены
+        """
+
+        manifest = read_manifest(self.manifest_path)
+        current = self.versions()
+        deployed = []
+
+        for name, entry in manifest.items():
+            if name in self.loaders and entry["version"] != current.get(name) and self.deploy(name, entry):
+                deployed.append(name)
+
+        return deployed
+
+    def watch(self, interval: float = poll_interval) -> threading.Thread:
+
+        """
+        Фоновый поток, проверяющий файл версий каждые interval секунд (при изменении времени записи файла).
+        Первая проверка - сразу: файл мог измениться, пока модели загружались при импорте.
+        Ошибка проверки (например, файл версий с ошибкой) записывается в лог, поток продолжает работу
+        """
+
+        if self.watcher is not None: return self.watcher
+
+        def poll():
+
+            while True:
+
+                try:
+
+                    mtime = os.path.getmtime(self.manifest_path) if os.path.exists(self.manifest_path) else None
+
+                    if mtime != self.manifest_mtime:
+                        self.manifest_mtime = mtime
+                        self.check()
+
+                except Exception as e:
+                    self._write_log(f"Ошибка проверки файла версий {self.manifest_path}: {e!r}", content = "ERR")
+
+                time.sleep(interval)
+
+        self.watcher = threading.Thread(target=poll, daemon=True, name="model-registry")
+        self.watcher.start()
+
+        return self.watcher
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="Версии моделей: просмотр и выкладка новой версии")
+    arg_parser.add_argument("command", choices=["show", "deploy"])
+    arg_parser.add_argument("name", nargs="?", default="", help="Имя модели: spellcheck, ner_names, ner_addresses")
+    arg_parser.add_argument("version", nargs="?", default="", help="Новая версия")
+    arg_parser.add_argument("paths", nargs="*", default=[],
+                            help="Пути версии в виде ключ=путь (path=... для NER; model=..., tokenizer=..., tokenizer_fast=... для spellcheck)")
+    arg_parser.add_argument("--manifest", default=manifest_path)
+    args = arg_parser.parse_args()
+
+    manifest = read_manifest(args.manifest)
+
+    if args.command == "deploy":
+
+        if args.name == "" or args.version == "":
+            arg_parser.error("для deploy нужны имя модели и версия")
+
+        entry = dict(path.split("=", 1) for path in args.paths)
+        missing = [path for key, path in entry.items() if key != "tokenizer_fast" and not os.path.exists(path)]
+
+        if len(missing) > 0:
+            arg_parser.error(f"не найдены пути: {', '.join(missing)}")
+
+        manifest[args.name] = {"version": args.version, **entry}
+        write_manifest(manifest, args.manifest)
+
+        # запущенные исполнители и сервис заменят модель при следующей проверке файла версий
+        log = logFile(operation = "Выкладка версии модели")
+        log.write_log(f"{args.name}: версия {args.version} записана в {args.manifest}")
+        log.close()
+
+    for name, entry in manifest.items():
+        print(f"{name}: {entry['version']} ({', '.join(f'{key}={value}' for key, value in entry.items() if key != 'version')})")
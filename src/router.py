@@ -0,0 +1,148 @@
+import re
+import threading
+from functools import lru_cache
+from collections import Counter
+
+from openpyxl import load_workbook
+
+from src import metrics
+
+
+# Маршруты ячеек
+ROUTE_PASSTHROUGH = "passthrough"   # ячейка не меняется
+ROUTE_RULES = "rules"               # только правила (без модели)
+ROUTE_NEURAL = "neural"             # исправление орфографии моделью
+
+template_file = "templates/form4.template.xlsx"
+
+# Типовые короткие ответы, которые модель не исправляет
+passthrough_answers = {"нет", "не имею", "не имел", "не имела", "не было", "не состоял", "не состояла",
+                       "не привлекался", "не привлекалась", "не изменял", "не изменяла", "отсутствует",
+                       "отсутствуют", "да", "-", "—"}
+
+# Числа, даты, номера телефонов и документов: только цифры и разделители
+pattern_numeric = re.compile(r"^[\d\s.,:;/\\\-–—№()+]+$")
+
+pattern_latin = re.compile("[a-zA-Z]")
+pattern_cyrillic = re.compile("[а-яА-ЯёЁ]")
+
+
+def _normalize(text: str) -> str:
+
+    return " ".join(text.lower().split()).strip(" .")
+
+
+@lru_cache(maxsize=4)
+def template_texts(template_file: str = template_file) -> frozenset:
+
+    """
+    Тексты шаблона анкеты (вопросы и значения по умолчанию).
+    Ячейка, повторяющая текст шаблона, не является ответом и не исправляется
+
+    Параметры:
+    template_file : str
+        Путь к шаблону
+
+    Возвращает:
+    texts : frozenset of str
+        Нормализованные тексты ячеек шаблона (пустое множество, если шаблона нет)
+    """
+
+    try:
+        wb = load_workbook(template_file, read_only=True)
+    except FileNotFoundError:
+        return frozenset()
+
+    texts = set()
+
+    for ws in wb.worksheets:
+        for row in ws.iter_rows(values_only=True):
+            texts.update(_normalize(value) for value in row if isinstance(value, str))
+
+    wb.close()
+
+    return frozenset(texts)
+
+
+def route_cell(value, default_texts: frozenset = frozenset()) -> str:
+
+    """
+    Определение маршрута ячейки перед проверкой орфографии
+
+    - passthrough: пустые и нестроковые значения, числа и даты, типовые ответы ("нет", "не имею"),
+      повторы текста шаблона;
+    - rules: текст только на латинице - correct_errors все равно удаляет латиницу из ответа модели,
+      поэтому результат получается правилом без вызова модели;
+    - neural: остальные ячейки.
+
+    Параметры:
+    value
+        Значение ячейки
+    default_texts : frozenset of str
+        Нормализованные тексты шаблона
+
+    Возвращает:
+    route : str
+        Один из маршрутов ROUTE_PASSTHROUGH, ROUTE_RULES, ROUTE_NEURAL
+    """
+
+    if not isinstance(value, str) or value.strip() == "": return ROUTE_PASSTHROUGH
+
+    normalized = _normalize(value)
+
+    if normalized in passthrough_answers or normalized in default_texts: return ROUTE_PASSTHROUGH
+
+    if pattern_numeric.match(value): return ROUTE_PASSTHROUGH
+
+    if pattern_latin.search(value) and not pattern_cyrillic.search(value): return ROUTE_RULES
+
+    return ROUTE_NEURAL
+
+
+def rule_correct(value: str) -> str:
+
+    "Исправление без модели: та же постобработка, что и в correct_errors (удаление латиницы)"
+
+    return re.sub('[a-zA-Z]+', '', value).strip()
+
+
+class CellRouter:
+
+    """
+    Класс-обертка над функцией исправления орфографии: ячейки, которым модель не поможет,
+    не отправляются в модель. Ведет подсчет ячеек по маршрутам (потокобезопасно)
+    и сообщает маршрут ячейки в trace (changeset.CellTrace), если он задан
+    """
+
+    def __init__(self, correct_fn, default_texts: frozenset = frozenset(), trace = None):
+
+        self.correct_fn = correct_fn
+        self.default_texts = default_texts
+        self.trace = trace
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, value):
+
+        route = route_cell(value, self.default_texts)
+
+        with self.lock:
+            self.counts[route] += 1
+
+        metrics.cells_routed.inc(route=route)
+
+        if self.trace is not None and route != ROUTE_NEURAL:
+            self.trace.path("passthrough" if route == ROUTE_PASSTHROUGH else "latin_rules")
+
+        # исправление моделью возвращает ответ без пробелов по краям - так же и без модели
+        if route == ROUTE_PASSTHROUGH: return value.strip() if isinstance(value, str) else value
+
+        if route == ROUTE_RULES: return rule_correct(value)
+
+        return self.correct_fn(value)
+
+    def report(self) -> str:
+
+        "Строка с числом ячеек по маршрутам для лога"
+
+        return ", ".join(f"{route}: {self.counts[route]}" for route in [ROUTE_PASSTHROUGH, ROUTE_RULES, ROUTE_NEURAL])
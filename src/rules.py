@@ -0,0 +1,249 @@
+import numpy as np
+import re
+import locale
+import pymorphy3
+from dateutil import parser
+from datetime import datetime
+
+from src.utilities import RussianParserInfo
+
+
+# Настройки
+locale.setlocale(locale.LC_ALL, 'ru_RU')
+m = pymorphy3.MorphAnalyzer()
+
+# Паттерны элементов адреса (условие 4)
+pattern_reg = "республика|респ\.|область|обл\.|край|кр\.|асср"
+pattern_subreg = "район|р-н"
+pattern_towncity = "г\.|гор\.|город|п\.|пос\.|поселок|гп|городское поселение|с\.|село"
+pattern_street = "ул\.|улица|б-р|бульвар|пр\.|проезд"
+pattern_house = "дом|д\."
+pattern_flat = "квартира|кв\."
+
+
+def correct_date_condition2(datestring: str) -> str:
+
+    """
+    Функция для проверки и корректировки по условию 2: 
+    Графы «Поступление» и «Увольнение» пункта 14 даты должны содержать только цифры и точки.
+
+    Функция проверяет соответствие даты формату ДД.ММ.ГГГГ или ММ.ГГГГ.
+    Функция угадывает формат даты, если указана дата в читаемом формате и возвращает строку в формате ММ.ГГГГ.
+    В противном случае функция оставляет в строке только числа и точки. 
+    В случае, если указано "по настоящее время" - текст не меняется.
+
+    Параметры:
+    datestring : str
+        Дата для форматирования
+
+    Возвращает:
+    string_out : str
+        Строка с датой в формате ДД.ГГГГ
+
+    """
+
+    if datestring.lower() == "по настоящее время": return datestring
+    
+    try:
+
+        dt = datetime.strptime(datestring, "%m.%Y")
+        return(datestring)
+    
+    except ValueError as e:
+
+        try:
+
+            dt = datetime.strptime(datestring, "%d.%m.%Y")
+            return(dt.strftime("%m.%Y"))
+        
+        except ValueError as e:
+
+            try: 
+                
+                return(date_guesser_corrector(datestring, "%m.%Y"))
+            
+            except Exception as e:
+
+                # нечитаемый формат даты
+                pass
+
+    return("".join(re.findall(pattern = "[0-9.]+", string = datestring)))
+
+
+def only_cyrillic(textstring: str) -> str:
+
+    """
+    Функция для проверки и корректировки по условию 3.1: 
+    1. Графа «Степень родства» пункта 15 должна содержать только буквы кириллицы
+
+    Параметры:
+    textstring : str
+        Текст для форматирования
+
+    Возвращает:
+    string_out : str
+        Строка, содержащая текст, состоящий только из символов кириллицы
+
+    """
+
+    return("".join(re.findall(pattern = "[а-яА-ЯёЁ ]+", string = textstring)))
+
+
+def last_surnames(textstring: str) -> str:
+
+    """
+    Функция для проверки и корректировки по условию 3.2: 
+    2. В графе «Фамилия, имя и отчество» предыдущие фамилии (девичьи, изменённые) указываются в скобках. 
+    Если у одного родственника несколько раз изменялась фамилия, то они указываются в скобках через запятую.
+
+    Параметры:
+    textstring : str
+        Текст для форматирования
+
+    Возвращает:
+    string_out : str
+        Строка, содержащая имя в соответсвующем формате
+
+    """
+
+    x = " ".join(re.findall(pattern = "[а-яА-ЯёЁ -]+", string = textstring)).split()
+
+    if len(x) > 3:
+        string_out = x[0] + " (" + ", ".join(x[1:-2]) + ") " + " ".join(x[-2:])
+    else:
+        string_out = " ".join(x)
+
+    return string_out
+
+
+def sort_address(adress_text: str) -> str:
+
+    """
+    Функция для проверки и корректировки по условию 4: 
+    При заполнении адресов проживания и работы сначала необходимо указывать регион: республику, край, область.
+
+    23.01.2024: DEPRECATED: Функция заменена на функцию address_reconstruct() из модуля spellcheck, 
+    данная функцию использует нейросеть для определения адресов.
+
+    Параметры:
+    adress_text : str
+        Адрес для форматирования
+
+    Возвращает:
+    adr_classes: numpy array of str
+        Массив из классов элементов адреса
+
+    string_out : str
+        Строка, содержащая адрес в необходимом формате
+
+    """
+
+    patterns = {"REGION": pattern_reg, 
+                "SUBREGION": pattern_subreg, 
+                "TOWNCITY": pattern_towncity, 
+                "STREET": pattern_street, 
+                "HOUSE": pattern_house,
+                "FLAT": pattern_flat,
+                "UNDEFINED": None}
+    
+    # создание словаря для сортировки элементов адреса
+    sort_dict = {key: elem for elem, key in list(enumerate(patterns.keys()))}
+
+    adr_tokens = adress_text.split(", ")
+    adr_classes = np.full(len(adr_tokens), "UNDEFINED")
+
+    # создание массива элементов адресов
+    for i, adr_token in enumerate(adr_tokens):
+
+        for key, pattern in patterns.items():
+
+            if key == "UNDEFINED": continue
+
+            # print(key)
+
+            res = re.findall(pattern, adr_token.lower())
+
+            if len(res) > 0:
+
+                if adr_classes[i] != "UNDEFINED":
+                    
+                    adr_classes[i] += "|" + key
+
+                else:
+
+                    adr_classes[i] = key
+
+    # print(adr_classes)
+    # print(adr_tokens)
+
+    # переформирование адреса
+    string_out = ", ".join([x for _, x in sorted(zip(adr_classes, adr_tokens), key = lambda pair: sort_dict[pair[0]])])
+
+    return string_out
+
+
+def case_corrector(string_in: str, word: str, case: str = "nomn") -> str:
+
+    """
+    Функция для исправления падежа слова в предложении. 
+    Делается через подстановку заполняемого выражения в строку и форматирование.
+
+    Параметры:
+    string_in : str
+        Строка, в которой есть слово для форматирования
+    word : str
+        Слово, которое необходимо скорректировать (используется как паттерн)
+    case : str
+        Падеж, в который необходимо просклонять слово
+
+    Возвращает:
+    string_out : str
+        Строка, содержащая слово в желаемом падеже
+    """
+
+    string_out = re.sub(word, "{replacement}", string_in)\
+            .format(replacement = m.parse(word)[0].inflect({case}).word.title())
+    
+    return string_out
+
+
+def date_guesser_corrector(datestring: str, target_format: str = "%Y, %d %B") -> str:
+
+    """
+    Функция для определения datetime из произвольного формата даты и конвертации полученного
+    datetime в указанный формат.
+
+    Параметры:
+    datestring : str
+        Строка, содержащая дату в произвольном формате (на русском)
+    target_format : str
+        Желаемый формат даты
+
+    Возвращает:
+    datestring_corrected : str
+        Строка, содержащая дату в желаемом формате
+    """
+
+    # Создание паттернов для поиска форматов и частей даты
+    date_pattern = "\%[a-zA-Z]"
+    pattern_split = "[0-9а-яА-Я]+"
+
+    formats = re.findall(date_pattern, target_format)
+
+    # Угадывание даты из строки
+    guessdate = parser.parse(datestring, 
+                             parserinfo = RussianParserInfo())                         
+    
+    # если в искомом формате присутствует месяц, необходимо применить верное склонение
+    if "%B" in formats: 
+        
+        guessdate_inner = guessdate.strftime("%d %B %Y")
+        dateparts_inner = re.findall(pattern_split, guessdate_inner)
+
+        datestring_corrected = case_corrector(guessdate.strftime(target_format), dateparts_inner[1], 'gent')
+    
+    else:
+
+        datestring_corrected = guessdate.strftime(target_format)
+    
+    return datestring_corrected
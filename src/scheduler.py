@@ -0,0 +1,196 @@
+import os
+import json
+import heapq
+import argparse
+import pandas as pd
+from datetime import datetime, timedelta
+from openpyxl import load_workbook
+
+from src.logger import logFile
+from src.config import tuned
+
+
+# Настройки планировщика
+priority_file = "data/priorities.json"   # {"имя файла": приоритет} - ручные приоритеты
+default_priority = 1                     # 0 - срочно, 1 - обычный, 2 - низкий
+aging_seconds = 2 * 3600                 # каждые aging_seconds ожидания повышают приоритет на 1
+seconds_per_form = 10                    # оценка времени обработки: постоянная часть
+seconds_per_cell = 1.5                   # оценка времени обработки: на одну текстовую ячейку
+deadline_time = "23:59:59"               # срок: конец дня подачи анкеты
+
+
+def submission_time(filename: str) -> datetime:
+
+    "Время подачи анкеты из timestamp в имени файла (формат %d%m%Y%H%M%S)"
+
+    return datetime.strptime(filename.split("_")[-1].split(".")[0], "%d%m%Y%H%M%S")
+
+
+def count_text_cells(path: str) -> int:
+
+    """
+    Число непустых текстовых ячеек анкеты (все листы) - оценка объема работы моделей.
+    Файл читается openpyxl в режиме read_only, без pandas и без загрузки стилей
+
+    Параметры:
+    path : str
+        Путь к файлу анкеты
+
+    Возвращает:
+    n_cells : int
+        Число текстовых ячеек
+    """
+
+    wb = load_workbook(path, read_only=True)
+    n_cells = 0
+
+    for ws in wb.worksheets:
+        for row in ws.iter_rows(values_only=True):
+            n_cells += sum(isinstance(value, str) and value.strip() != "" for value in row)
+
+    wb.close()
+
+    return n_cells
+
+
+def estimate_seconds(n_cells: int) -> float:
+
+    "Оценка времени обработки анкеты по числу текстовых ячеек"
+
+    return seconds_per_form + seconds_per_cell * n_cells
+
+
+def load_priorities(path: str = priority_file) -> dict:
+
+    "Ручные приоритеты анкет (пустой словарь, если файла нет)"
+
+    if not os.path.exists(path): return {}
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def effective_priority(priority: int, waited_seconds: float) -> int:
+
+    "Приоритет с учетом ожидания (aging): долго ожидающая анкета не может быть вытеснена навсегда"
+
+    return max(0, priority - int(max(0, waited_seconds) // aging_seconds))
+
+
+def schedule(file_names: list,
+             dir_in: str = "data/raw",
+             priorities: dict = None,
+             now: datetime = None,
+             n_workers: int = 1) -> pd.DataFrame:
+
+    """
+    Порядок обработки анкет: сначала по приоритету (с учетом ожидания), внутри приоритета -
+    кратчайшая анкета первой (shortest job first), при равенстве - более ранняя.
+    Для каждой анкеты рассчитывается ожидаемое время завершения при n_workers исполнителях
+    и проверяется срок (конец дня подачи)
+
+    Параметры:
+    file_names : list of str
+        Имена файлов анкет
+    dir_in : str
+        Папка с анкетами
+    priorities : dict
+        Ручные приоритеты {имя файла: приоритет} (по умолчанию - из priority_file)
+    now : datetime
+        Момент планирования (по умолчанию - текущее время)
+    n_workers : int
+        Число параллельных исполнителей
+
+    Возвращает:
+    plan : pd.DataFrame
+        Анкеты в порядке обработки: приоритет, оценка времени, ожидаемые начало и завершение, срок
+    """
+
+    if priorities is None: priorities = load_priorities()
+    if now is None: now = datetime.now()
+
+    deadline_clock = datetime.strptime(deadline_time, "%H:%M:%S").time()
+    rows = []
+
+    for filename in file_names:
+
+        submitted = submission_time(filename)
+        priority = int(priorities.get(filename, default_priority))
+
+        try:
+            n_cells = count_text_cells(os.path.join(dir_in, filename))
+        except Exception:
+            n_cells = 0
+
+        rows.append({"filename": filename,
+                     "submitted": submitted,
+                     "priority": priority,
+                     "effective_priority": effective_priority(priority, (now - submitted).total_seconds()),
+                     "cells": n_cells,
+                     "est_seconds": estimate_seconds(n_cells),
+                     "deadline": datetime.combine(submitted.date(), deadline_clock)})
+
+    rows.sort(key=lambda row: (row["effective_priority"], row["est_seconds"], row["submitted"]))
+
+    # ожидаемое время: анкета достается исполнителю, который освободится первым
+    workers = [now] * max(1, n_workers)
+    heapq.heapify(workers)
+
+    for row in rows:
+
+        start = heapq.heappop(workers)
+        row["expected_start"] = start
+        row["expected_done"] = start + timedelta(seconds=row["est_seconds"])
+        row["on_time"] = row["expected_done"] <= row["deadline"]
+        heapq.heappush(workers, row["expected_done"])
+
+    return pd.DataFrame(rows, columns=["filename", "submitted", "priority", "effective_priority", "cells", "est_seconds",
+                                       "expected_start", "expected_done", "deadline", "on_time"])
+
+
+def log_plan(plan: pd.DataFrame, verbose: bool = False):
+
+    "Запись плана обработки в лог; анкеты, не успевающие к сроку, записываются как ошибки"
+
+    log = logFile(operation = "Планирование обработки анкет")
+
+    for i, row in enumerate(plan.itertuples()):
+
+        msg = (f"{i}. {row.filename}: приоритет {row.effective_priority} ({row.priority}), ячеек {row.cells}, "
+               f"ожидаемое завершение {row.expected_done:%d-%m-%Y %H:%M:%S}, срок {row.deadline:%d-%m-%Y %H:%M:%S}")
+        log.write_log(msg, content = "MSG" if row.on_time else "ERR")
+        if verbose: print(msg)
+
+    log.close()
+
+
+if __name__ == "__main__":
+
+    from src.dircheck import get_new_file_names
+
+    arg_parser = argparse.ArgumentParser(description="План обработки анкет с учетом приоритета и срока")
+    arg_parser.add_argument("--workdir", default="data/")
+    arg_parser.add_argument("--priorities", default=priority_file, help="JSON с ручными приоритетами")
+    arg_parser.add_argument("--workers", type=int, default=tuned["n_workers"])
+    arg_parser.add_argument("--run", action="store_true", help="Обработать анкеты в порядке плана (file_processor)")
+    arg_parser.add_argument("--metrics-textfile", default="", help="Файл метрик обработки (--run) для textfile-коллектора node_exporter")
+    args = arg_parser.parse_args()
+
+    file_names = get_new_file_names(args.workdir + "raw", args.workdir + "processed")
+    plan = schedule(file_names, args.workdir + "raw", load_priorities(args.priorities), n_workers = args.workers)
+
+    log_plan(plan, verbose = True)
+    print(f"Успевают к сроку: {plan['on_time'].sum()} из {len(plan)}")
+
+    if args.run:
+
+        from src.processor import file_processor
+
+        for filename in plan["filename"]:
+            file_processor(filename, workdir = args.workdir)
+
+        if args.metrics_textfile != "":
+
+            from src import metrics
+
+            metrics.write_textfile(args.metrics_textfile)
@@ -0,0 +1,427 @@
+import asyncio
+import argparse
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+
+from src import metrics
+from src.logger import logFile
+from src.spellcheck import correct_errors_batch, name_reconstruct_batch, address_reconstruct_batch, registry, init_threads
+from src.processor import file_processor
+from src.budget import BudgetExceeded
+from src.config import tuned
+
+
+# Настройки сервиса
+host = "127.0.0.1"
+port = 8080
+max_batch_size = tuned["service_batch_size"]
+max_wait = 0.01
+max_forms = 2
+form_budget = None     # бюджет времени на анкету по умолчанию, с (None - без ограничения)
+
+xlsx_content_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+http_statuses = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class MicroBatcher:
+
+    """
+    Класс для объединения одновременных запросов в пакеты для модели.
+
+    Запросы накапливаются в очереди; пакет отправляется в модель, когда набрано max_batch_size
+    элементов или с момента первого элемента прошло max_wait секунд.
+    Пакетная функция выполняется в отдельном потоке, чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self,
+                 batch_fn,
+                 max_batch_size: int = max_batch_size,
+                 max_wait: float = max_wait,
+                 name: str = ""):
+
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+
+        self.queue = asyncio.Queue()
+        self.in_flight = 0
+        self.batches_done = 0
+        self.items_done = 0
+
+        # один поток на модель: пакеты для одной модели выполняются последовательно
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"batcher-{name}")
+        self.task = None
+
+    def start(self):
+
+        "Запуск фоновой задачи, формирующей пакеты"
+
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+
+        "Остановка фоновой задачи и пула потоков"
+
+        if self.task is not None:
+            self.task.cancel()
+
+        self.executor.shutdown(wait=True)
+
+    @property
+    def queue_depth(self) -> int:
+
+        "Число элементов, ожидающих обработки или обрабатываемых моделью"
+
+        return self.queue.qsize() + self.in_flight
+
+    async def submit(self, item):
+
+        "Поставить элемент в очередь и дождаться результата"
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+
+        return await future
+
+    async def run(self):
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            # добор пакета до max_batch_size в пределах max_wait
+            while len(batch) < self.max_batch_size:
+
+                timeout = deadline - loop.time()
+
+                if timeout <= 0: break
+
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            self.in_flight = len(batch)
+
+            try:
+
+                results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+
+                for (_, future), result in zip(batch, results):
+                    if not future.done(): future.set_result(result)
+
+            except Exception as e:
+
+                if len(batch) == 1:
+                    if not batch[0][1].done(): batch[0][1].set_exception(e)
+
+                # ошибка одного элемента не должна отменять весь пакет: элементы повторяются по одному,
+                # исключение получают только запросы с ошибочными элементами
+                else:
+                    await self._retry_items(batch)
+
+            self.in_flight = 0
+            self.batches_done += 1
+            self.items_done += len(batch)
+
+    async def _retry_items(self, batch: list):
+
+        "Обработка элементов упавшего пакета по одному"
+
+        loop = asyncio.get_running_loop()
+
+        for item, future in batch:
+
+            try:
+                result = (await loop.run_in_executor(self.executor, self.batch_fn, [item]))[0]
+            except Exception as e:
+                if not future.done(): future.set_exception(e)
+            else:
+                if not future.done(): future.set_result(result)
+
+    def status(self) -> dict:
+
+        return {"queue_depth": self.queue_depth,
+                "batches": self.batches_done,
+                "items": self.items_done,
+                "max_batch_size": self.max_batch_size,
+                "max_wait": self.max_wait}
+
+
+class CorrectorService:
+
+    """
+    Локальный HTTP-сервис для исправления анкет.
+
+    Эндпоинты:
+        POST /form?filename=<имя>.xlsx      - тело запроса: анкета xlsx, ответ: исправленный _check.xlsx
+        POST /correct_errors                - тело запроса: {"cells": [...]}, ответ: {"cells": [...]}
+        POST /name_reconstruct              - аналогично
+        POST /address_reconstruct           - аналогично
+        POST /reload                        - проверка файла версий моделей и замена изменившихся версий
+        GET  /status                        - глубина очередей и версии моделей
+        GET  /metrics                       - метрики в текстовом формате Prometheus
+
+    Модели загружаются при импорте модуля spellcheck; новые версии (файл версий, см. модуль registry)
+    загружаются в фоне и подменяются между пакетами, без остановки сервиса.
+    Ячейки из одновременных запросов (в том числе из обрабатываемых анкет) объединяются в пакеты.
+    """
+
+    def __init__(self,
+                 host: str = host,
+                 port: int = port,
+                 max_batch_size: int = max_batch_size,
+                 max_wait: float = max_wait,
+                 max_forms: int = max_forms,
+                 form_budget: float = form_budget,
+                 verbose: bool = False):
+
+        self.host = host
+        self.port = port
+        self.form_budget = form_budget
+        self.verbose = verbose
+
+        self.batchers = {"correct_errors": MicroBatcher(correct_errors_batch, max_batch_size, max_wait, "spell"),
+                         "name_reconstruct": MicroBatcher(name_reconstruct_batch, max_batch_size, max_wait, "names"),
+                         "address_reconstruct": MicroBatcher(address_reconstruct_batch, max_batch_size, max_wait, "addresses")}
+
+        # анкеты обрабатываются в отдельных потоках, ячейки отправляются в общие очереди
+        self.forms_executor = ThreadPoolExecutor(max_workers=max_forms, thread_name_prefix="form")
+        self.forms_in_flight = 0
+        self.forms_done = 0
+
+        self.log = None
+        self.loop = None
+
+    def _queue_submit(self, batcher_name: str):
+
+        """
+        Постановка ячейки в очередь из потока обработки анкеты без ожидания результата (возвращается Future).
+        Результаты колонки ожидаются после постановки всех ее ячеек (см. FormTable.map), 
+        поэтому ячейки одной анкеты объединяются в пакеты и без других анкет
+        """
+
+        batcher = self.batchers[batcher_name]
+
+        def submit(item):
+            return asyncio.run_coroutine_threadsafe(batcher.submit(item), self.loop)
+
+        return submit
+
+    def _process_form(self, body: bytes, filename: str, budget_seconds: float = None) -> bytes:
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+
+            workdir = tmpdir + "/"
+            os.makedirs(workdir + "raw")
+            os.makedirs(workdir + "processed")
+
+            with open(workdir + "raw/" + filename, "wb") as f:
+                f.write(body)
+
+            output_file = file_processor(filename,
+                                         workdir = workdir,
+                                         logfile = os.path.basename(self.log.log_filename),
+                                         verbose = self.verbose,
+                                         correct_fn = self._queue_submit("correct_errors"),
+                                         name_fn = self._queue_submit("name_reconstruct"),
+                                         address_fn = self._queue_submit("address_reconstruct"),
+                                         budget_seconds = budget_seconds)
+
+            with open(output_file, "rb") as f:
+                return f.read()
+
+    async def handle_form(self, query: dict, body: bytes) -> tuple:
+
+        filename = os.path.basename(query.get("filename", [""])[0])
+
+        if filename == "":
+            filename = "form_" + datetime.now().strftime("%d%m%Y%H%M%S") + ".xlsx"
+
+        if not filename.endswith(".xlsx"):
+            return 400, "application/json", json.dumps({"error": "Ожидается файл .xlsx"}).encode(), {}
+
+        try:
+            budget_seconds = float(query["budget"][0]) if "budget" in query else self.form_budget
+        except ValueError:
+            return 400, "application/json", json.dumps({"error": "Бюджет задается числом секунд"}).encode(), {}
+
+        self.forms_in_flight += 1
+
+        try:
+            content = await self.loop.run_in_executor(self.forms_executor, self._process_form, body, filename, budget_seconds)
+        except BudgetExceeded as e:
+            return 503, "application/json", json.dumps({"error": str(e)}, ensure_ascii=False).encode(), {}
+        finally:
+            self.forms_in_flight -= 1
+
+        self.forms_done += 1
+        self.log.write_log(f"{filename}: анкета обработана сервисом")
+
+        headers = {"Content-Disposition": f'attachment; filename="{filename.replace(".xlsx", "")}_check.xlsx"'}
+
+        return 200, xlsx_content_type, content, headers
+
+    async def handle_cells(self, batcher_name: str, body: bytes) -> tuple:
+
+        try:
+            cells = json.loads(body.decode("utf-8"))["cells"]
+        except Exception:
+            cells = None
+
+        if not isinstance(cells, list):
+            return 400, "application/json", json.dumps({"error": 'Ожидается JSON вида {"cells": [...]}'}).encode(), {}
+
+        batcher = self.batchers[batcher_name]
+
+        # в модель отправляется только текст: null, числа и т.п. возвращаются без изменений
+        results = list(cells)
+        texts = [i for i, cell in enumerate(cells) if isinstance(cell, str)]
+
+        for i, result in zip(texts, await asyncio.gather(*[batcher.submit(cells[i]) for i in texts])):
+            results[i] = result
+
+        return 200, "application/json", json.dumps({"cells": results}, ensure_ascii=False).encode(), {}
+
+    def status(self) -> dict:
+
+        return {"queues": {name: batcher.status() for name, batcher in self.batchers.items()},
+                "queue_depth": sum(batcher.queue_depth for batcher in self.batchers.values()),
+                "forms_in_flight": self.forms_in_flight,
+                "forms_done": self.forms_done,
+                "models_loaded": registry.loaded(),
+                "model_versions": registry.versions()}
+
+    async def route(self, method: str, path: str, query: dict, body: bytes) -> tuple:
+
+        if method == "GET" and path == "/status":
+            return 200, "application/json", json.dumps(self.status()).encode(), {}
+
+        if method == "GET" and path == "/metrics":
+            for name, batcher in self.batchers.items():
+                metrics.queue_depth.set(batcher.queue_depth, queue=name)
+
+            return 200, "text/plain; version=0.0.4; charset=utf-8", metrics.expose().encode("utf-8"), {}
+
+        if method == "POST" and path == "/reload":
+            deployed = await self.loop.run_in_executor(None, registry.check)
+            return 200, "application/json", json.dumps({"deployed": deployed, "model_versions": registry.versions()}).encode(), {}
+
+        if method == "POST" and path == "/form":
+            return await self.handle_form(query, body)
+
+        if method == "POST" and path.strip("/") in self.batchers:
+            return await self.handle_cells(path.strip("/"), body)
+
+        return 404, "application/json", json.dumps({"error": "Неизвестный адрес"}).encode(), {}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+
+        try:
+
+            request_line = (await reader.readline()).decode("latin-1").strip()
+
+            if request_line == "": return
+
+            method, target, _ = request_line.split(" ", 2)
+
+            headers = {}
+
+            while True:
+
+                line = (await reader.readline()).decode("latin-1").strip()
+
+                if line == "": break
+
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            url = urlsplit(target)
+
+            try:
+                status, content_type, content, extra_headers = await self.route(method, url.path, parse_qs(url.query), body)
+            except Exception as e:
+                self.log.write_log(f"Ошибка обработки запроса {method} {url.path}: {e}", content = "ERR")
+                status, content_type, content, extra_headers = \
+                    500, "application/json", json.dumps({"error": str(e)}, ensure_ascii=False).encode(), {}
+
+            response = [f"HTTP/1.1 {status} {http_statuses[status]}",
+                        f"Content-Type: {content_type}",
+                        f"Content-Length: {len(content)}",
+                        "Connection: close"]
+            response += [f"{key}: {value}" for key, value in extra_headers.items()]
+
+            writer.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1") + content)
+            await writer.drain()
+
+        except (ValueError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def serve(self):
+
+        self.loop = asyncio.get_running_loop()
+        self.log = logFile(operation = "Сервис исправления анкет")
+
+        init_threads()
+
+        for batcher in self.batchers.values():
+            batcher.start()
+
+        # замена версий моделей при изменении файла версий
+        registry.log = self.log
+        registry.watch()
+
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+
+        msg = f"Сервис запущен на {self.host}:{self.port}"
+        self.log.write_log(msg)
+        if self.verbose: print(msg)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for batcher in self.batchers.values():
+                await batcher.stop()
+
+            self.forms_executor.shutdown(wait=True)
+            registry.log = None
+            self.log.close()
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="Локальный HTTP-сервис исправления анкет")
+    arg_parser.add_argument("--host", default=host)
+    arg_parser.add_argument("--port", type=int, default=port)
+    arg_parser.add_argument("--max-batch-size", type=int, default=max_batch_size)
+    arg_parser.add_argument("--max-wait", type=float, default=max_wait, help="Максимальное ожидание пакета, с")
+    arg_parser.add_argument("--max-forms", type=int, default=max_forms, help="Число одновременно обрабатываемых анкет")
+    arg_parser.add_argument("--budget", type=float, default=form_budget, help="Бюджет времени на анкету, с")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    service = CorrectorService(host = args.host,
+                               port = args.port,
+                               max_batch_size = args.max_batch_size,
+                               max_wait = args.max_wait,
+                               max_forms = args.max_forms,
+                               form_budget = args.budget,
+                               verbose = args.verbose)
+
+    asyncio.run(service.serve())
@@ -0,0 +1,282 @@
+import argparse
+import time
+import torch
+import pandas as pd
+
+
+# Настройки
+draft_len = 10
+ngram_max = 3
+
+# Настройки generation_config, которые жадное декодирование с черновиком не воспроизводит:
+# (имя, значение по умолчанию) - при другом значении результат не совпал бы с generate
+unsupported_generation_settings = [("num_beams", 1),
+                                   ("do_sample", False),
+                                   ("forced_eos_token_id", None),
+                                   ("forced_decoder_ids", None),
+                                   ("repetition_penalty", 1.0),
+                                   ("no_repeat_ngram_size", 0),
+                                   ("encoder_no_repeat_ngram_size", 0),
+                                   ("bad_words_ids", None),
+                                   ("min_length", 0),
+                                   ("min_new_tokens", None),
+                                   ("suppress_tokens", None),
+                                   ("begin_suppress_tokens", None),
+                                   ("sequence_bias", None),
+                                   ("exponential_decay_length_penalty", None)]
+
+
+def unsupported_settings(model) -> list:
+
+    """
+    Настройки генерации модели, с которыми результат speculative_generate не совпадет с generate
+    (лучевой поиск, сэмплирование, обработчики логитов)
+
+    Параметры:
+    model : M2M100ForConditionalGeneration
+        Модель
+
+    Возвращает:
+    settings : list of str
+        Настройки в виде "имя=значение" (пустой список - спекулятивное декодирование применимо)
+    """
+
+    config = model.generation_config if hasattr(model, "generation_config") else model.config
+
+    settings = []
+
+    for name, default in unsupported_generation_settings:
+
+        value = getattr(config, name, default)
+
+        if value is not None and value != default and not (isinstance(value, (list, dict)) and len(value) == 0):
+            settings.append(f"{name}={value}")
+
+    return settings
+
+
+def _lookup_draft(seq: list, source: list, cursor: int, draft_len: int = draft_len, ngram_max: int = ngram_max) -> tuple:
+
+    """
+    Поиск черновика в исходном тексте (prompt lookup): последние n токенов выхода ищутся в исходной
+    последовательности, черновиком становятся следующие за совпадением токены.
+    Предпочтение отдается совпадениям не левее позиции предыдущего совпадения (cursor),
+    так как исправленный текст почти повторяет исходный по порядку.
+
+    Возвращает:
+    draft : list of int
+        Токены черновика (пустой список, если совпадений нет)
+    cursor : int
+        Позиция в исходной последовательности, следующая за черновиком
+    """
+
+    for n in range(min(ngram_max, len(seq)), 0, -1):
+
+        pattern = seq[-n:]
+        matches = [i for i in range(len(source) - n) if source[i:i+n] == pattern]
+
+        if len(matches) == 0: continue
+
+        ahead = [i for i in matches if i + n >= cursor]
+        i = ahead[0] if len(ahead) > 0 else matches[0]
+
+        draft = source[i+n:i+n+draft_len]
+
+        return draft, i + n + len(draft)
+
+    return [], cursor
+
+
+def _crop_cache(past_key_values, length: int):
+
+    "Обрезка кэша self-attention декодера до length позиций (кэш cross-attention не меняется)"
+
+    if hasattr(past_key_values, "crop"):
+        past_key_values.crop(length)
+        return past_key_values
+
+    # старый формат кэша: кортеж (self_k, self_v, cross_k, cross_v) для каждого слоя
+    return tuple((layer[0][:, :, :length], layer[1][:, :, :length]) + tuple(layer[2:]) for layer in past_key_values)
+
+
+@torch.no_grad()
+def speculative_generate(model,
+                         input_ids: torch.Tensor,
+                         attention_mask: torch.Tensor = None,
+                         forced_bos_token_id: int = None,
+                         max_new_tokens: int = 200,
+                         draft_len: int = draft_len,
+                         ngram_max: int = ngram_max) -> tuple:
+
+    """
+    Жадное декодирование с проверкой черновика из исходного текста (prompt lookup decoding).
+
+    На каждом шаге декодер получает уже принятые токены и черновик - продолжение совпавшего
+    фрагмента исходного текста. За один проход декодера проверяются все токены черновика:
+    принимается самый длинный префикс, совпадающий с argmax модели, и еще один токен модели.
+    Результат совпадает с жадным декодированием generate(num_beams=1, do_sample=False),
+    а число проходов декодера сокращается, если выход почти повторяет вход.
+    Если в конфигурации генерации модели заданы настройки, которые здесь не воспроизводятся
+    (см. unsupported_settings), - исключение ValueError: вызывающий код использует generate.
+
+    Параметры:
+    model : M2M100ForConditionalGeneration
+        Модель (в т.ч. квантизованная)
+    input_ids : torch.Tensor
+        Токены исходного текста, размер [1, длина]
+    attention_mask : torch.Tensor
+        Маска исходного текста
+    forced_bos_token_id : int
+        Токен, принудительно генерируемый первым (код языка); по умолчанию - из конфигурации генерации
+    max_new_tokens : int
+        Максимальное число генерируемых токенов
+    draft_len : int
+        Максимальная длина черновика
+    ngram_max : int
+        Максимальная длина n-граммы для поиска в исходном тексте
+
+    Возвращает:
+    sequence : torch.Tensor
+        Сгенерированная последовательность размера [1, длина] (как у generate)
+    n_forward : int
+        Число проходов декодера
+    """
+
+    assert input_ids.shape[0] == 1, "Поддерживается только одна последовательность"
+
+    settings = unsupported_settings(model)
+
+    if len(settings) > 0:
+        raise ValueError(f"Спекулятивное декодирование не воспроизводит настройки генерации: {', '.join(settings)}")
+
+    config = model.generation_config if hasattr(model, "generation_config") else model.config
+
+    if forced_bos_token_id is None: forced_bos_token_id = getattr(config, "forced_bos_token_id", None)
+
+    eos_token_id = config.eos_token_id
+    eos_token_ids = set(eos_token_id) if isinstance(eos_token_id, list) else {eos_token_id}
+
+    encoder_outputs = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask, return_dict=True)
+
+    seq = [config.decoder_start_token_id]
+    n_new = 0
+
+    # первый генерируемый токен (код языка) задан заранее
+    if forced_bos_token_id is not None:
+        seq.append(forced_bos_token_id)
+        n_new += 1
+
+    source = input_ids[0].tolist()
+    cursor = 0
+
+    pending = list(seq)
+    past_key_values = None
+    n_forward = 0
+
+    # начальный токен декодера может совпадать с токеном конца (у M2M100 - </s>): конец проверяется только у новых токенов
+    while n_new < max_new_tokens and (n_new == 0 or seq[-1] not in eos_token_ids):
+
+        draft, cursor = _lookup_draft(seq, source, cursor, min(draft_len, max_new_tokens - n_new - 1), ngram_max)
+
+        outputs = model(encoder_outputs=encoder_outputs,
+                        attention_mask=attention_mask,
+                        decoder_input_ids=torch.tensor([pending + draft], device=input_ids.device),
+                        past_key_values=past_key_values,
+                        use_cache=True,
+                        return_dict=True)
+        n_forward += 1
+
+        predictions = outputs.logits[0].argmax(-1).tolist()
+
+        # predictions[len(pending) - 1 + j] - следующий токен после seq + draft[:j]
+        accepted = []
+
+        for j in range(len(draft) + 1):
+
+            token = predictions[len(pending) - 1 + j]
+            accepted.append(token)
+
+            if token in eos_token_ids or j == len(draft) or draft[j] != token: break
+
+        accepted = accepted[:max_new_tokens - n_new]
+
+        seq += accepted
+        n_new += len(accepted)
+
+        # в кэше остаются только позиции принятых токенов, последний принятый токен подается на следующем шаге
+        past_key_values = _crop_cache(outputs.past_key_values, len(seq) - 1)
+        pending = [seq[-1]]
+
+    return torch.tensor([seq], device=input_ids.device), n_forward
+
+
+def benchmark(sentences: list, draft_len: int = draft_len) -> pd.DataFrame:
+
+    """
+    Сравнение спекулятивного декодирования с текущим вызовом generate модуля spellcheck
+    и с жадным generate: время, число проходов декодера и совпадение результата с жадным декодированием
+
+    Параметры:
+    sentences : list of str
+        Тексты для проверки
+    draft_len : int
+        Максимальная длина черновика
+
+    Возвращает:
+    results : pd.DataFrame
+        Таблица результатов по каждому тексту
+    """
+
+    from src.spellcheck import model_M100_spell, tokenizer_M100_spell, lang_id_ru
+
+    rows = []
+
+    for sentence in sentences:
+
+        encodings = tokenizer_M100_spell(sentence, return_tensors="pt")
+
+        start = time.perf_counter()
+        model_M100_spell.generate(**encodings, forced_bos_token_id=lang_id_ru, max_new_tokens=200)
+        time_generate = time.perf_counter() - start
+
+        start = time.perf_counter()
+        greedy = model_M100_spell.generate(**encodings, forced_bos_token_id=lang_id_ru, max_new_tokens=200,
+                                           num_beams=1, do_sample=False)
+        time_greedy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        speculative, n_forward = speculative_generate(model_M100_spell, encodings["input_ids"], encodings["attention_mask"],
+                                                      forced_bos_token_id=lang_id_ru, max_new_tokens=200, draft_len=draft_len)
+        time_speculative = time.perf_counter() - start
+
+        rows.append({"text": sentence,
+                     "time_generate": time_generate,
+                     "time_greedy": time_greedy,
+                     "time_speculative": time_speculative,
+                     # жадный generate: один проход декодера на каждый токен после начального
+                     "forward_greedy": greedy.shape[1] - 1,
+                     "forward_speculative": n_forward,
+                     "identical": greedy[0].tolist() == speculative[0].tolist()})
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+
+    from src.tokenizer_convert import sample_texts, form_texts
+
+    arg_parser = argparse.ArgumentParser(description="Сравнение спекулятивного декодирования с generate")
+    arg_parser.add_argument("--check-dir", default="", help="Папка с анкетами (по умолчанию - встроенные примеры)")
+    arg_parser.add_argument("--draft-len", type=int, default=draft_len)
+    arg_parser.add_argument("--limit", type=int, default=50)
+    args = arg_parser.parse_args()
+
+    texts = form_texts(args.check_dir) if args.check_dir != "" else sample_texts
+    results = benchmark(texts[:args.limit], args.draft_len)
+
+    print(results.drop(columns="text").to_string())
+    print(f"\nСовпадает с жадным декодированием: {results['identical'].mean():.0%}")
+    print(f"Проходов декодера: {results['forward_greedy'].sum()} -> {results['forward_speculative'].sum()} "
+          f"(в {results['forward_greedy'].sum() / results['forward_speculative'].sum():.1f} раз меньше)")
+    print(f"Время: generate {results['time_generate'].sum():.2f} с, жадный {results['time_greedy'].sum():.2f} с, "
+          f"спекулятивный {results['time_speculative'].sum():.2f} с")
@@ -1,8 +1,17 @@
 from transformers import M2M100ForConditionalGeneration, M2M100Tokenizer, pipeline, \
-    AutoModelForTokenClassification, AutoTokenizer
+    AutoModelForTokenClassification, AutoTokenizer, PreTrainedTokenizerFast
 import numpy as np
+import os
 import re
+import threading
 import torch
+from contextlib import contextmanager
+
+from src import metrics
+from src.speculative import speculative_generate, unsupported_settings
+from src.ner_packing import packed_token_classification
+from src.registry import ModelRegistry, read_manifest
+from src.config import tuned
 
 # Универсальный путь (на HuggingFace)
 # path_to_model = "ai-forever/RuM2M100-1.2B" 
@@ -11,61 +20,496 @@ import torch
 # path_to_model_spell = "model/M2M100ForConditionalGeneration/" 
 # path_to_tokenizer_spell = "model/M2M100Tokenizer/"
 
-path_to_model_spell = "model/M2M100_spellchecker/quantized_model.pt" 
-path_to_tokenizer_spell = "model/M2M100_tokenizer/"
+# Вариант модели исправления орфографии:
+#   "full" - исходный словарь
+#   "ru"   - словарь, сокращенный до русских токенов (создается модулем vocab_prune)
+spell_variant = "full"
+
+spell_variants = {"full": {"model": "model/M2M100_spellchecker/quantized_model.pt",
+                           "tokenizer": "model/M2M100_tokenizer/",
+                           "tokenizer_fast": "model/M2M100_tokenizer_fast/"},
+                  "ru": {"model": "model/M2M100_spellchecker/quantized_model_ru.pt",
+                         "tokenizer": "model/M2M100_tokenizer_ru/",
+                         "tokenizer_fast": "model/M2M100_tokenizer_ru_fast/"}}
+
+path_to_model_spell = spell_variants[spell_variant]["model"]
+path_to_tokenizer_spell = spell_variants[spell_variant]["tokenizer"]
+
+# Быстрый токенизатор (создается модулем tokenizer_convert), используется при наличии
+path_to_tokenizer_spell_fast = spell_variants[spell_variant]["tokenizer_fast"]
 
 path_to_model_NER_names = "model/stable/bert-finetuned-ner-names-accelerate" 
 path_to_model_NER_addresses = "model/stable/bert-finetuned-ner-addresses-accelerate" 
 
+# Режим декодирования для исправления орфографии:
+#   "generate"    - стандартный generate модели
+#   "speculative" - жадное декодирование с черновиком из исходного текста (см. модуль speculative);
+#                   результат совпадает с generate, поэтому если в конфигурации генерации модели задан лучевой поиск
+#                   или обработчики логитов, которые спекулятивное декодирование не воспроизводит, используется generate
+# Значения по умолчанию здесь и ниже подбираются для хоста модулем autotune (см. модуль config)
+spell_decoding = tuned["spell_decoding"]
+
+# Число частей текста в одном вызове generate и число текстов в одном вызове NER-модели
+spell_batch_size = tuned["spell_batch_size"]
+ner_batch_size = tuned["ner_batch_size"]
+
+# Разбиение длинных ячеек перед исправлением орфографии: ячейка длиннее segment_min_chars символов
+# делится на предложения, предложения длиннее segment_max_chars - по запятым; части исправляются одним пакетом
+segment_min_chars = 120
+segment_max_chars = 80
+
+# Граница предложения: знак конца после слова не короче 4 букв (не сокращение "г.", "ул.", "им.", инициалы),
+# далее пробел и заглавная буква, цифра или кавычка
+pattern_sentence_sep = re.compile(r"(?<=[^\W\d_]{4})[.!?;…]+\s+(?=[А-ЯЁA-Z0-9«\"(])")
+pattern_comma_sep = re.compile(r",\s+")
+
+# Компактная модель-ученик (создается модулем distill): ячейка исправляется учеником,
+# а при уверенности ниже student_threshold (среднее геометрическое вероятностей токенов) - исходной моделью.
+# Версия ученика ведется реестром (имя "spellcheck_student"), как и версии остальных моделей
+use_student = False
+path_to_model_student = "model/M2M100_student/"
+student_threshold = 0.8
+
+# Упаковка частей адресов (", ") в общие последовательности NER-модели вместо отдельной последовательности 
+# на каждую часть (см. модуль ner_packing); результат совпадает с обычным вызовом пайплайна
+pack_addresses = True
+packs_per_batch = tuned["packs_per_batch"]
+
+# Число потоков torch, доступных процессу (делится между одновременно обрабатываемыми листами).
+# Задается точкой входа процесса (init_threads): импорт модуля настройки torch не меняет
+torch_threads = torch.get_num_threads()
+
+# Прогрев новой версии модели перед заменой (см. registry)
+warmup_spell = ["Фамилию, имя, отчество не изменял", "г. Москва, ул. Ленина, д. 1, кв. 5"]
+warmup_names = ["Иванов", "Иван", "Иванович"]
+warmup_addresses = ["Республика Татарстан", "г. Казань", "ул. Баумана", "д. 5"]
+
+label_names_NER = {"ner_names": ['PER-NAME', 'PER-SURN', 'PER-PATR'],
+                   "ner_addresses": ["LOC-REG", 
+                                     "LOC-DIST", 
+                                     "LOC-SETL", 
+                                     "LOC-CDIST", 
+                                     "LOC-STRT", 
+                                     "LOC-HOUS", 
+                                     "LOC-FLAT"]}
+
 # Определение моделей
 
-## Spellchecker
-# model_M100_spell = M2M100ForConditionalGeneration.from_pretrained(path_to_model_spell)
-tokenizer_M100_spell = M2M100Tokenizer.from_pretrained(path_to_tokenizer_spell)
+def load_spellcheck(entry: dict) -> dict:
 
-model_M100_spell = torch.load(path_to_model_spell)
-model_M100_spell.eval()
+    """
+    Загрузка версии модели исправления орфографии
 
-## NER для имен
-label_names = ['PER-NAME', 'PER-SURN', 'PER-PATR']
+    Параметры:
+    entry : dict
+        Запись файла версий: пути model, tokenizer и (необязательно) tokenizer_fast
 
-id2label = {i: label for i, label in enumerate(label_names)}
-label2id = {v: k for k, v in id2label.items()}
+    Возвращает:
+    spell : dict
+        Модель, токенизатор и идентификатор русского языка
+    """
 
-model_NER_name = AutoModelForTokenClassification.from_pretrained(path_to_model_NER_names,
-                                                               id2label=id2label,
-                                                               label2id=label2id)
-tokenizer_NER_name = AutoTokenizer.from_pretrained(path_to_model_NER_names, use_fast=True)
+    # model_M100_spell = M2M100ForConditionalGeneration.from_pretrained(path_to_model_spell)
+    if os.path.exists(entry.get("tokenizer_fast", "")):
+        tokenizer = PreTrainedTokenizerFast.from_pretrained(entry["tokenizer_fast"])
+    else:
+        tokenizer = M2M100Tokenizer.from_pretrained(entry["tokenizer"])
 
-token_classifier_name = pipeline(
-    "token-classification", model=model_NER_name, aggregation_strategy="simple", tokenizer=tokenizer_NER_name
-)
+    model = torch.load(entry["model"])
+    model.eval()
+
+    # у быстрого токенизатора нет get_lang_id, поэтому идентификатор языка определяется по токену
+    return {"model": model, "tokenizer": tokenizer, "lang_id": tokenizer.convert_tokens_to_ids("__ru__")}
+
+
+def load_ner(entry: dict, name: str):
+
+    "Загрузка версии NER-модели (entry[\"path\"]) и создание пайплайна с объединением токенов в сущности"
+
+    id2label = {i: label for i, label in enumerate(label_names_NER[name])}
+    label2id = {v: k for k, v in id2label.items()}
+
+    model = AutoModelForTokenClassification.from_pretrained(entry["path"],
+                                                            id2label=id2label,
+                                                            label2id=label2id)
+
+    tokenizer = AutoTokenizer.from_pretrained(entry["path"], use_fast=True)
+
+    return pipeline("token-classification", model=model, aggregation_strategy="simple", tokenizer=tokenizer)
+
+
+def load_student(entry: dict):
+
+    """
+    Загрузка версии модели-ученика (entry["path"]). Ученик работает только с тем словарем, на котором обучен:
+    версия, словарь которой не совпадает с текущим токенизатором исправления орфографии, не загружается
+    """
+
+    student = M2M100ForConditionalGeneration.from_pretrained(entry["path"])
+    student.eval()
+
+    with registry.acquire("spellcheck") as spell:
+        if not _student_matches(student, spell):
+            raise ValueError(f"Словарь модели {entry['path']} не совпадает с токенизатором модели исправления орфографии")
+
+    return student
+
+
+def _student_matches(student, spell: dict) -> bool:
+
+    return student.config.vocab_size == len(spell["tokenizer"])
 
-## NER для адресов
-label_names = ["LOC-REG", 
-               "LOC-DIST", 
-               "LOC-SETL", 
-               "LOC-CDIST", 
-               "LOC-STRT", 
-               "LOC-HOUS", 
-               "LOC-FLAT"]
 
-id2label = {i: label for i, label in enumerate(label_names)}
-label2id = {v: k for k, v in id2label.items()}
+def _warmup_student(student):
 
-model_NER_adr = AutoModelForTokenClassification.from_pretrained(path_to_model_NER_addresses,
-                                                               id2label=id2label,
-                                                               label2id=label2id)
+    "Прогрев модели-ученика на токенизаторе текущей версии модели исправления орфографии"
 
-tokenizer_NER_adr = AutoTokenizer.from_pretrained(path_to_model_NER_addresses, use_fast=True)
+    with registry.acquire("spellcheck") as spell:
+        _student_generate(spell["tokenizer"](warmup_spell, return_tensors="pt", padding=True), spell, student)
 
-token_classifier_adr = pipeline(
-    "token-classification", model=model_NER_adr, aggregation_strategy="simple", tokenizer=tokenizer_NER_adr
-)
+
+def _warmup_spellcheck(spell: dict):
+
+    "Прогрев модели исправления орфографии (без учета в метриках)"
+
+    encodings = spell["tokenizer"](warmup_spell, return_tensors="pt", padding=True)
+    spell["model"].generate(**encodings, forced_bos_token_id=spell["lang_id"], max_new_tokens = 200)
+
+
+def _bind_globals(name: str, model_version):
+
+    "Глобальные имена моделей указывают на текущую версию (для кода, обращающегося к ним напрямую)"
+
+    global model_M100_spell, tokenizer_M100_spell, lang_id_ru, token_classifier_name, token_classifier_adr, model_student
+
+    if name == "spellcheck":
+        model_M100_spell = model_version.handles["model"]
+        tokenizer_M100_spell = model_version.handles["tokenizer"]
+        lang_id_ru = model_version.handles["lang_id"]
+
+    elif name == "ner_names":
+        token_classifier_name = model_version.handles
+
+    elif name == "ner_addresses":
+        token_classifier_adr = model_version.handles
+
+    elif name == "spellcheck_student":
+        model_student = model_version.handles
+
+
+## Реестр версий: модели загружаются по файлу версий (или по путям выше) и могут заменяться без остановки процесса
+registry = ModelRegistry()
+registry.add_listener(_bind_globals)
+
+## Spellchecker
+_bind_globals("spellcheck", registry.register("spellcheck",
+                                              load_spellcheck,
+                                              _warmup_spellcheck,
+                                              {"version": spell_variant,
+                                               "model": path_to_model_spell,
+                                               "tokenizer": path_to_tokenizer_spell,
+                                               "tokenizer_fast": path_to_tokenizer_spell_fast}))
+
+## Компактная модель-ученик (с тем же словарем, что и исходная модель, - проверяется при загрузке)
+model_student = None
+
+if use_student and (os.path.exists(path_to_model_student) or "spellcheck_student" in read_manifest(registry.manifest_path)):
+    _bind_globals("spellcheck_student", registry.register("spellcheck_student",
+                                                          load_student,
+                                                          _warmup_student,
+                                                          {"version": "student", "path": path_to_model_student}))
+
+## NER для имен
+_bind_globals("ner_names", registry.register("ner_names",
+                                             lambda entry: load_ner(entry, "ner_names"),
+                                             lambda token_classifier: token_classifier(warmup_names),
+                                             {"version": "stable", "path": path_to_model_NER_names}))
+
+## NER для адресов
+_bind_globals("ner_addresses", registry.register("ner_addresses",
+                                                 lambda entry: load_ner(entry, "ner_addresses"),
+                                                 lambda token_classifier: token_classifier(warmup_addresses),
+                                                 {"version": "stable", "path": path_to_model_NER_addresses}))
 
 
 # Функции
 
+def set_thread_budget(n_threads: int):
+
+    """
+    Число потоков torch для всего процесса (torch.set_num_threads действует на все потоки процесса,
+    а не только на вызывающий). Для временного ограничения используется thread_budget
+    """
+
+    torch.set_num_threads(max(1, n_threads))
+
+
+def init_threads(n_threads: int = None):
+
+    """
+    Число потоков torch процесса: вызывается при запуске исполнителя или сервиса
+
+    Параметры:
+    n_threads : int
+        Число потоков (по умолчанию - подобранное для хоста, см. модуль config)
+    """
+
+    global torch_threads
+
+    torch_threads = max(1, tuned["torch_threads"] if n_threads is None else n_threads)
+    set_thread_budget(torch_threads)
+
+
+# Одновременные ограничения числа потоков (анкеты, обрабатываемые параллельно в одном процессе)
+_thread_budget_lock = threading.Lock()
+_thread_budget_users = 0
+_threads_before = None
+
+
+@contextmanager
+def thread_budget(n_threads: int):
+
+    """
+    Ограничение числа потоков torch на время блока с восстановлением прежнего значения.
+    Используется при одновременной обработке листов анкеты. Ограничение действует на весь процесс,
+    поэтому при одновременных блоках (несколько анкет в сервисе) число потоков задает первый блок,
+    а прежнее значение восстанавливается при выходе из последнего
+
+    Пример:
+    with thread_budget(torch_threads // 4):
+        ...
+    """
+
+    global _thread_budget_users, _threads_before
+
+    with _thread_budget_lock:
+
+        if _thread_budget_users == 0:
+            _threads_before = torch.get_num_threads()
+            set_thread_budget(n_threads)
+
+        _thread_budget_users += 1
+
+    try:
+        yield
+    finally:
+        with _thread_budget_lock:
+
+            _thread_budget_users -= 1
+
+            if _thread_budget_users == 0: set_thread_budget(_threads_before)
+
+
+def _generate(encodings, spell: dict):
+
+    "Вызов generate модели исправления орфографии (версии spell из реестра) с учетом метрик"
+
+    with metrics.model_latency.time(model="spellcheck"):
+
+        if spell_decoding == "speculative" and len(unsupported_settings(spell["model"])) == 0:
+            generated_tokens = _speculative_batch(encodings, spell)
+        else:
+            generated_tokens = spell["model"].generate(**encodings, 
+                                                       forced_bos_token_id=spell["lang_id"], 
+                                                       max_new_tokens = 200)
+
+    for row in generated_tokens:
+        metrics.tokens_generated.observe(int((row != spell["tokenizer"].pad_token_id).sum()))
+
+    return generated_tokens
+
+
+def _speculative_batch(encodings, spell: dict):
+
+    "Спекулятивное декодирование для каждой строки пакета, результаты дополняются до общей длины"
+
+    sequences = []
+
+    for input_ids, attention_mask in zip(encodings["input_ids"], encodings["attention_mask"]):
+
+        length = int(attention_mask.sum())
+
+        sequence, _ = speculative_generate(spell["model"], 
+                                           input_ids[:length].unsqueeze(0), 
+                                           attention_mask[:length].unsqueeze(0),
+                                           forced_bos_token_id=spell["lang_id"], 
+                                           max_new_tokens = 200)
+        sequences.append(sequence[0])
+
+    return torch.nn.utils.rnn.pad_sequence(sequences, batch_first=True, padding_value=spell["tokenizer"].pad_token_id)
+
+
+def _ner_call(tokens: list, model_name: str, packed: bool = False):
+
+    "Вызов текущей версии NER-пайплайна из реестра с учетом метрик (packed - с упаковкой коротких текстов)"
+
+    metrics.ner_calls.inc(model=model_name)
+
+    with registry.acquire(model_name) as token_classifier, metrics.model_latency.time(model=model_name):
+
+        if packed: return packed_token_classification(token_classifier, tokens, packs_per_batch = packs_per_batch)
+
+        return token_classifier(tokens, batch_size = ner_batch_size)
+
+
+def split_segments(text: str, min_chars: int = segment_min_chars, max_chars: int = segment_max_chars) -> list:
+
+    """
+    Разбиение длинного текста на части для исправления орфографии.
+    Текст делится по границам предложений; предложение длиннее max_chars делится по запятым,
+    соседние части по запятым объединяются, пока длина не превышает max_chars (или часть короче max_chars / 4).
+    Разделители (знаки препинания и пробелы между частями) сохраняются без изменений:
+    "".join(segment + separator) == text
+
+    Параметры:
+    text : str
+        Текст ячейки
+    min_chars : int
+        Текст не длиннее min_chars не разбивается
+    max_chars : int
+        Желаемая максимальная длина части
+
+    Возвращает:
+    parts : list of tuple (str, str)
+        Части текста и следующие за ними разделители (у последней части - пустая строка)
+    """
+
+    if len(text) <= min_chars: return [(text, "")]
+
+    # все возможные границы: (начало разделителя, конец разделителя, граница предложения)
+    bounds = [(m.start(), m.end(), True) for m in pattern_sentence_sep.finditer(text)]
+    sentence_ends = {start for start, _, _ in bounds}
+    bounds += [(m.start(), m.end(), False) for m in pattern_comma_sep.finditer(text) if m.start() not in sentence_ends]
+    bounds.sort()
+
+    parts = []
+    segment_start = 0
+
+    for i, (start, end, is_sentence) in enumerate(bounds):
+
+        # по запятой - только если следующий фрагмент не помещается в текущую часть,
+        # а текущая часть не слишком короткая (модели нужен контекст)
+        if not is_sentence:
+            next_end = bounds[i + 1][0] if i + 1 < len(bounds) else len(text)
+            if next_end - segment_start <= max_chars or start - segment_start < max_chars // 4: continue
+
+        parts.append((text[segment_start:start], text[start:end]))
+        segment_start = end
+
+    parts.append((text[segment_start:], ""))
+
+    return parts
+
+
+def teacher_correct_batch(sentences_in: list) -> list:
+
+    "Исправление орфографии пакета предложений исходной моделью одним вызовом generate (без разбиения)"
+
+    with registry.acquire("spellcheck") as spell:
+        return _teacher_batch(sentences_in, spell)
+
+
+def _teacher_batch(sentences_in: list, spell: dict) -> list:
+
+    encodings = spell["tokenizer"](list(sentences_in), return_tensors="pt", padding=True)
+
+    generated_tokens = _generate(encodings, spell)
+    
+    answers = spell["tokenizer"].batch_decode(generated_tokens, skip_special_tokens=True)
+
+    return [re.sub('[a-zA-Z]+', '', answer).strip() for answer in answers]
+
+
+@contextmanager
+def _acquire_spell():
+
+    """
+    Версии модели исправления орфографии и модели-ученика (None, если ученик не используется) на время вызова.
+    Ученик не используется, если после смены версии токенизатора его словарь не совпадает с новым
+
+    Пример:
+    with _acquire_spell() as (spell, student):
+        _correct_batch(sentences, spell, student)
+    """
+
+    with registry.acquire("spellcheck") as spell:
+
+        if "spellcheck_student" not in registry.versions():
+            yield spell, None
+            return
+
+        with registry.acquire("spellcheck_student") as student:
+            yield spell, student if _student_matches(student, spell) else None
+
+
+@torch.no_grad()
+def _student_generate(encodings, spell: dict, student) -> tuple:
+
+    """
+    Жадное декодирование моделью-учеником с оценкой уверенности
+
+    Возвращает:
+    generated_tokens : torch.Tensor
+        Сгенерированные последовательности
+    confidence : list of float
+        Среднее геометрическое вероятностей сгенерированных токенов для каждой последовательности
+    """
+
+    with metrics.model_latency.time(model="spellcheck_student"):
+
+        outputs = student.generate(**encodings,
+                                   forced_bos_token_id=spell["lang_id"],
+                                   max_new_tokens = 200,
+                                   num_beams = 1,
+                                   do_sample = False,
+                                   output_scores = True,
+                                   return_dict_in_generate = True)
+
+    # логарифмы вероятностей выбранных токенов; токены после конца последовательности не учитываются,
+    # как и первый шаг - код языка (forced_bos_token_id) задается принудительно и имеет вероятность 1
+    log_probs = student.compute_transition_scores(outputs.sequences, outputs.scores, normalize_logits=True)
+    generated = outputs.sequences[:, -log_probs.shape[1]:]
+    mask = (generated != spell["tokenizer"].pad_token_id).float()
+    mask[:, 0] = 0
+
+    confidence = ((log_probs * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)).exp().tolist()
+
+    return outputs.sequences, confidence
+
+
+def _correct_batch(sentences_in: list, spell: dict, student = None) -> list:
+
+    """
+    Исправление орфографии пакета предложений (без разбиения) версиями моделей, полученными через _acquire_spell.
+    При модели-ученике предложения исправляются ею, а предложения с уверенностью ниже student_threshold - исходной моделью
+    """
+
+    if student is None: return _teacher_batch(sentences_in, spell)
+
+    return _student_batch(sentences_in, spell, student)
+
+
+def _student_batch(sentences_in: list, spell: dict, student) -> list:
+
+    encodings = spell["tokenizer"](list(sentences_in), return_tensors="pt", padding=True)
+
+    generated_tokens, confidence = _student_generate(encodings, spell, student)
+
+    answers = [re.sub('[a-zA-Z]+', '', answer).strip() 
+               for answer in spell["tokenizer"].batch_decode(generated_tokens, skip_special_tokens=True)]
+
+    escalated = [i for i, value in enumerate(confidence) if value < student_threshold]
+
+    if len(escalated) > 0:
+
+        metrics.cells_escalated.inc(len(escalated))
+
+        for i, answer in zip(escalated, _teacher_batch([sentences_in[i] for i in escalated], spell)):
+            answers[i] = answer
+
+    return answers
+
+
 def correct_errors(sentence_in: str) -> str:
 
     """
@@ -80,17 +524,51 @@ def correct_errors(sentence_in: str) -> str:
         Предложение, очищенное от ошибок
     """
 
-    encodings = tokenizer_M100_spell(sentence_in, return_tensors="pt")
+    # длинная ячейка исправляется по частям (см. split_segments)
+    if len(sentence_in) > segment_min_chars: return correct_errors_batch([sentence_in])[0]
 
-    generated_tokens = model_M100_spell.generate(**encodings, 
-                                                 forced_bos_token_id=tokenizer_M100_spell.get_lang_id("ru"), 
-                                                 max_new_tokens = 200)
-    
-    answer = tokenizer_M100_spell.batch_decode(generated_tokens, skip_special_tokens=True)
-    
-    answer = re.sub('[a-zA-Z]+', '', answer[0]).strip()
+    metrics.cells_spellchecked.inc()
+
+    with _acquire_spell() as (spell, student):
+        return _correct_batch([sentence_in], spell, student)[0]
+
+
+def correct_errors_batch(sentences_in: list) -> list:
+
+    """
+    Пакетная версия correct_errors: длинные предложения разбиваются на части (split_segments),
+    части исправляются пакетами по spell_batch_size (внутри пакета - дополнение до общей длины и один вызов generate),
+    затем части соединяются с исходными разделителями. Все пакеты вызова исправляются одной версией моделей
+
+    Параметры:
+    sentences_in : list of str
+        Список предложений с (возможно) орфографическими ошибками
+
+    Возвращает:
+    answers : list of str
+        Список предложений, очищенных от ошибок (в исходном порядке)
+    """
+
+    if len(sentences_in) == 0: return []
+
+    # учитываются входные ячейки, а не части, на которые они разбиты
+    metrics.cells_spellchecked.inc(len(sentences_in))
+
+    sentences_parts = [split_segments(sentence) for sentence in sentences_in]
+    segments = [segment for parts in sentences_parts for segment, _ in parts if segment.strip() != ""]
+
+    with _acquire_spell() as (spell, student):
+        corrected = iter([answer for i in range(0, len(segments), spell_batch_size)
+                          for answer in _correct_batch(segments[i:i+spell_batch_size], spell, student)])
 
-    return answer
+    answers = []
+
+    for parts in sentences_parts:
+
+        answer = "".join((next(corrected) if segment.strip() != "" else segment) + separator for segment, separator in parts)
+        answers.append(answer.strip())
+
+    return answers
 
 
 def name_reconstruct(name: str) -> str:
@@ -109,14 +587,54 @@ def name_reconstruct(name: str) -> str:
         Строка с именем требуемого формата
     """
 
+    name_tokens = re.findall("[а-яА-ЯЁё\-]+", name)
+
+    NER_output = _ner_call(name_tokens, "ner_names")
+
+    return _name_from_entities(name_tokens, NER_output)
+
+
+def name_reconstruct_batch(names: list) -> list:
+
+    """
+    Пакетная версия name_reconstruct: токены всех имен классифицируются 
+    одним вызовом NER-модели, затем разбираются обратно по именам
+
+    Параметры:
+    names : list of str
+        Список строк с именами
+
+    Возвращает:
+    strings_out : list of str
+        Список имен требуемого формата (в исходном порядке)
+    """
+
+    names_tokens = [re.findall("[а-яА-ЯЁё\-]+", name) for name in names]
+    flat_tokens = [token for name_tokens in names_tokens for token in name_tokens]
+
+    NER_output = _ner_call(flat_tokens, "ner_names") if len(flat_tokens) > 0 else []
+
+    strings_out = []
+    i = 0
+
+    for name_tokens in names_tokens:
+
+        strings_out.append(_name_from_entities(name_tokens, NER_output[i:i+len(name_tokens)]))
+        i += len(name_tokens)
+
+    return strings_out
+
+
+def _name_from_entities(name_tokens: list, NER_output: list) -> str:
+
+    "Переформирование имени по результатам NER для его токенов"
+
+    if len(name_tokens) == 0: return ""
+
     # создание словаря для сортировки элементов имени
     entities = ['SURN', 'NAME', 'PATR']
     sort_dict = {key: elem for elem, key in list(enumerate(entities))}
 
-    name_tokens = re.findall("[а-яА-ЯЁё\-]+", name)
-
-    NER_output = token_classifier_name(name_tokens)
-
     name_classes =  np.array([elem[0]['entity_group'] for elem in NER_output])
 
     # переформирование имени
@@ -149,16 +667,54 @@ def address_reconstruct(address: str) -> str:
         Строка с адресом требуемого формата
     """
 
-    # создание словаря для сортировки элементов адреса
-    entities = ["O", "REG", "DIST", "SETL", "CDIST", "STRT", "HOUS", "FLAT"]
-    
-    sort_dict = {key: elem for elem, key in list(enumerate(entities))}
-
     adr_tokens = address.strip().split(", ")
 
     # print(adr_tokens)
 
-    NER_output = list(token_classifier_adr(adr_tokens))
+    NER_output = list(_ner_call(adr_tokens, "ner_addresses", pack_addresses))
+
+    return _address_from_entities(adr_tokens, NER_output)
+
+
+def address_reconstruct_batch(addresses: list) -> list:
+
+    """
+    Пакетная версия address_reconstruct: части всех адресов классифицируются 
+    одним вызовом NER-модели, затем разбираются обратно по адресам
+
+    Параметры:
+    addresses : list of str
+        Список строк, содержащих адреса
+
+    Возвращает:
+    strings_out : list of str
+        Список адресов требуемого формата (в исходном порядке)
+    """
+
+    addresses_tokens = [address.strip().split(", ") for address in addresses]
+    flat_tokens = [token for adr_tokens in addresses_tokens for token in adr_tokens]
+
+    NER_output = list(_ner_call(flat_tokens, "ner_addresses", pack_addresses)) if len(flat_tokens) > 0 else []
+
+    strings_out = []
+    i = 0
+
+    for adr_tokens in addresses_tokens:
+
+        strings_out.append(_address_from_entities(adr_tokens, NER_output[i:i+len(adr_tokens)]))
+        i += len(adr_tokens)
+
+    return strings_out
+
+
+def _address_from_entities(adr_tokens: list, NER_output: list) -> str:
+
+    "Переформирование адреса по результатам NER для его частей"
+
+    # создание словаря для сортировки элементов адреса
+    entities = ["O", "REG", "DIST", "SETL", "CDIST", "STRT", "HOUS", "FLAT"]
+    
+    sort_dict = {key: elem for elem, key in list(enumerate(entities))}
 
     addresses = [[]]
     adr_entities = [[]]
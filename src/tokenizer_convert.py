@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import pandas as pd
+from tokenizers import Tokenizer, AddedToken, Regex, decoders, normalizers, pre_tokenizers, processors
+from tokenizers.models import BPE
+from transformers import M2M100Tokenizer, PreTrainedTokenizerFast
+from transformers.convert_slow_tokenizer import SentencePieceExtractor
+
+from src.logger import logFile
+
+
+# Пути к токенизаторам
+path_to_tokenizer_slow = "model/M2M100_tokenizer/"
+path_to_tokenizer_fast = "model/M2M100_tokenizer_fast/"
+
+# Тексты для проверки, если нет анкет
+sample_texts = ["Основая цель мероприятия 5 орпеля 2020 - практичиская оттработка навыкоф по ока занию помощь гражданов",
+                "Фомилию, имя, отчество не изменял",
+                "Студент, Уфимский фелеал Масковского нифтеного института им. Академика И.М. Губкина",
+                "Имею загррничный паспорт 6543217 89, ОУМС пос. Хор Хабаровского края, 04.02.2012",
+                "Калужская обл., г. Обнинск, ул. Гагарина, д. 5, кв.52",
+                "1966, 09 августа, г. Уфа, Республика Башкортостан, гражданство РФ"]
+
+
+def read_spm_model(spm_file: str):
+
+    "Чтение модели sentencepiece (protobuf ModelProto)"
+
+    try:
+        from transformers.convert_slow_tokenizer import import_protobuf
+        model_pb2 = import_protobuf()
+    except ImportError:
+        from sentencepiece import sentencepiece_model_pb2 as model_pb2
+
+    proto = model_pb2.ModelProto()
+
+    with open(spm_file, "rb") as f:
+        proto.ParseFromString(f.read())
+
+    return proto
+
+
+def _load_precompiled_charsmap(spm_file: str) -> bytes:
+
+    "Чтение таблицы нормализации из модели sentencepiece"
+
+    return read_spm_model(spm_file).normalizer_spec.precompiled_charsmap
+
+
+def _metaspace(module):
+
+    "Metaspace для разных версий tokenizers"
+
+    try:
+        return module.Metaspace(replacement="▁", prepend_scheme="always")
+    except TypeError:
+        return module.Metaspace(replacement="▁", add_prefix_space=True)
+
+
+def convert_tokenizer(path_in: str = path_to_tokenizer_slow,
+                      path_out: str = path_to_tokenizer_fast) -> PreTrainedTokenizerFast:
+
+    """
+    Конвертация медленного токенизатора M2M100 (sentencepiece + словарь vocab.json на Python)
+    в быстрый токенизатор на Rust (библиотека tokenizers).
+
+    Сегментация выполняется BPE с правилами слияния, извлеченными из sentencepiece.bpe.model,
+    идентификаторы берутся из vocab.json, языковые токены получают те же идентификаторы,
+    что и в медленном токенизаторе. Результат сохраняется в path_out.
+
+    Параметры:
+    path_in : str
+        Путь к медленному токенизатору
+    path_out : str
+        Путь для сохранения быстрого токенизатора
+
+    Возвращает:
+    tokenizer_fast : PreTrainedTokenizerFast
+        Быстрый токенизатор
+    """
+
+    tokenizer_slow = M2M100Tokenizer.from_pretrained(path_in)
+    spm_file = os.path.join(path_in, "sentencepiece.bpe.model")
+
+    encoder = tokenizer_slow.encoder
+
+    # правила слияния упорядочиваются по score из sentencepiece, как в конвертерах transformers
+    extractor = SentencePieceExtractor(spm_file)
+    vocab_scores = {extractor.sp.id_to_piece(i): extractor.sp.get_score(i) for i in range(extractor.sp.get_piece_size())}
+    _, merges = extractor.extract(vocab_scores)
+
+    # для сокращенного словаря (см. модуль vocab_prune) остаются только слияния внутри словаря
+    merges = [(a, b) for a, b in merges if a in encoder and b in encoder and a + b in encoder]
+
+    tokenizer = Tokenizer(BPE(vocab=encoder, merges=merges, unk_token=tokenizer_slow.unk_token, fuse_unk=True))
+
+    # как remove_extra_whitespaces в sentencepiece: пробелы по краям удаляются, повторяющиеся - схлопываются
+    tokenizer.normalizer = normalizers.Sequence([normalizers.Precompiled(_load_precompiled_charsmap(spm_file)),
+                                                 normalizers.Strip(left=True, right=True),
+                                                 normalizers.Replace(Regex(" {2,}"), " ")])
+    tokenizer.pre_tokenizer = _metaspace(pre_tokenizers)
+    tokenizer.decoder = _metaspace(decoders)
+
+    # языковые токены и служебные слова - после основного словаря, в порядке идентификаторов
+    extra_tokens = sorted([(idx, token) for token, idx in tokenizer_slow.get_vocab().items() if idx >= len(encoder)])
+
+    tokenizer.add_special_tokens([AddedToken(token, special=True, normalized=False) for _, token in extra_tokens])
+
+    for idx, token in extra_tokens:
+        assert tokenizer.token_to_id(token) == idx, f"Идентификатор токена {token} не совпадает"
+
+    # шаблон входа: <код исходного языка> текст </s>
+    prefix = tokenizer_slow.convert_ids_to_tokens(tokenizer_slow.prefix_tokens)
+    suffix = tokenizer_slow.convert_ids_to_tokens(tokenizer_slow.suffix_tokens)
+    special_tokens = [(token, tokenizer_slow.convert_tokens_to_ids(token)) for token in set(prefix + suffix)]
+
+    tokenizer.post_processor = processors.TemplateProcessing(single=prefix + ["$A"] + suffix,
+                                                             pair=prefix + ["$A", "$B"] + suffix,
+                                                             special_tokens=special_tokens)
+
+    tokenizer_fast = PreTrainedTokenizerFast(tokenizer_object=tokenizer,
+                                             bos_token=tokenizer_slow.bos_token,
+                                             eos_token=tokenizer_slow.eos_token,
+                                             sep_token=tokenizer_slow.sep_token,
+                                             unk_token=tokenizer_slow.unk_token,
+                                             pad_token=tokenizer_slow.pad_token,
+                                             additional_special_tokens=[token for _, token in extra_tokens if token.startswith("__")],
+                                             clean_up_tokenization_spaces=tokenizer_slow.clean_up_tokenization_spaces,
+                                             model_input_names=["input_ids", "attention_mask"])
+
+    tokenizer_fast.save_pretrained(path_out)
+
+    return tokenizer_fast
+
+
+def form_texts(dir_in: str = "data/raw") -> list:
+
+    """
+    Сбор текстов ячеек из анкет для проверки токенизатора
+
+    Параметры:
+    dir_in : str
+        Путь к папке с анкетами
+
+    Возвращает:
+    texts : list of str
+        Уникальные тексты непустых ячеек всех листов
+    """
+
+    texts = set()
+
+    for filename in os.listdir(dir_in):
+
+        if filename.split(".")[-1] not in ["xls", "xlsx"] or "~$" in filename: continue
+
+        for sheet in pd.read_excel(os.path.join(dir_in, filename), sheet_name=None, header=None).values():
+
+            texts.update(str(value) for value in sheet.to_numpy().ravel() if not pd.isna(value))
+
+    return sorted(texts)
+
+
+def verify_tokenizer(tokenizer_slow, tokenizer_fast, texts: list, batch_size: int = 64) -> list:
+
+    """
+    Проверка идентичности быстрого и медленного токенизаторов:
+    совпадение идентификаторов при кодировании и текста при декодировании (в т.ч. с пропуском служебных токенов)
+
+    Параметры:
+    tokenizer_slow, tokenizer_fast
+        Сравниваемые токенизаторы
+    texts : list of str
+        Корпус текстов
+
+    Возвращает:
+    mismatches : list of dict
+        Список расхождений (пустой, если токенизаторы идентичны)
+    """
+
+    mismatches = []
+
+    for i in range(0, len(texts), batch_size):
+
+        batch = texts[i:i+batch_size]
+
+        ids_slow = tokenizer_slow(batch)["input_ids"]
+        ids_fast = tokenizer_fast(batch)["input_ids"]
+
+        decoded_slow = tokenizer_slow.batch_decode(ids_slow, skip_special_tokens=True)
+        decoded_fast = tokenizer_fast.batch_decode(ids_slow, skip_special_tokens=True)
+
+        for text, i_slow, i_fast, d_slow, d_fast in zip(batch, ids_slow, ids_fast, decoded_slow, decoded_fast):
+
+            if i_slow != i_fast or d_slow != d_fast:
+                mismatches.append({"text": text, "ids_slow": i_slow, "ids_fast": i_fast,
+                                   "decoded_slow": d_slow, "decoded_fast": d_fast})
+
+    return mismatches
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="Конвертация токенизатора M2M100 в быстрый (Rust) токенизатор")
+    arg_parser.add_argument("--path-in", default=path_to_tokenizer_slow)
+    arg_parser.add_argument("--path-out", default=path_to_tokenizer_fast)
+    arg_parser.add_argument("--check-dir", default="data/raw", help="Папка с анкетами для проверки идентичности")
+    args = arg_parser.parse_args()
+
+    log = logFile(operation = "Конвертация токенизатора")
+
+    tokenizer_fast = convert_tokenizer(args.path_in, args.path_out)
+    tokenizer_slow = M2M100Tokenizer.from_pretrained(args.path_in)
+
+    texts = sample_texts + (form_texts(args.check_dir) if os.path.isdir(args.check_dir) else [])
+    mismatches = verify_tokenizer(tokenizer_slow, tokenizer_fast, texts)
+
+    msg = f"Токенизатор сохранен в {args.path_out}, проверено текстов: {len(texts)}, расхождений: {len(mismatches)}"
+    log.write_log(msg, content = "MSG" if len(mismatches) == 0 else "ERR")
+    print(msg)
+
+    for mismatch in mismatches[:10]:
+        print(json.dumps(mismatch, ensure_ascii=False))
+
+    log.close()
@@ -0,0 +1,251 @@
+import re
+import time
+import argparse
+import pandas as pd
+from datetime import datetime
+
+from src.logger import logFile
+from src.form import read_form, split_sheet_1, split_sheet_2, split_sheet_3, split_sheet_4
+from src.rules import correct_date_condition2, only_cyrillic, last_surnames, sort_address, \
+    date_guesser_corrector, pattern_reg
+
+
+# Модели не загружаются: проверяются только условия 1-4 правилами из модуля rules
+
+
+def _violation(filename: str, sheet: int, table: str, row: int, column: str, condition: str, value, expected) -> dict:
+
+    return {"file": filename, "sheet": sheet, "table": table, "row": row, "column": column,
+            "condition": condition, "value": value, "expected": expected}
+
+
+def check_condition_1(value) -> tuple:
+
+    """
+    Условие 1: в пункте 3 год рождения указывается только цифрами, число – двумя цифрами (ГГГГ, ДД месяц)
+
+    Возвращает:
+    ok : bool
+        Выполняется ли условие
+    expected : str
+        Исправленное значение (None, если дату не удалось распознать)
+    """
+
+    if not isinstance(value, str): return False, None
+
+    date_place_parts = value.split(", ")
+
+    if len(date_place_parts) < 2: return False, None
+
+    if re.search(pattern = r"\d{4},\s\d{2}\s\w+", string = date_place_parts[0] + ", " + date_place_parts[1]) is not None:
+        return True, value
+
+    try:
+        date_corrected = date_guesser_corrector(date_place_parts[0] + ", " + date_place_parts[1])
+        return False, " ".join([date_corrected, *date_place_parts[2:]])
+
+    except Exception:
+        return False, None
+
+
+def check_condition_2(value) -> tuple:
+
+    "Условие 2: даты содержат только цифры и точки (ячейка с датой Excel - datetime, pd.Timestamp - условию соответствует)"
+
+    if isinstance(value, datetime): return True, value.strftime("%m.%Y")
+
+    if not isinstance(value, str): return False, None
+
+    expected = correct_date_condition2(value)
+
+    return expected == value, expected
+
+
+def check_condition_3_1(value) -> tuple:
+
+    "Условие 3.1: степень родства содержит только буквы кириллицы"
+
+    if not isinstance(value, str): return False, None
+
+    expected = only_cyrillic(value)
+
+    return expected == value, expected
+
+
+def check_condition_3_2(value) -> tuple:
+
+    "Условие 3.2: предыдущие фамилии указываются в скобках через запятую"
+
+    if not isinstance(value, str): return False, None
+
+    expected = last_surnames(value)
+
+    return expected == " ".join(value.split()), expected
+
+
+def check_condition_4(value) -> tuple:
+
+    "Условие 4: адрес начинается с региона (если регион в адресе указан)"
+
+    if not isinstance(value, str): return False, None
+
+    region_positions = [i for i, part in enumerate(value.split(", ")) if re.search(pattern_reg, part.lower())]
+
+    if len(region_positions) == 0 or region_positions[0] == 0: return True, value
+
+    return False, sort_address(value)
+
+
+def validate_form(filename: str, workdir: str = "data/") -> list:
+
+    """
+    Проверка анкеты на нарушения условий 1-4 без исправления и без вызова моделей
+
+    Параметры:
+    filename : str
+        Имя файла анкеты
+    workdir : str
+        Рабочая директория (анкета читается из workdir/raw)
+
+    Возвращает:
+    violations : list of dict
+        Нарушения по ячейкам: лист, таблица, строка, колонка, условие, значение и исправление по правилам
+    """
+
+    data_sheets = read_form(workdir + "raw/" + filename)
+
+    data_sheets_0_1, data_sheets_0_2 = split_sheet_1(data_sheets[0])
+    data_sheets_1 = split_sheet_2(data_sheets[1])
+    data_sheets_2 = split_sheet_3(data_sheets[2])
+    data_sheets_3_1, data_sheets_3_2 = split_sheet_4(data_sheets[3])
+
+    # условие 1 относится только к п. 3 (вторая строка ответов)
+    checks = [(1, "п. 2-13", data_sheets_0_2, "Ответ", "1", check_condition_1),
+              (2, "п. 14", data_sheets_1, "Месяц и год поступления", "2", check_condition_2),
+              (2, "п. 14", data_sheets_1, "Месяц и год увольнения", "2", check_condition_2),
+              (2, "п. 14", data_sheets_1, "Адрес организации", "4", check_condition_4),
+              (3, "п. 15", data_sheets_2, "Степень родства", "3.1", check_condition_3_1),
+              (3, "п. 15", data_sheets_2, "Фамилия, имя и отчество", "3.2", check_condition_3_2),
+              (3, "п. 15", data_sheets_2, "Адрес места жительства", "4", check_condition_4),
+              (4, "п. 16", data_sheets_3_1, "Степень родства", "3.1", check_condition_3_1),
+              (4, "п. 16", data_sheets_3_1, "Фамилия, имя и отчество", "3.2", check_condition_3_2),
+              (4, "п. 17", data_sheets_3_2, "Период проживания начало", "2", check_condition_2),
+              (4, "п. 17", data_sheets_3_2, "Период проживания конец", "2", check_condition_2),
+              (4, "п. 17", data_sheets_3_2, "Адрес проживания и регистрации", "4", check_condition_4)]
+
+    violations = []
+
+    for sheet, table, form_table, column, condition, check in checks:
+
+        for row, value in enumerate(form_table[column]):
+
+            if condition == "1" and row != 1: continue
+            if pd.isna(value): continue
+
+            ok, expected = check(value)
+
+            if not ok:
+                violations.append(_violation(filename, sheet, table, row, column, condition, value, expected))
+
+    return violations
+
+
+def validate(file_names: list, workdir: str = "data/", verbose: bool = False) -> pd.DataFrame:
+
+    """
+    Проверка списка анкет. Анкеты, которые не удалось прочитать, попадают в отчет с условием "read"
+
+    Параметры:
+    file_names : list of str
+        Имена файлов анкет
+    workdir : str
+        Рабочая директория
+
+    Возвращает:
+    report : pd.DataFrame
+        Отчет по нарушениям (строка на ячейку)
+    """
+
+    log = logFile(operation = "Проверка анкет без исправления")
+    violations = []
+
+    for filename in file_names:
+
+        start = time.perf_counter()
+
+        try:
+            form_violations = validate_form(filename, workdir)
+
+        except Exception as e:
+            form_violations = [_violation(filename, None, None, None, None, "read", repr(e), None)]
+
+        violations += form_violations
+
+        msg = f"{filename}: нарушений - {len(form_violations)} ({(time.perf_counter() - start) * 1000:.0f} мс)"
+        log.write_log(msg, content = "MSG" if len(form_violations) == 0 else "ERR")
+        if verbose: print(msg)
+
+    log.close()
+
+    return pd.DataFrame(violations, columns=["file", "sheet", "table", "row", "column", "condition", "value", "expected"])
+
+
+def failing_forms(report: pd.DataFrame) -> list:
+
+    "Имена анкет, в которых есть нарушения (для передачи в полную обработку); непрочитанные анкеты не передаются"
+
+    return list(dict.fromkeys(report.loc[report["condition"] != "read", "file"]))
+
+
+def unreadable_forms(report: pd.DataFrame) -> list:
+
+    "Имена анкет, которые не удалось прочитать (условие \"read\")"
+
+    return list(dict.fromkeys(report.loc[report["condition"] == "read", "file"]))
+
+
+if __name__ == "__main__":
+
+    from src.dircheck import get_new_file_names
+
+    arg_parser = argparse.ArgumentParser(description="Проверка анкет на нарушения условий 1-4 без исправления")
+    arg_parser.add_argument("--workdir", default="data/")
+    arg_parser.add_argument("--report", default="", help="Путь для сохранения отчета (csv)")
+    arg_parser.add_argument("--run", action="store_true", help="Обработать анкеты с нарушениями (file_processor)")
+    arg_parser.add_argument("--metrics-textfile", default="", help="Файл метрик обработки (--run) для textfile-коллектора node_exporter")
+    arg_parser.add_argument("--enqueue", default="", help="Добавить анкеты с нарушениями в очередь (путь к базе очереди)")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    file_names = get_new_file_names(args.workdir + "raw", args.workdir + "processed")
+    report = validate(file_names, args.workdir, args.verbose)
+    failing = failing_forms(report)
+
+    print(f"Проверено анкет: {len(file_names)}, с нарушениями: {len(failing)}, не прочитано: {len(unreadable_forms(report))}")
+
+    if args.report != "":
+        report.to_csv(args.report, index=False)
+    else:
+        print(report.to_string())
+
+    if args.enqueue != "":
+
+        from src.jobqueue import SQLiteJobQueue
+
+        queue = SQLiteJobQueue(args.enqueue)
+
+        for filename in failing:
+            queue.enqueue(filename)
+
+    if args.run:
+
+        from src.processor import file_processor
+
+        for filename in failing:
+            file_processor(filename, workdir = args.workdir, verbose = args.verbose)
+
+        if args.metrics_textfile != "":
+
+            from src import metrics
+
+            metrics.write_textfile(args.metrics_textfile)
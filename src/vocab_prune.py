@@ -0,0 +1,363 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+import torch
+from transformers import M2M100ForConditionalGeneration, M2M100Tokenizer, PreTrainedTokenizerFast
+from transformers.convert_slow_tokenizer import SentencePieceExtractor
+
+from src.logger import logFile
+from src.tokenizer_convert import convert_tokenizer, verify_tokenizer, form_texts, sample_texts, read_spm_model
+
+
+# Пути: исходная (не квантизованная) модель и токенизатор, результаты сокращения словаря
+path_to_model_full = "model/M2M100ForConditionalGeneration/"
+path_to_tokenizer_full = "model/M2M100_tokenizer/"
+
+path_to_model_quantized = "model/M2M100_spellchecker/quantized_model.pt"
+
+path_to_model_ru = "model/M2M100_spellchecker/quantized_model_ru.pt"
+path_to_tokenizer_ru = "model/M2M100_tokenizer_ru/"
+path_to_tokenizer_ru_fast = "model/M2M100_tokenizer_ru_fast/"
+
+# Токен без букв других алфавитов: кириллица, цифры, знаки препинания
+pattern_non_russian = re.compile(r"[^\W\d_а-яА-ЯёЁ]")
+
+
+def _merge_parents(spm_file: str) -> dict:
+
+    "Для каждого токена - пары токенов, слиянием которых он получается (правила BPE из sentencepiece)"
+
+    extractor = SentencePieceExtractor(spm_file)
+    vocab_scores = {extractor.sp.id_to_piece(i): extractor.sp.get_score(i) for i in range(extractor.sp.get_piece_size())}
+    _, merges = extractor.extract(vocab_scores)
+
+    parents = {}
+
+    for a, b in merges:
+        parents.setdefault(a + b, []).append((a, b))
+
+    return parents
+
+
+def select_tokens(tokenizer: M2M100Tokenizer, texts: list, observed_only: bool = False) -> list:
+
+    """
+    Выбор токенов основного словаря, которые остаются в модели:
+    служебные токены, токены, встретившиеся в текстах, и (если observed_only=False) все токены
+    без букв других алфавитов. Набор дополняется токенами, через которые BPE приходит к выбранным,
+    поэтому сегментация текста из выбранных токенов не меняется.
+
+    Параметры:
+    tokenizer : M2M100Tokenizer
+        Исходный токенизатор
+    texts : list of str
+        Русские тексты (анкеты, корпус)
+    observed_only : bool
+        Оставить только встретившиеся в текстах токены
+
+    Возвращает:
+    kept_ids : list of int
+        Идентификаторы оставляемых токенов основного словаря (по возрастанию)
+    """
+
+    encoder = tokenizer.encoder
+
+    kept = {tokenizer.bos_token, tokenizer.pad_token, tokenizer.eos_token, tokenizer.unk_token}
+
+    for text in texts:
+        kept.update(piece for piece in tokenizer.tokenize(text) if piece in encoder)
+
+    if not observed_only:
+        kept.update(piece for piece in encoder if not pattern_non_russian.search(piece))
+
+    # замыкание по правилам слияния
+    parents = _merge_parents(tokenizer.spm_file)
+    stack = list(kept)
+
+    while len(stack) > 0:
+
+        for pair in parents.get(stack.pop(), []):
+            for piece in pair:
+                if piece in encoder and piece not in kept:
+                    kept.add(piece)
+                    stack.append(piece)
+
+    return sorted(encoder[piece] for piece in kept)
+
+
+def prune_model(model: M2M100ForConditionalGeneration, old_ids: list) -> M2M100ForConditionalGeneration:
+
+    """
+    Сокращение словаря модели: строки матрицы эмбеддингов (общей для кодировщика и декодера)
+    и выходного слоя оставляются только для old_ids, новый идентификатор токена - его позиция в old_ids
+
+    Параметры:
+    model : M2M100ForConditionalGeneration
+        Не квантизованная модель
+    old_ids : list of int
+        Идентификаторы оставляемых токенов в исходной модели
+
+    Возвращает:
+    model : M2M100ForConditionalGeneration
+        Та же модель с сокращенным словарем
+    """
+
+    index = torch.tensor(old_ids)
+    id_map = {old: new for new, old in enumerate(old_ids)}
+
+    embeddings = torch.nn.Parameter(model.get_input_embeddings().weight.data[index].clone())
+    output_weight = model.get_output_embeddings().weight.data[index].clone()
+
+    for module in [model.model.shared, model.model.encoder.embed_tokens, model.model.decoder.embed_tokens]:
+        module.weight = embeddings
+        module.num_embeddings = len(old_ids)
+
+    lm_head = torch.nn.Linear(output_weight.shape[1], len(old_ids), bias=False)
+    lm_head.weight = embeddings if model.config.tie_word_embeddings else torch.nn.Parameter(output_weight)
+    model.set_output_embeddings(lm_head)
+
+    model.config.vocab_size = len(old_ids)
+
+    # служебные идентификаторы в конфигурациях
+    configs = [model.config] + ([model.generation_config] if getattr(model, "generation_config", None) is not None else [])
+
+    for config in configs:
+        for attr in ["bos_token_id", "pad_token_id", "eos_token_id", "decoder_start_token_id", "forced_bos_token_id"]:
+            value = getattr(config, attr, None)
+            if isinstance(value, int) and value in id_map:
+                setattr(config, attr, id_map[value])
+
+    return model
+
+
+def prune_spm_model(spm_in: str, spm_out: str, pieces: set):
+
+    """
+    Сокращение словаря модели sentencepiece: из обычных токенов остаются только pieces,
+    служебные токены и таблица нормализации сохраняются.
+
+    Без этого медленный токенизатор сегментирует текст по полному словарю и заменяет удаленные токены на <unk>,
+    а быстрый (BPE без слияний в удаленные токены) разбивает их на оставшиеся части. С сокращенной моделью
+    sentencepiece не собирает удаленные токены и оба токенизатора дают одинаковые части;
+    символы вне словаря в обоих становятся <unk> (подряд идущие - одним <unk>)
+
+    Параметры:
+    spm_in, spm_out : str
+        Исходная и сокращенная модели sentencepiece.bpe.model
+    pieces : set of str
+        Оставляемые токены
+    """
+
+    proto = read_spm_model(spm_in)
+    normal = type(proto.pieces[0]).NORMAL
+
+    kept = [piece for piece in proto.pieces if piece.type != normal or piece.piece in pieces]
+
+    del proto.pieces[:]
+    proto.pieces.extend(kept)
+
+    with open(spm_out, "wb") as f:
+        f.write(proto.SerializeToString())
+
+
+def save_pruned_tokenizer(tokenizer: M2M100Tokenizer,
+                          kept_ids: list,
+                          path_tokenizer_in: str = path_to_tokenizer_full,
+                          path_tokenizer_out: str = path_to_tokenizer_ru,
+                          path_tokenizer_fast_out: str = path_to_tokenizer_ru_fast) -> M2M100Tokenizer:
+
+    """
+    Сохранение токенизатора с сокращенным словарем: перенумерованный vocab.json, сокращенная модель sentencepiece
+    (prune_spm_model) и быстрый токенизатор (tokenizer_convert); языковые токены получают len(vocab) + j
+
+    Параметры:
+    tokenizer : M2M100Tokenizer
+        Исходный токенизатор
+    kept_ids : list of int
+        Идентификаторы оставляемых токенов основного словаря (см. select_tokens)
+    path_tokenizer_in : str
+        Исходный токенизатор
+    path_tokenizer_out, path_tokenizer_fast_out : str
+        Пути для сохранения медленного и быстрого токенизаторов
+
+    Возвращает:
+    tokenizer_ru : M2M100Tokenizer
+        Токенизатор с сокращенным словарем
+    """
+
+    id_to_token = {idx: token for token, idx in tokenizer.encoder.items()}
+    old_ids = kept_ids + list(range(len(tokenizer.encoder), len(tokenizer)))
+
+    shutil.copytree(path_tokenizer_in, path_tokenizer_out, dirs_exist_ok=True)
+
+    with open(os.path.join(path_tokenizer_out, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump({id_to_token[old]: new for new, old in enumerate(kept_ids)}, f, ensure_ascii=False, indent=2)
+
+    prune_spm_model(tokenizer.spm_file, os.path.join(path_tokenizer_out, os.path.basename(tokenizer.spm_file)),
+                    {id_to_token[old] for old in kept_ids})
+
+    tokenizer_ru = M2M100Tokenizer.from_pretrained(path_tokenizer_out)
+
+    for new, old in enumerate(old_ids):
+        assert tokenizer_ru.convert_ids_to_tokens(new) == tokenizer.convert_ids_to_tokens(old), \
+            f"Токен {old} перенумерован неверно"
+
+    convert_tokenizer(path_tokenizer_out, path_tokenizer_fast_out)
+
+    return tokenizer_ru
+
+
+def build_pruned(texts: list,
+                 path_model_in: str = path_to_model_full,
+                 path_tokenizer_in: str = path_to_tokenizer_full,
+                 path_model_out: str = path_to_model_ru,
+                 path_tokenizer_out: str = path_to_tokenizer_ru,
+                 path_tokenizer_fast_out: str = path_to_tokenizer_ru_fast,
+                 observed_only: bool = False) -> dict:
+
+    """
+    Построение модели с сокращенным (русским) словарем:
+    1. выбор токенов (select_tokens); языковые токены и служебные слова сохраняются и следуют за основным словарем,
+       как в исходном токенизаторе;
+    2. сокращение эмбеддингов и выходного слоя (prune_model);
+    3. квантизация, как в ноутбуке Model Training (quantize_dynamic, qint8), и сохранение модели;
+    4. сохранение токенизатора с перенумерованным vocab.json и сокращенной моделью sentencepiece
+       и быстрого токенизатора (save_pruned_tokenizer).
+
+    Параметры:
+    texts : list of str
+        Русские тексты, по которым определяются используемые токены
+    path_model_in, path_tokenizer_in : str
+        Исходные модель (не квантизованная) и токенизатор
+    path_model_out, path_tokenizer_out, path_tokenizer_fast_out : str
+        Пути для сохранения результатов
+    observed_only : bool
+        Оставить только встретившиеся в текстах токены
+
+    Возвращает:
+    summary : dict
+        Размер словаря до и после сокращения
+    """
+
+    tokenizer = M2M100Tokenizer.from_pretrained(path_tokenizer_in)
+    model = M2M100ForConditionalGeneration.from_pretrained(path_model_in)
+    model.eval()
+
+    kept_ids = select_tokens(tokenizer, texts, observed_only)
+
+    # языковые токены и служебные слова: исходные идентификаторы после основного словаря
+    extra_ids = list(range(len(tokenizer.encoder), len(tokenizer)))
+    old_ids = kept_ids + extra_ids
+
+    vocab_size_before = model.config.vocab_size
+
+    prune_model(model, old_ids)
+
+    quantized_model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    os.makedirs(os.path.dirname(path_model_out), exist_ok=True)
+    torch.save(quantized_model, path_model_out)
+
+    save_pruned_tokenizer(tokenizer, kept_ids, path_tokenizer_in, path_tokenizer_out, path_tokenizer_fast_out)
+
+    return {"vocab_before": vocab_size_before,
+            "vocab_after": len(old_ids),
+            "main_vocab_before": len(tokenizer.encoder),
+            "main_vocab_after": len(kept_ids)}
+
+
+def compare(texts: list,
+            path_model_a: str, path_tokenizer_a: str,
+            path_model_b: str, path_tokenizer_b: str) -> dict:
+
+    """
+    Сравнение исправлений двух вариантов модели (исходной и с сокращенным словарем):
+    доля совпадающих ответов, время и размер файла модели
+
+    Возвращает:
+    summary : dict
+        Результаты сравнения
+    """
+
+    results = {}
+
+    for name, path_model, path_tokenizer in [("a", path_model_a, path_tokenizer_a), ("b", path_model_b, path_tokenizer_b)]:
+
+        tokenizer = M2M100Tokenizer.from_pretrained(path_tokenizer)
+        model = torch.load(path_model)
+        model.eval()
+
+        lang_id_ru = tokenizer.convert_tokens_to_ids("__ru__")
+        answers = []
+
+        start = time.perf_counter()
+
+        with torch.no_grad():
+            for text in texts:
+                generated_tokens = model.generate(**tokenizer(text, return_tensors="pt"),
+                                                  forced_bos_token_id=lang_id_ru, max_new_tokens=200)
+                answer = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)[0]
+                answers.append(re.sub('[a-zA-Z]+', '', answer).strip())
+
+        results[name] = {"answers": answers,
+                         "time": time.perf_counter() - start,
+                         "size_mb": os.path.getsize(path_model) / 2**20}
+
+    return {"identical": sum(a == b for a, b in zip(results["a"]["answers"], results["b"]["answers"])) / max(1, len(texts)),
+            "time_a": results["a"]["time"], "time_b": results["b"]["time"],
+            "size_mb_a": results["a"]["size_mb"], "size_mb_b": results["b"]["size_mb"]}
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="Сокращение словаря модели исправления орфографии до русского")
+    arg_parser.add_argument("--model-in", default=path_to_model_full, help="Не квантизованная модель")
+    arg_parser.add_argument("--tokenizer-in", default=path_to_tokenizer_full)
+    arg_parser.add_argument("--model-out", default=path_to_model_ru)
+    arg_parser.add_argument("--tokenizer-out", default=path_to_tokenizer_ru)
+    arg_parser.add_argument("--tokenizer-fast-out", default=path_to_tokenizer_ru_fast)
+    arg_parser.add_argument("--check-dir", default="data/raw", help="Папка с анкетами (тексты для выбора токенов)")
+    arg_parser.add_argument("--corpus", default="", help="Текстовый файл с русским корпусом (по строке на текст)")
+    arg_parser.add_argument("--observed-only", action="store_true", help="Оставить только встретившиеся токены")
+    arg_parser.add_argument("--compare", type=int, default=50, help="Число текстов для сравнения с исходной моделью")
+    args = arg_parser.parse_args()
+
+    log = logFile(operation = "Сокращение словаря модели исправления орфографии")
+
+    texts = sample_texts + (form_texts(args.check_dir) if os.path.isdir(args.check_dir) else [])
+
+    if args.corpus != "":
+        with open(args.corpus, encoding="utf-8") as f:
+            texts += [line.strip() for line in f if line.strip() != ""]
+
+    summary = build_pruned(texts, args.model_in, args.tokenizer_in, args.model_out, args.tokenizer_out,
+                           args.tokenizer_fast_out, args.observed_only)
+
+    msg = (f"Словарь: {summary['vocab_before']} -> {summary['vocab_after']} токенов "
+           f"(основной {summary['main_vocab_before']} -> {summary['main_vocab_after']}), модель сохранена в {args.model_out}")
+    log.write_log(msg)
+    print(msg)
+
+    mismatches = verify_tokenizer(M2M100Tokenizer.from_pretrained(args.tokenizer_out),
+                                  PreTrainedTokenizerFast.from_pretrained(args.tokenizer_fast_out),
+                                  texts)
+
+    msg = f"Быстрый токенизатор: проверено текстов: {len(texts)}, расхождений: {len(mismatches)}"
+    log.write_log(msg, content = "MSG" if len(mismatches) == 0 else "ERR")
+    print(msg)
+
+    if args.compare > 0 and os.path.exists(path_to_model_quantized):
+
+        comparison = compare(texts[:args.compare], path_to_model_quantized, args.tokenizer_in,
+                             args.model_out, args.tokenizer_out)
+
+        msg = (f"Совпадение ответов с исходной моделью: {comparison['identical']:.0%}, "
+               f"время {comparison['time_a']:.2f} с -> {comparison['time_b']:.2f} с, "
+               f"размер {comparison['size_mb_a']:.0f} МБ -> {comparison['size_mb_b']:.0f} МБ")
+        log.write_log(msg)
+        print(msg)
+
+    log.close()
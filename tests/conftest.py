@@ -0,0 +1,30 @@
+import importlib
+import sys
+
+import pytest
+
+from src.registry import ModelRegistry, ModelVersion
+
+
+@pytest.fixture(scope="module")
+def spellcheck():
+
+    "Модуль spellcheck без файлов моделей: реестр регистрирует версии без загрузки"
+
+    def register(self, name, load_fn, warmup_fn, default_entry):
+
+        self.loaders[name] = (load_fn, warmup_fn)
+        self.current[name] = ModelVersion(name, default_entry["version"], default_entry,
+                                          {"model": None, "tokenizer": None, "lang_id": None})
+
+        return self.current[name]
+
+    with pytest.MonkeyPatch.context() as mp:
+
+        mp.setattr(ModelRegistry, "register", register)
+        mp.delitem(sys.modules, "src.spellcheck", raising=False)
+
+        yield importlib.import_module("src.spellcheck")
+
+        sys.modules.pop("src.spellcheck", None)
+        sys.modules["src"].__dict__.pop("spellcheck", None)
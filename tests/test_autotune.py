@@ -0,0 +1,46 @@
+import types
+from contextlib import contextmanager
+
+import pytest
+
+pytest.importorskip("transformers")
+
+from src import autotune
+
+
+@pytest.fixture
+def spellcheck(monkeypatch):
+
+    "Модуль spellcheck без моделей: пакетные функции записывают размеры вызовов"
+
+    calls = {"spell": [], "names": [], "addresses": []}
+
+    @contextmanager
+    def acquire(name):
+        yield {"model": types.SimpleNamespace(config=types.SimpleNamespace())}
+
+    spellcheck = types.SimpleNamespace(registry=types.SimpleNamespace(acquire=acquire),
+                                       correct_errors_batch=lambda cells: calls["spell"].append(len(cells)),
+                                       name_reconstruct_batch=lambda names: calls["names"].append(len(names)),
+                                       address_reconstruct_batch=lambda addresses: calls["addresses"].append(len(addresses)),
+                                       calls=calls)
+
+    monkeypatch.setattr(autotune, "_load_models", lambda threads: spellcheck)
+
+    return spellcheck
+
+
+def test_sweep_times_batches_not_whole_dataset(spellcheck, monkeypatch):
+
+    monkeypatch.setattr(autotune, "spell_batch_candidates", [4])
+    monkeypatch.setattr(autotune, "ner_batch_candidates", [8])
+    monkeypatch.setattr(autotune, "packs_candidates", [1])
+
+    data = {"cells": ["текст"] * 20, "names": ["Иванов Иван"] * 20, "addresses": ["г. Казань, ул. Баумана"] * 20}
+
+    results = autotune.sweep(data, threads=1)
+
+    # после прогрева (2 элемента) - пакеты по кандидату размера; адреса - пакетами сервиса
+    assert spellcheck.calls["names"] == [2, 8, 8, 4]
+    assert spellcheck.calls["addresses"] == [2] + [4] * 5
+    assert results["spell_batch_size"] == 4
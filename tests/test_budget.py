@@ -0,0 +1,89 @@
+import locale
+import time
+
+import pytest
+
+from src.changeset import CellTrace
+from src.form import FormTable
+
+try:
+    from src.budget import FormBudget, BudgetExceeded, LEVEL_FULL, LEVEL_SKIP_LOW, LEVEL_RULES, LEVEL_GIVE_UP
+except locale.Error:
+    pytest.skip("нужна локаль ru_RU (см. src/rules.py)", allow_module_level=True)
+
+
+low_column = "Место работы, должность"
+
+
+def _budget(share: float, seconds: float = 100) -> FormBudget:
+
+    "Бюджет, из которого уже израсходована доля share"
+
+    budget = FormBudget(seconds, "a.xlsx")
+    budget.start = time.perf_counter() - share * seconds
+
+    return budget
+
+
+def _model(value):
+
+    return "модель: " + value
+
+
+@pytest.mark.parametrize("share, level", [(0, LEVEL_FULL), (0.6, LEVEL_SKIP_LOW), (0.8, LEVEL_RULES), (1.1, LEVEL_GIVE_UP)])
+def test_level(share, level):
+
+    assert _budget(share).level() == level
+
+
+def test_full_level_calls_model():
+
+    budget = _budget(0)
+
+    assert budget.wrap("spellcheck", _model, "sheet_1", low_column)("текст") == "модель: текст"
+    assert budget.degraded == []
+
+
+def test_skip_spellcheck_only_in_low_priority_columns():
+
+    budget = _budget(0.6)
+
+    assert budget.wrap("spellcheck", _model, "sheet_1", low_column)("текст") == "текст"
+    assert budget.wrap("spellcheck", _model, "sheet_1", "Степень родства")("текст") == "модель: текст"
+    # ячейки, которые модель и так не получает, деградацией не считаются
+    assert budget.wrap("spellcheck", _model, "sheet_1", low_column)("12.2015") == "модель: 12.2015"
+
+    assert [cell["action"] for cell in budget.degraded] == ["skip_spellcheck"]
+    assert budget.degraded_sheets() == {"sheet_1"}
+
+
+def test_rules_level_replaces_models():
+
+    budget = _budget(0.8)
+
+    assert budget.wrap("names", _model, "sheet_3", "Фамилия, имя и отчество")("Иванова Петрова Анна Петровна") \
+        == "Иванова (Петрова) Анна Петровна"
+    assert budget.wrap("addresses", _model, "sheet_3", "Адрес")("г. Химки, Московская область") \
+        == "Московская область, г. Химки"
+
+    assert [cell["action"] for cell in budget.degraded] == ["rule_names", "rule_addresses"]
+
+
+def test_give_up():
+
+    with pytest.raises(BudgetExceeded):
+        _budget(1.1).wrap("spellcheck", _model, "sheet_1", low_column)("текст")
+
+
+def test_degradation_is_reported_to_trace():
+
+    trace = CellTrace()
+    budget = _budget(0.8)
+    budget.trace = trace
+
+    table = FormTable(["Адрес"], [["г. Химки, Московская область"], ["Московская область"]])
+    trace.map(table, 3, "Адрес", "condition_4", budget.wrap("addresses", _model, "sheet3", "Адрес"))
+
+    assert trace.rule(3, "Адрес", 0) == "condition_4: sort_address (budget)"
+    # значение не изменилось - шаг не записывается
+    assert trace.rule(3, "Адрес", 1) is None
@@ -0,0 +1,99 @@
+import copy
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from src import form
+from src.form import FormTable, columns_sheet_1, columns_sheet_2, columns_sheet_3, columns_sheet_4_1, columns_sheet_4_2, \
+    save_to_excel
+from src.changeset import CellTrace, PATH_RULES, output_cell, diff_tables
+from src.router import CellRouter
+
+
+def _tables(n_rows_16: int = 6, n_rows_17: int = 3) -> list:
+
+    "Шесть таблиц анкеты с уникальными значениями ячеек"
+
+    shapes = [(columns_sheet_1, 3), (columns_sheet_1, 12), (columns_sheet_2, 2), (columns_sheet_3, 3),
+              (columns_sheet_4_1, n_rows_16), (columns_sheet_4_2, n_rows_17)]
+
+    return [FormTable(columns, [[f"t{table} r{row} c{col}" for col in range(len(columns))] for row in range(n_rows)])
+            for table, (columns, n_rows) in enumerate(shapes)]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    template = tmp_path / "template.xlsx"
+    wb = Workbook()
+    wb.active.title = "Лист1"
+    for name in ["Лист2", "Лист3", "Лист4"]:
+        wb.create_sheet(name)
+    wb.save(template)
+
+    monkeypatch.setattr(form, "template_file", str(template))
+    (tmp_path / "processed").mkdir()
+
+    return str(tmp_path) + "/"
+
+
+@pytest.mark.parametrize("n_rows_16, n_rows_17", [(2, 3), (4, 11), (6, 3), (7, 13)])
+def test_output_cell_matches_save_to_excel(workdir, n_rows_16, n_rows_17):
+
+    tables = _tables(n_rows_16, n_rows_17)
+
+    wb = load_workbook(save_to_excel(tables, "a.xlsx", workdir))
+
+    for table, form_table in enumerate(tables):
+
+        columns = ["Ответ"] if table in [0, 1] else form_table.columns
+
+        for column in columns:
+            for row, value in enumerate(form_table[column]):
+
+                sheet, cell = output_cell(tables, table, row, column)
+
+                assert wb[sheet][cell].value == value
+
+
+def test_diff_tables_without_trace_uses_table_rules():
+
+    original = _tables()
+    processed = copy.deepcopy(original)
+    processed[3]["Адрес места жительства"][1] = "новый адрес"
+
+    changes = diff_tables("a.xlsx", original, processed, "spell=1")
+
+    assert len(changes) == 1
+    assert changes[0]["sheet"] == "Лист3" and changes[0]["cell"] == "E4"
+    assert changes[0]["old"] == "t3 r1 c4" and changes[0]["new"] == "новый адрес"
+    assert changes[0]["rule"] == "spellcheck, condition_4"
+    assert changes[0]["models"] == "spell=1"
+
+
+def test_trace_reports_applied_path():
+
+    original = [FormTable(columns_sheet_1, []), FormTable(columns_sheet_1, []), FormTable(columns_sheet_2, []),
+                FormTable(columns_sheet_3, [["мать", "Иванова Анна", "1970", "  нет  ", "ул. Ленина"],
+                                            ["отец", "Иванов Петр", "1968", "school", "ул. Мира"],
+                                            ["брат", "Иванов Олег", "1995", "завот", "ул. Мира"]]),
+                FormTable(columns_sheet_4_1, []), FormTable(columns_sheet_4_2, [])]
+    processed = copy.deepcopy(original)
+
+    trace = CellTrace()
+    router = CellRouter(lambda value: value.replace("завот", "завод"), trace=trace)
+
+    trace.map(processed[3], 3, "Место работы, должность", "spellcheck", router)
+    trace.map(processed[3], 3, "Адрес места жительства", "condition_4", lambda value: "г. Москва, " + value)
+    trace.map(processed[3], 3, "Степень родства", "condition_3.1", str.upper, PATH_RULES)
+    trace.note(3, "Адрес места жительства", 0, "condition_4", "sort_address (budget)")
+
+    rules = {(change["column"], change["row"]): change["rule"] for change in diff_tables("a.xlsx", original, processed, "", trace)}
+
+    assert rules[("Место работы, должность", 0)] == "spellcheck: passthrough"
+    assert rules[("Место работы, должность", 1)] == "spellcheck: latin_rules"
+    assert rules[("Место работы, должность", 2)] == "spellcheck: model"
+    assert rules[("Адрес места жительства", 0)] == "condition_4: model, condition_4: sort_address (budget)"
+    assert rules[("Степень родства", 0)] == "condition_3.1: rules"
+    # ячейки, не изменившиеся на шаге, шаг не получают; без записанного пути - правило колонки
+    assert trace.rule(3, "Фамилия, имя и отчество", 0) is None
@@ -0,0 +1,64 @@
+import os
+
+from src.checkpoint import StageCheckpoint, file_hash
+
+
+def _form(tmp_path, content: bytes = b"form"):
+
+    path = tmp_path / "form.xlsx"
+    path.write_bytes(content)
+
+    return str(path)
+
+
+def test_round_trip(tmp_path):
+
+    checkpoint = StageCheckpoint(_form(tmp_path), str(tmp_path / "checkpoints"), {"spellcheck": "v1"})
+
+    assert checkpoint.stages() == []
+    assert checkpoint.load("sheet1") is None
+
+    checkpoint.save("sheet1", {"Ответ": ["нет"]})
+
+    restored = StageCheckpoint(_form(tmp_path), str(tmp_path / "checkpoints"), {"spellcheck": "v1"})
+
+    assert restored.stages() == ["sheet1"]
+    assert restored.load("sheet1") == {"Ответ": ["нет"]}
+    assert not any(name.endswith(".tmp") for name in os.listdir(restored.dir))
+
+
+def test_key_depends_on_content_and_model_versions(tmp_path):
+
+    checkpoint_dir = str(tmp_path / "checkpoints")
+
+    StageCheckpoint(_form(tmp_path), checkpoint_dir, {"spellcheck": "v1"}).save("sheet1", "v1")
+
+    assert StageCheckpoint(_form(tmp_path), checkpoint_dir, {"spellcheck": "v2"}).load("sheet1") is None
+    assert StageCheckpoint(_form(tmp_path, b"changed"), checkpoint_dir, {"spellcheck": "v1"}).load("sheet1") is None
+
+
+def test_corrupted_stage_is_ignored(tmp_path):
+
+    checkpoint = StageCheckpoint(_form(tmp_path), str(tmp_path / "checkpoints"))
+    checkpoint.save("sheet2", [1, 2])
+
+    with open(checkpoint._path("sheet2"), "wb") as f:
+        f.write(b"\x80")
+
+    assert checkpoint.load("sheet2") is None
+
+
+def test_clear_removes_all_versions_of_the_form(tmp_path):
+
+    checkpoint_dir = tmp_path / "checkpoints"
+
+    StageCheckpoint(_form(tmp_path), str(checkpoint_dir), {"spellcheck": "v1"}).save("sheet1", 1)
+    StageCheckpoint(_form(tmp_path), str(checkpoint_dir), {"spellcheck": "v2"}).save("sheet1", 2)
+
+    other_dir = checkpoint_dir / ("0" * 64 + "-other")
+    other_dir.mkdir()
+
+    StageCheckpoint(_form(tmp_path), str(checkpoint_dir), {"spellcheck": "v2"}).clear()
+
+    assert [path.name for path in checkpoint_dir.iterdir()] == [other_dir.name]
+    assert file_hash(_form(tmp_path)) not in other_dir.name
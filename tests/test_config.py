@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from src import config
+from src.config import load_config, default_config, save_profile, threads_per_worker
+
+
+gb = 1024 ** 3
+
+
+@pytest.fixture
+def host(monkeypatch):
+
+    "Хост с 16 ядрами и 64 ГБ памяти"
+
+    monkeypatch.setattr(config, "cpu_count", lambda: 16)
+    monkeypatch.setattr(config, "total_memory", lambda: 64 * gb)
+
+
+def _write(path, profiles: dict):
+
+    path.write_text(json.dumps({"profiles": profiles}), encoding="utf-8")
+
+
+def test_default_without_file(tmp_path, host):
+
+    tuned = load_config(str(tmp_path / "tuned.json"))
+
+    assert tuned == dict(default_config(), profile="default")
+    assert tuned["n_workers"] == 4 and tuned["torch_threads"] == 4
+
+
+def test_exact_profile(tmp_path, host):
+
+    path = tmp_path / "tuned.json"
+    _write(path, {"16cpu-64gb": {"n_workers": 2, "torch_threads": 8, "spell_batch_size": 32}})
+
+    tuned = load_config(str(path))
+
+    assert tuned["profile"] == "16cpu-64gb"
+    assert (tuned["n_workers"], tuned["torch_threads"], tuned["spell_batch_size"]) == (2, 8, 32)
+    # отсутствующие в профиле параметры - по умолчанию
+    assert tuned["ner_batch_size"] == default_config()["ner_batch_size"]
+
+
+def test_same_cpu_profile_keeps_threads_when_workers_fit(tmp_path, host):
+
+    path = tmp_path / "tuned.json"
+    _write(path, {"16cpu-128gb": {"n_workers": 4, "torch_threads": 4, "worker_memory": 8 * gb}})
+
+    tuned = load_config(str(path))
+
+    assert tuned["profile"] == "16cpu-128gb"
+    assert (tuned["n_workers"], tuned["torch_threads"]) == (4, 4)
+
+
+def test_same_cpu_profile_splits_threads_between_fewer_workers(tmp_path, host):
+
+    path = tmp_path / "tuned.json"
+    _write(path, {"16cpu-128gb": {"n_workers": 8, "torch_threads": 2, "worker_memory": 16 * gb}})
+
+    tuned = load_config(str(path))
+
+    # в 64 ГБ (80% - исполнителям) помещаются 3 процесса по 16 ГБ: ядра делятся между ними
+    assert (tuned["n_workers"], tuned["torch_threads"]) == (3, 5)
+
+
+def test_other_cpu_profile_is_not_used(tmp_path, host):
+
+    path = tmp_path / "tuned.json"
+    _write(path, {"8cpu-64gb": {"n_workers": 1, "torch_threads": 8}})
+
+    assert load_config(str(path))["profile"] == "default"
+
+
+@pytest.mark.parametrize("content", ["{не json", '{"profiles": []}', '{"profiles": {"cpu": {"n_workers": 1}}}',
+                                     '{"profiles": {"16cpu-128gb": {"n_workers": "8"}}}',
+                                     '{"profiles": {"16cpu-64gb": {"n_workers": "8"}}}',
+                                     '{"profiles": {"16cpu-64gb": {"spell_batch_size": 16.0}}}',
+                                     '{"profiles": {"16cpu-64gb": {"spell_decoding": null}}}',
+                                     '{"profiles": {"16cpu-64gb": {"worker_memory": "8gb"}}}'])
+def test_malformed_file_falls_back_to_default(tmp_path, host, content):
+
+    path = tmp_path / "tuned.json"
+    path.write_text(content, encoding="utf-8")
+
+    assert load_config(str(path)) == dict(default_config(), profile="default")
+
+
+def test_save_profile_keeps_other_profiles(tmp_path, host):
+
+    path = str(tmp_path / "config" / "tuned.json")
+
+    save_profile({"n_workers": 1}, path, "8cpu-32gb")
+    save_profile({"n_workers": 2}, path)
+
+    assert load_config(path, "8cpu-32gb")["n_workers"] == 1
+    assert load_config(path)["n_workers"] == 2
+
+
+def test_threads_per_worker():
+
+    assert threads_per_worker(3, 16) == 5
+    assert threads_per_worker(32, 16) == 1
+    assert threads_per_worker(0, 16) == 16
@@ -0,0 +1,182 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.form import FormTable, as_table, split_sheet_1, split_sheet_2, split_sheet_3, split_sheet_4, split_form, \
+    columns_sheet_1, columns_sheet_2, columns_sheet_3, columns_sheet_4_1, columns_sheet_4_2
+
+
+nan = np.nan
+
+
+def _sheets() -> list:
+
+    "Четыре листа анкеты в виде, в котором их возвращает read_form: шапки, пустые строки, числа"
+
+    sheet_1 = pd.DataFrame([["Анкета", nan], [nan, nan],
+                            ["Фамилия", "Иванов"], ["Имя", "Иван"], [nan, nan], ["Отчество", "Иванович"],
+                            ["2. Изменяли ли фамилию", "не изменял"], ["3. Дата рождения", "1980, 01 января, г. Москва"],
+                            ["4. Образование", nan], ["5. Номер паспорта", 4510123456]],
+                           columns=["Unnamed: 0", "Unnamed: 1"])
+
+    sheet_2 = pd.DataFrame([["14. Трудовая деятельность", nan, nan, nan], ["поступление", "увольнение", "должность", "адрес"],
+                            ["09.2015", "по настоящее время", "инженер", "г. Москва"],
+                            ["01.2010", nan, "техник", "г. Химки"],
+                            ["06.2005", "12.2009", "стажер", "Московская область, г. Химки"]],
+                           columns=["14", "Unnamed: 1", "Unnamed: 2", "Unnamed: 3"])
+
+    sheet_3 = pd.DataFrame([["родство", "ФИО", "рождение", "работа", "адрес"],
+                            ["мать", "Иванова Анна", 1955, "пенсионер", "г. Москва"],
+                            ["отец", "Иванов Петр", 1953, nan, "г. Москва"],
+                            ["брат", "Иванов Олег", 1985, "врач", "г. Тверь"]],
+                           columns=["15", "Unnamed: 1", "Unnamed: 2", "Unnamed: 3", "Unnamed: 4"])
+
+    sheet_4 = pd.DataFrame([["16. Родственники за границей", nan, nan], ["родство", "ФИО", "где"],
+                            ["сестра", "Иванова Мария", "Германия"], [nan, nan, nan], ["дядя", nan, "Израиль"],
+                            ["17. Места проживания", nan, nan], ["начало", "конец", "адрес"],
+                            ["1980", "1998", "г. Москва"], [nan, nan, nan], ["1998", nan, "г. Химки"],
+                            ["Дополнительные сведения", nan, nan], ["нет", nan, nan]],
+                           columns=["16", "Unnamed: 1", "Unnamed: 2"])
+
+    return [sheet_1, sheet_2, sheet_3, sheet_4]
+
+
+# Разбиение листов на таблицы через pandas - как до перехода на FormTable
+
+def _frame_sheet_1(sheet: pd.DataFrame) -> tuple:
+
+    sheet.columns = columns_sheet_1
+    sheet = sheet[2:].dropna(subset = ["Вопрос"]).reset_index(drop = True)
+
+    return sheet[:3].reset_index(drop = True), sheet[3:].reset_index(drop = True)
+
+
+def _frame_sheet_2(sheet: pd.DataFrame) -> pd.DataFrame:
+
+    sheet.columns = columns_sheet_2
+
+    return sheet[2:].dropna().reset_index(drop = True)
+
+
+def _frame_sheet_3(sheet: pd.DataFrame) -> pd.DataFrame:
+
+    sheet.columns = columns_sheet_3
+
+    return sheet[1:].dropna().reset_index(drop = True)
+
+
+def _frame_sheet_4(sheet: pd.DataFrame) -> tuple:
+
+    data_sheets_3_1 = sheet[2:5].dropna(how="all")
+    data_sheets_3_1.columns = columns_sheet_4_1
+
+    stop_idx = sheet[sheet.iloc[:, 0].str.contains("Дополнительные сведения", na=False)].index[0]
+    data_sheets_3_2 = sheet[7:stop_idx].dropna(how="all")
+    data_sheets_3_2.columns = columns_sheet_4_2
+
+    return data_sheets_3_1, data_sheets_3_2
+
+
+def _rows(table) -> list:
+
+    "Строки таблицы (FormTable или pd.DataFrame); пропуски - None"
+
+    rows = table.rows() if isinstance(table, FormTable) else table.astype(object).values.tolist()
+
+    return [[None if not isinstance(value, str) and pd.isna(value) else value for value in row] for row in rows]
+
+
+def test_split_matches_dataframe_path():
+
+    sheets = _sheets()
+    reference = [*_frame_sheet_1(sheets[0].copy()), _frame_sheet_2(sheets[1].copy()), _frame_sheet_3(sheets[2].copy()),
+                 *_frame_sheet_4(sheets[3].copy())]
+
+    tables = split_form(sheets)
+
+    assert [table.columns for table in tables] == [list(frame.columns) for frame in reference]
+    assert [_rows(table) for table in tables] == [_rows(frame) for frame in reference]
+
+
+def test_split_does_not_change_sheets():
+
+    sheets = _sheets()
+
+    for split_sheet, sheet in zip([split_sheet_1, split_sheet_2, split_sheet_3, split_sheet_4], sheets):
+        split_sheet(sheet)
+
+    for sheet, original in zip(sheets, _sheets()):
+        pd.testing.assert_frame_equal(sheet, original)
+
+
+def test_frame_round_trip_keeps_values():
+
+    table = split_sheet_3(_sheets()[2])
+    frame = table.to_frame()
+
+    assert list(frame.columns) == columns_sheet_3
+    assert frame["Число, месяц, год и место рождения, гражданство"].tolist() == [1955, 1985]
+    assert _rows(as_table(frame)) == _rows(table)
+    assert as_table(table) is table
+
+
+def test_column_views_stay_current():
+
+    table = FormTable(columns_sheet_4_2, [["1980", "1998", "г. Москва"]])
+    column = table["Адрес проживания и регистрации"]
+
+    table["Адрес проживания и регистрации"] = ["Москва"]
+    table["Период проживания начало"][0] = "01.1980"
+
+    assert column == ["Москва"]
+    assert table.rows() == [["01.1980", "1998", "Москва"]]
+
+
+def test_column_count_is_checked():
+
+    with pytest.raises(ValueError):
+        FormTable(columns_sheet_4_1, [["сестра", "Иванова Мария"]])
+
+
+def test_map_waits_for_futures_after_whole_column():
+
+    "Функция, возвращающая Future, вызывается для всех ячеек колонки до ожидания первого результата"
+
+    table = FormTable(["Вопрос", "Ответ"], [["1", "а"], ["2", "б"], ["3", "в"]])
+    all_submitted = threading.Event()
+    submitted = []
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+
+        def submit(value):
+
+            submitted.append(value)
+            if len(submitted) == 3: all_submitted.set()
+
+            # результат ячейки готов только после постановки всех ячеек колонки (иначе - тайм-аут)
+            return executor.submit(lambda: value.upper() if all_submitted.wait(timeout=5) else None)
+
+        table.map("Ответ", submit)
+
+    assert table["Ответ"] == ["А", "Б", "В"]
+
+
+def test_map_mixes_futures_and_values():
+
+    table = FormTable(["Ответ"], [["нет"], ["текст"]])
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        table.map("Ответ", lambda value: value if value == "нет" else executor.submit(str.upper, value))
+
+    assert table["Ответ"] == ["нет", "ТЕКСТ"]
+
+
+def test_map_raises_future_exception():
+
+    table = FormTable(["Ответ"], [["текст"]])
+
+    with ThreadPoolExecutor(max_workers=1) as executor, pytest.raises(ZeroDivisionError):
+        table.map("Ответ", lambda value: executor.submit(lambda: 1 / 0))
@@ -0,0 +1,154 @@
+import sys
+import time
+import types
+
+import pytest
+
+from src import jobqueue
+from src.jobqueue import JobQueue, SQLiteJobQueue, run_worker, run_workers
+
+
+@pytest.fixture
+def queue(tmp_path):
+
+    return SQLiteJobQueue(str(tmp_path / "queue.sqlite"), max_attempts=2)
+
+
+def test_job_queue_is_abstract():
+
+    with pytest.raises(TypeError):
+        JobQueue()
+
+
+def test_enqueue_is_idempotent(queue):
+
+    assert queue.enqueue("a.xlsx")
+    assert not queue.enqueue("a.xlsx")
+    assert queue.counts() == {"queued": 1}
+
+
+def test_lease_complete(queue):
+
+    queue.enqueue("a.xlsx")
+
+    job = queue.lease("w1")
+
+    assert job["filename"] == "a.xlsx" and job["attempts"] == 1
+    assert queue.lease("w2") is None
+    assert queue.heartbeat(job["id"], "w1")
+    assert not queue.heartbeat(job["id"], "w2")
+    assert not queue.complete(job["id"], "w2")
+    assert queue.complete(job["id"], "w1")
+    assert queue.counts() == {"done": 1}
+
+
+def test_expired_lease_is_given_to_another_worker(queue):
+
+    queue.enqueue("a.xlsx")
+
+    job = queue.lease("w1", lease_seconds=-1)
+    released = queue.lease("w2")
+
+    assert released["id"] == job["id"] and released["attempts"] == 2
+    assert not queue.heartbeat(job["id"], "w1")
+    assert not queue.complete(job["id"], "w1")
+    assert queue.complete(job["id"], "w2")
+
+
+def test_failures_go_to_dead_letter(queue):
+
+    queue.enqueue("a.xlsx")
+
+    assert queue.fail(queue.lease("w1")["id"], "w1", "ошибка 1") == "queued"
+    assert queue.fail(queue.lease("w1")["id"], "w1", "ошибка 2") == "dead"
+    assert queue.lease("w1") is None
+
+    dead = queue.dead_letters()
+    assert [(job["filename"], job["attempts"], job["last_error"]) for job in dead] == [("a.xlsx", 2, "ошибка 2")]
+
+
+def test_fail_missing_job(queue):
+
+    assert queue.fail(42, "w1", "ошибка") is None
+
+
+def test_expired_lease_after_last_attempt_goes_to_dead_letter(queue):
+
+    queue.enqueue("a.xlsx")
+    queue.lease("w1", lease_seconds=-1)
+    queue.lease("w1", lease_seconds=-1)
+
+    assert queue.lease("w1") is None
+    assert queue.dead_letters()[0]["last_error"] == "Аренда истекла"
+
+
+@pytest.fixture
+def worker_env(tmp_path, monkeypatch):
+
+    "Исполнитель без моделей: file_processor, реестр моделей и настройка потоков torch подменяются в тесте"
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+
+    registry = types.SimpleNamespace(log=None, watch=lambda: None)
+    processor = types.ModuleType("src.processor")
+    spellcheck = types.ModuleType("src.spellcheck")
+    spellcheck.registry = registry
+    spellcheck.threads = []
+    spellcheck.init_threads = spellcheck.threads.append
+    processor.spellcheck = spellcheck
+
+    monkeypatch.setitem(sys.modules, "src.processor", processor)
+    monkeypatch.setitem(sys.modules, "src.spellcheck", spellcheck)
+
+    return processor
+
+
+def test_worker_completes_and_fails_jobs(queue, worker_env):
+
+    queue.enqueue("ok.xlsx")
+    queue.enqueue("bad.xlsx", priority=2)
+
+    def file_processor(filename, **kwargs):
+        if filename == "bad.xlsx": raise ValueError("нет листа")
+        return filename
+
+    worker_env.file_processor = file_processor
+
+    assert run_worker(queue, worker_id="w1", exit_when_empty=True) == 1
+    assert queue.counts() == {"done": 1, "dead": 1}
+
+
+def test_worker_does_not_complete_job_after_losing_lease(queue, worker_env):
+
+    queue.enqueue("a.xlsx")
+
+    def file_processor(filename, **kwargs):
+
+        # аренда истекает, анкету берет другой исполнитель
+        time.sleep(0.1)
+        assert queue.lease("w2")["filename"] == "a.xlsx"
+        time.sleep(0.1)
+
+    worker_env.file_processor = file_processor
+
+    n_done = run_worker(queue, worker_id="w1", lease_seconds=0.05, heartbeat_interval=0.5, exit_when_empty=True)
+
+    assert n_done == 0
+    assert queue.counts() == {"leased": 1}
+    assert queue.complete(1, "w2")
+
+
+@pytest.mark.parametrize("tuned_workers, threads", [(1, None), (2, 8)])
+def test_workers_split_threads_when_count_differs_from_tuned(tmp_path, worker_env, monkeypatch, tuned_workers, threads):
+
+    monkeypatch.setitem(jobqueue.tuned, "n_workers", tuned_workers)
+    monkeypatch.setattr(jobqueue, "threads_per_worker", lambda n_workers: 8 // n_workers)
+    worker_env.file_processor = lambda filename, **kwargs: filename
+
+    path = str(tmp_path / "queue.sqlite")
+
+    # подобранное число процессов - потоки из настроек хоста (None), иначе - ядра поровну между процессами
+    run_workers(path, 1, exit_when_empty=True)
+
+    assert worker_env.spellcheck.threads == [threads]
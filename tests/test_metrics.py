@@ -0,0 +1,67 @@
+import urllib.request
+
+from src import metrics
+from src.jobqueue import SQLiteJobQueue, export_counts
+
+
+def test_counter_and_histogram_exposition():
+
+    counter = metrics.Counter("test_cells_total", "Тестовый счетчик")
+    counter.inc(route="neural")
+    counter.inc(2, route="neural")
+
+    histogram = metrics.Histogram("test_latency_seconds", "Тестовая гистограмма", buckets=(0.1, 1))
+    histogram.observe(0.5, stage="form")
+
+    assert 'test_cells_total{route="neural"} 3' in counter.expose()
+
+    lines = histogram.expose()
+    assert 'test_latency_seconds_bucket{stage="form",le="0.1"} 0' in lines
+    assert 'test_latency_seconds_bucket{stage="form",le="1"} 1' in lines
+    assert 'test_latency_seconds_bucket{stage="form",le="+Inf"} 1' in lines
+    assert 'test_latency_seconds_count{stage="form"} 1' in lines
+
+
+def test_label_values_are_escaped():
+
+    assert metrics._format_labels((("file", 'a"b\\c'),)) == '{file="a\\"b\\\\c"}'
+
+
+def test_export_counts_sets_job_gauges(tmp_path):
+
+    queue = SQLiteJobQueue(str(tmp_path / "queue.sqlite"))
+    queue.enqueue("a.xlsx")
+    queue.enqueue("b.xlsx")
+    queue.lease("worker")
+
+    counts = export_counts(queue)
+
+    assert counts == {"queued": 1, "leased": 1}
+
+    text = metrics.expose()
+    assert 'etl_jobs{status="queued"} 1' in text
+    assert 'etl_jobs{status="dead"} 0' in text
+    assert 'etl_queue_depth{queue="forms"} 1' in text
+
+
+def test_write_textfile(tmp_path):
+
+    path = tmp_path / "metrics.prom"
+    metrics.write_textfile(str(path))
+
+    assert "# TYPE etl_forms_processed_total counter" in path.read_text(encoding="utf-8")
+    assert not (tmp_path / "metrics.prom.tmp").exists()
+
+
+def test_http_server_serves_metrics():
+
+    server = metrics.start_http_server(port=0)
+
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert "etl_jobs" in response.read().decode("utf-8")
+
+    finally:
+        server.shutdown()
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from transformers import AutoConfig, AutoModelForTokenClassification, AutoTokenizer, pipeline
+
+from src.ner_packing import pack_segments, packed_token_classification, _entity_keys
+
+
+path_to_tokenizer = os.path.join(os.path.dirname(__file__), "..", "model", "bert-finetuned-ner-addresses-accelerate")
+
+
+def test_pack_segments_keeps_order_and_max_length():
+
+    lengths = [5, 3, 8, 2, 2, 9, 1, 10, 4]
+
+    packs = pack_segments(lengths, max_length=10)
+
+    assert [i for pack in packs for i in pack] == list(range(len(lengths)))
+    assert all(sum(lengths[i] for i in pack) <= 10 for pack in packs)
+    assert packs == [[0, 1], [2, 3], [4], [5, 6], [7], [8]]
+
+
+@pytest.mark.parametrize("lengths, packs", [([7], [[0]]), ([10], [[0]]), ([], [])])
+def test_pack_segments_single_segment(lengths, packs):
+
+    assert pack_segments(lengths, max_length=10) == packs
+
+
+@pytest.fixture(scope="module")
+def token_classifier():
+
+    "NER-пайплайн со словарем модели адресов и маленькой случайной моделью"
+
+    config = AutoConfig.from_pretrained(path_to_tokenizer)
+    config.update({"hidden_size": 32, "num_hidden_layers": 2, "num_attention_heads": 2, "intermediate_size": 64})
+
+    torch.manual_seed(0)
+    model = AutoModelForTokenClassification.from_config(config)
+    model.eval()
+
+    return pipeline("token-classification", model=model, tokenizer=AutoTokenizer.from_pretrained(path_to_tokenizer),
+                    aggregation_strategy="simple")
+
+
+def test_packed_entities_match_plain_call(token_classifier):
+
+    texts = ["Республика Татарстан", "г. Казань", "ул. Баумана", "д. 5", "кв. 12", "Московская область",
+             "Ленинский район", "пос. Горки", "ул. Пролетарская, д. 7"] * 3
+
+    plain = token_classifier(texts)
+    packed = packed_token_classification(token_classifier, texts, max_length=16, packs_per_batch=2)
+
+    assert [_entity_keys(entities) for entities in packed] == [_entity_keys(entities) for entities in plain]
+    assert any(len(entities) > 0 for entities in plain)
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from src.registry import ModelRegistry, read_manifest, write_manifest, stamp, format_versions
+
+
+class _Log:
+
+    "Лог в памяти: (сообщение, тип)"
+
+    def __init__(self):
+
+        self.records = []
+
+    def write_log(self, message: str = "", content: str = "MSG"):
+
+        self.records.append((message, content))
+
+
+def _load(entry: dict) -> dict:
+
+    if entry.get("broken"): raise OSError("файл модели не найден")
+
+    return {"version": entry["version"]}
+
+
+@pytest.fixture
+def registry(tmp_path):
+
+    registry = ModelRegistry(str(tmp_path / "registry.json"), log=_Log())
+    registry.register("spellcheck", _load, lambda handles: None, {"version": "v1"})
+
+    return registry
+
+
+def _wait(condition, timeout: float = 5) -> bool:
+
+    deadline = time.time() + timeout
+
+    while time.time() < deadline:
+        if condition(): return True
+        time.sleep(0.01)
+
+    return False
+
+
+def test_register_uses_manifest_entry(tmp_path):
+
+    write_manifest({"spellcheck": {"version": "v7"}}, str(tmp_path / "registry.json"))
+
+    registry = ModelRegistry(str(tmp_path / "registry.json"))
+    registry.register("spellcheck", _load, lambda handles: None, {"version": "v1"})
+
+    assert registry.versions() == {"spellcheck": "v7"}
+
+
+def test_deploy_replaces_version_and_notifies(registry):
+
+    notified = []
+    registry.add_listener(lambda name, model_version: notified.append((name, model_version.version)))
+
+    assert registry.deploy("spellcheck", {"version": "v2"})
+    assert not registry.deploy("spellcheck", {"version": "v2"})
+
+    with registry.acquire("spellcheck") as handles:
+        assert handles == {"version": "v2"}
+
+    assert notified == [("spellcheck", "v2")]
+    assert registry.log.records[-1] == ("spellcheck: версия v1 выгружена", "MSG")
+
+
+def test_failed_deploy_keeps_current_version(registry):
+
+    assert not registry.deploy("spellcheck", {"version": "v2", "broken": True})
+
+    assert registry.versions() == {"spellcheck": "v1"}
+    assert registry.log.records[-1][1] == "ERR"
+
+
+def test_old_version_is_kept_until_batches_finish(registry):
+
+    with registry.acquire("spellcheck") as handles:
+
+        old_version = registry.current["spellcheck"]
+        deploy = threading.Thread(target=registry.deploy, args=("spellcheck", {"version": "v2"}))
+        deploy.start()
+
+        # новые пакеты получают новую версию, взятая пакетом версия не освобождается
+        assert _wait(lambda: registry.versions() == {"spellcheck": "v2"})
+        assert handles == {"version": "v1"} and old_version.handles is not None
+
+    deploy.join(timeout=5)
+
+    assert old_version.handles is None
+
+
+def test_check_deploys_changed_versions(registry):
+
+    write_manifest({"spellcheck": {"version": "v2"}, "unknown": {"version": "x"}}, registry.manifest_path)
+
+    assert registry.check() == ["spellcheck"]
+    assert registry.check() == []
+
+
+def test_watch_survives_malformed_manifest(registry):
+
+    with open(registry.manifest_path, "w", encoding="utf-8") as f:
+        f.write("{не json")
+
+    registry.watch(interval=0.01)
+
+    assert _wait(lambda: any(content == "ERR" for _, content in registry.log.records))
+    assert registry.watcher.is_alive()
+
+    # исправленный файл версий применяется тем же потоком
+    write_manifest({"spellcheck": {"version": "v2"}}, registry.manifest_path)
+
+    assert _wait(lambda: registry.versions() == {"spellcheck": "v2"})
+
+
+def test_read_manifest_missing_file(tmp_path):
+
+    assert read_manifest(str(tmp_path / "missing.json")) == {}
+
+
+def test_stamp_and_format_versions():
+
+    versions = stamp({"spellcheck": "v1", "ner_names": "stable"}, {"spellcheck": "v2", "ner_names": "stable"})
+
+    assert versions == {"spellcheck": "v1->v2", "ner_names": "stable"}
+    assert format_versions(versions) == "spellcheck=v1->v2, ner_names=stable"
+
+
+def test_loaded(tmp_path, registry):
+
+    assert registry.loaded()
+    assert not ModelRegistry(str(tmp_path / "registry.json")).loaded()
+
+    registry.current["spellcheck"].handles = None
+
+    assert not registry.loaded()
@@ -0,0 +1,51 @@
+import math
+
+import pytest
+
+from src.router import CellRouter, ROUTE_NEURAL, ROUTE_PASSTHROUGH, ROUTE_RULES, route_cell, rule_correct
+
+
+@pytest.mark.parametrize("value", [None, math.nan, 12, "", "   ", "нет", " Не имею. ", "12.05.2001", "+7 (900) 123-45-67",
+                                   "№ 45 01 123456"])
+def test_passthrough(value):
+
+    assert route_cell(value) == ROUTE_PASSTHROUGH
+
+
+def test_template_text_is_passthrough():
+
+    assert route_cell("Фамилия,  имя, отчество.", frozenset({"фамилия, имя, отчество"})) == ROUTE_PASSTHROUGH
+    assert route_cell("Фамилия, имя, отчество") == ROUTE_NEURAL
+
+
+def test_latin_only_goes_to_rules():
+
+    assert route_cell("Moscow State University") == ROUTE_RULES
+    assert rule_correct("Moscow State University") == ""
+    assert rule_correct("MSU 2005") == "2005"
+
+
+def test_mixed_text_goes_to_model():
+
+    assert route_cell("ООО Ромашка, IT-отдел") == ROUTE_NEURAL
+    assert route_cell("г. Москва, ул. Ленина") == ROUTE_NEURAL
+
+
+def test_router_calls_model_only_for_neural_cells():
+
+    calls = []
+
+    def correct_fn(value):
+        calls.append(value)
+        return value.upper()
+
+    router = CellRouter(correct_fn)
+
+    assert router("москва") == "МОСКВА"
+    assert router(" нет ") == "нет"
+    assert router(" 12.05.2001 ") == "12.05.2001"
+    assert router(None) is None
+    assert router("London") == ""
+
+    assert calls == ["москва"]
+    assert router.report() == "passthrough: 3, rules: 1, neural: 1"
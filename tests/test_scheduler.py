@@ -0,0 +1,80 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.scheduler import submission_time, effective_priority, schedule, aging_seconds
+from src.jobqueue import SQLiteJobQueue, scan
+
+
+@pytest.fixture
+def local_tz(monkeypatch):
+
+    # часовой пояс, отличный от UTC: ошибка "наивное время как UTC" сдвигает время на 3 часа
+    monkeypatch.setenv("TZ", "Europe/Moscow")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_submission_time():
+
+    assert submission_time("form_ivanov_01022024103000.xlsx") == datetime(2024, 2, 1, 10, 30, 0)
+
+
+def test_effective_priority_ages():
+
+    assert effective_priority(2, 0) == 2
+    assert effective_priority(2, aging_seconds) == 1
+    assert effective_priority(2, 5 * aging_seconds) == 0
+    assert effective_priority(1, -aging_seconds) == 1
+
+
+def test_schedule_order(tmp_path):
+
+    now = datetime(2024, 2, 1, 12, 0, 0)
+    file_names = ["a_01022024110000.xlsx", "b_01022024100000.xlsx", "c_01022024115000.xlsx", "d_01022024090000.xlsx"]
+    priorities = {"c_01022024115000.xlsx": 0, "d_01022024090000.xlsx": 2}
+
+    plan = schedule(file_names, str(tmp_path), priorities, now = now, n_workers = 2)
+
+    # b ожидает 2 часа (1 -> 0) и подана раньше срочной c; d ожидает 3 часа (2 -> 1) и подана раньше a
+    assert list(plan["filename"]) == ["b_01022024100000.xlsx", "c_01022024115000.xlsx",
+                                      "d_01022024090000.xlsx", "a_01022024110000.xlsx"]
+    assert list(plan["effective_priority"]) == [0, 0, 1, 1]
+
+    # два исполнителя: первые две анкеты начинаются сразу, третья - после первой
+    assert list(plan["expected_start"][:2]) == [now, now]
+    assert plan["expected_start"][2] == plan["expected_done"][0]
+    assert plan["on_time"].all()
+
+
+def test_scan_stores_local_submission_time(tmp_path, monkeypatch, local_tz):
+
+    monkeypatch.chdir(tmp_path)
+    for name in ["logs", "raw", "processed"]:
+        (tmp_path / name).mkdir()
+
+    (tmp_path / "raw" / "a_01022024103000.xlsx").touch()
+
+    queue = SQLiteJobQueue(str(tmp_path / "queue.sqlite"))
+
+    assert scan(queue, str(tmp_path / "raw"), str(tmp_path / "processed")) == 1
+
+    job = queue.lease("w1")
+
+    assert job["submitted_at"] == datetime(2024, 2, 1, 10, 30, 0).timestamp()
+
+
+def test_lease_ages_by_local_submission_time(tmp_path, local_tz):
+
+    queue = SQLiteJobQueue(str(tmp_path / "queue.sqlite"))
+
+    # анкета с низким приоритетом ожидает дольше aging_seconds * 2 - обгоняет новую обычную
+    old = datetime.now() - timedelta(seconds=2 * aging_seconds + 60)
+    queue.enqueue("new.xlsx", priority=1, cost=1, submitted_at=datetime.now().timestamp())
+    queue.enqueue("old.xlsx", priority=2, cost=100, submitted_at=old.timestamp())
+
+    assert queue.lease("w1")["filename"] == "old.xlsx"
+    assert queue.lease("w1")["filename"] == "new.xlsx"
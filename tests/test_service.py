@@ -0,0 +1,104 @@
+import asyncio
+import importlib
+import json
+import locale
+import sys
+import types
+
+import pytest
+
+from src.registry import ModelRegistry
+
+
+def _correct(texts: list) -> list:
+
+    "Пакетная функция: ячейка со словом 'ошибка' не обрабатывается"
+
+    if any("ошибка" in text for text in texts): raise ValueError("ошибка модели")
+
+    return [text.upper() for text in texts]
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+
+    "Модуль service без моделей: spellcheck и processor подменяются в тесте, реестр - с тестовой моделью"
+
+    registry = ModelRegistry(str(tmp_path / "registry.json"))
+    registry.register("spellcheck", lambda entry: {"version": entry["version"]}, lambda handles: None, {"version": "v1"})
+
+    spellcheck = types.ModuleType("src.spellcheck")
+    spellcheck.correct_errors_batch = spellcheck.name_reconstruct_batch = spellcheck.address_reconstruct_batch = _correct
+    spellcheck.registry = registry
+    spellcheck.init_threads = lambda n_threads=None: None
+    processor = types.ModuleType("src.processor")
+    processor.file_processor = None
+
+    monkeypatch.setitem(sys.modules, "src.spellcheck", spellcheck)
+    monkeypatch.setitem(sys.modules, "src.processor", processor)
+    monkeypatch.delitem(sys.modules, "src.service", raising=False)
+
+    try:
+        return importlib.import_module("src.service")
+    except locale.Error:
+        pytest.skip("нужна локаль ru_RU (см. src/rules.py)")
+
+
+def _run(coroutine_fn):
+
+    return asyncio.run(coroutine_fn())
+
+
+def test_failed_batch_fails_only_bad_items(service):
+
+    async def main():
+
+        batcher = service.MicroBatcher(_correct, max_batch_size=3, max_wait=0.1)
+        batcher.start()
+
+        results = await asyncio.gather(*[batcher.submit(text) for text in ["а", "ошибка", "б"]], return_exceptions=True)
+        await batcher.stop()
+
+        return results, batcher.batches_done
+
+    (first, failed, last), batches_done = _run(main)
+
+    assert (first, last) == ("А", "Б")
+    assert isinstance(failed, ValueError)
+    assert batches_done == 1
+
+
+def test_handle_cells(service):
+
+    async def main():
+
+        corrector = service.CorrectorService(max_batch_size=4, max_wait=0.01)
+        for batcher in corrector.batchers.values():
+            batcher.start()
+
+        responses = [await corrector.handle_cells("correct_errors", json.dumps({"cells": cells}).encode())
+                     for cells in [["а", None, 5], "ab", 5, {"a": 1}]]
+        responses.append(await corrector.handle_cells("correct_errors", b"{"))
+
+        for batcher in corrector.batchers.values():
+            await batcher.stop()
+
+        return responses
+
+    responses = _run(main)
+
+    assert responses[0][0] == 200 and json.loads(responses[0][2]) == {"cells": ["А", None, 5]}
+    # не список ячеек: строка, число, объект, не JSON
+    assert [status for status, *_ in responses[1:]] == [400, 400, 400, 400]
+
+
+def test_status_reads_models_from_registry(service):
+
+    corrector = service.CorrectorService()
+
+    assert corrector.status()["models_loaded"] is True
+    assert corrector.status()["model_versions"] == {"spellcheck": "v1"}
+
+    service.registry.current["spellcheck"].handles = None
+
+    assert corrector.status()["models_loaded"] is False
@@ -0,0 +1,119 @@
+import copy
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from transformers import M2M100Config, M2M100ForConditionalGeneration
+
+from src import speculative
+from src.speculative import speculative_generate, unsupported_settings, _crop_cache
+
+
+lang = 4
+
+
+@pytest.fixture(scope="module")
+def model():
+
+    "Маленькая случайная модель M2M100"
+
+    config = M2M100Config(vocab_size=64, d_model=16, encoder_layers=2, decoder_layers=2, encoder_attention_heads=2,
+                          decoder_attention_heads=2, encoder_ffn_dim=32, decoder_ffn_dim=32, max_position_embeddings=64)
+
+    torch.manual_seed(0)
+
+    return M2M100ForConditionalGeneration(config).eval()
+
+
+def _greedy(model, input_ids: torch.Tensor, max_new_tokens: int = 20) -> list:
+
+    return model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), forced_bos_token_id=lang,
+                          max_new_tokens=max_new_tokens, num_beams=1, do_sample=False)[0].tolist()
+
+
+@pytest.mark.parametrize("source", [[5, 6, 7, 8, 9, 10, 11, 2], [12, 2], list(range(20, 50)) + [2]])
+def test_matches_greedy_generate(model, source):
+
+    input_ids = torch.tensor([source])
+
+    sequence, _ = speculative_generate(model, input_ids, torch.ones_like(input_ids), forced_bos_token_id=lang,
+                                       max_new_tokens=20)
+
+    assert sequence[0].tolist() == _greedy(model, input_ids)
+
+
+def test_draft_from_source_is_accepted(model):
+
+    # исходный текст повторяет жадный выход: черновики из исходного текста принимаются
+    greedy = _greedy(model, torch.tensor([[5, 6, 7, 8, 9, 10, 11, 2]]))
+    input_ids = torch.tensor([greedy[2:]])
+
+    sequence, n_forward = speculative_generate(model, input_ids, torch.ones_like(input_ids), forced_bos_token_id=lang,
+                                               max_new_tokens=20)
+
+    expected = _greedy(model, input_ids)
+
+    assert sequence[0].tolist() == expected
+    assert n_forward < len(expected) - 2
+
+
+@pytest.mark.parametrize("n_correct", [0, 1, 3])
+def test_partially_accepted_draft(model, monkeypatch, n_correct):
+
+    "Черновик: n_correct токенов жадного выхода и неверный токен - кэш обрезается до принятых токенов"
+
+    input_ids = torch.tensor([[5, 6, 7, 8, 9, 10, 11, 2]])
+    expected = _greedy(model, input_ids)
+
+    def lookup_draft(seq, source, cursor, draft_len, ngram_max):
+        draft = expected[len(seq):len(seq) + n_correct][:draft_len]
+        return (draft + [63])[:draft_len], cursor
+
+    monkeypatch.setattr(speculative, "_lookup_draft", lookup_draft)
+
+    sequence, n_forward = speculative_generate(model, input_ids, torch.ones_like(input_ids), forced_bos_token_id=lang,
+                                               max_new_tokens=20)
+
+    assert sequence[0].tolist() == expected
+    # за проход принимаются n_correct токенов черновика и токен модели
+    assert n_forward <= -(-(len(expected) - 2) // (n_correct + 1))
+
+
+def test_crop_legacy_cache():
+
+    layer = tuple(torch.zeros(1, 2, 5, 4) for _ in range(2)) + tuple(torch.zeros(1, 2, 7, 4) for _ in range(2))
+
+    cropped = _crop_cache((layer, layer), 3)
+
+    assert [tuple(tensor.shape[2] for tensor in layer) for layer in cropped] == [(3, 3, 7, 7)] * 2
+
+
+def test_unsupported_settings_fall_back_to_generate(model, spellcheck, monkeypatch):
+
+    beam_model = copy.deepcopy(model)
+    beam_model.generation_config.num_beams = 2
+
+    assert unsupported_settings(model) == []
+    assert unsupported_settings(beam_model) == ["num_beams=2"]
+
+    input_ids = torch.tensor([[5, 6, 7, 8, 9, 10, 11, 2]])
+
+    with pytest.raises(ValueError):
+        speculative_generate(beam_model, input_ids)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("спекулятивное декодирование при лучевом поиске")
+
+    monkeypatch.setattr(spellcheck, "spell_decoding", "speculative")
+    monkeypatch.setattr(spellcheck, "speculative_generate", fail)
+
+    class Tokenizer:
+        pad_token_id = 1
+
+    spell = {"model": beam_model, "tokenizer": Tokenizer(), "lang_id": lang}
+    encodings = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+    assert spellcheck._generate(encodings, spell).tolist() == \
+        beam_model.generate(**encodings, forced_bos_token_id=lang, max_new_tokens=200).tolist()
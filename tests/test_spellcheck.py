@@ -0,0 +1,139 @@
+import math
+import types
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+pad, eos, lang, token = 1, 2, 3, 0
+
+
+def _scores(probability: float) -> torch.Tensor:
+
+    "Логиты шага с вероятностью probability у token (остальное - поровну между прочими токенами)"
+
+    probabilities = torch.full((4,), (1 - probability) / 3)
+    probabilities[token] = probability
+
+    return probabilities.log()
+
+
+class _Student:
+
+    "Ученик, генерирующий token и конец последовательности с заданными вероятностями для каждой строки"
+
+    def __init__(self, probabilities: list):
+
+        self.probabilities = probabilities
+
+    def generate(self, **kwargs):
+
+        forced = torch.full((4,), -math.inf)
+        forced[lang] = 0
+
+        steps = [torch.stack([forced] * len(self.probabilities)),
+                 torch.stack([_scores(p) for p in self.probabilities]),
+                 torch.stack([_scores(p).roll(eos - token) for p in self.probabilities])]
+
+        sequences = torch.tensor([[eos, lang, token, eos]] * len(self.probabilities))
+
+        return types.SimpleNamespace(sequences=sequences, scores=tuple(steps))
+
+    def compute_transition_scores(self, sequences, scores, normalize_logits=True):
+
+        log_probs = torch.stack(scores, dim=1).log_softmax(dim=-1)
+
+        return log_probs.gather(2, sequences[:, -len(scores):, None])[..., 0]
+
+
+class _Tokenizer:
+
+    pad_token_id = pad
+
+    def __call__(self, texts, **kwargs):
+
+        return {}
+
+    def batch_decode(self, sequences, skip_special_tokens=True):
+
+        return ["ученик"] * len(sequences)
+
+
+def test_forced_language_token_is_not_counted(spellcheck):
+
+    _, confidence = spellcheck._student_generate({}, {"tokenizer": _Tokenizer(), "lang_id": lang}, _Student([0.95, 0.75]))
+
+    # без первого шага (вероятность 1) уверенность 0.75 не завышается до 0.75 ** (2/3) > 0.8
+    assert confidence == pytest.approx([0.95, 0.75])
+
+
+def test_low_confidence_is_escalated_to_teacher(spellcheck, monkeypatch):
+
+    teacher_calls = []
+
+    def teacher_batch(sentences, spell):
+        teacher_calls.append(sentences)
+        return ["учитель: " + sentence for sentence in sentences]
+
+    monkeypatch.setattr(spellcheck, "_teacher_batch", teacher_batch)
+    monkeypatch.setattr(spellcheck, "student_threshold", 0.8)
+
+    answers = spellcheck._correct_batch(["а", "б", "в"], {"tokenizer": _Tokenizer(), "lang_id": lang},
+                                        _Student([0.95, 0.75, 0.9]))
+
+    assert answers == ["ученик", "учитель: б", "ученик"]
+    assert teacher_calls == [["б"]]
+
+
+long_text = ("Работал в ООО «Ромашка» инженером по охране труда. Отвечал за проверку оборудования, "
+             "обучение сотрудников, ведение журналов инструктажа и подготовку отчетов для руководства компании, "
+             "а также за связь с инспекцией. Уволился по собственному желанию!")
+
+
+@pytest.mark.parametrize("text", [long_text, "г. Москва, ул. Ленина, д. 1. " * 8, "а" * 200, "Короткий текст."])
+def test_split_segments_round_trip(spellcheck, text):
+
+    assert "".join(segment + separator for segment, separator in spellcheck.split_segments(text)) == text
+
+
+def test_short_text_is_not_split(spellcheck):
+
+    text = "Работал инженером. Уволился, по собственному желанию"
+
+    assert spellcheck.split_segments(text) == [(text, "")]
+    assert spellcheck.split_segments(text, min_chars=10) != [(text, "")]
+
+
+def test_split_by_sentences_and_commas(spellcheck):
+
+    segments = [segment for segment, _ in spellcheck.split_segments(long_text)]
+
+    # границы предложений - всегда, длинное второе предложение - еще и по запятым
+    assert segments[0] == "Работал в ООО «Ромашка» инженером по охране труда"
+    assert segments[-1] == "Уволился по собственному желанию!"
+    assert len(segments) > 3
+    assert all(len(segment) <= spellcheck.segment_max_chars for segment in segments[1:-1])
+
+    # сокращения ("ул.") границей предложения не считаются
+    assert [separator for _, separator in spellcheck.split_segments("Москва, ул. Ленина. " * 8, max_chars=1000)] \
+        == [". "] * 7 + [""]
+
+
+def test_batch_stitches_segments(spellcheck, monkeypatch):
+
+    calls = []
+
+    def correct_batch(sentences, spell, student=None):
+        calls.append(list(sentences))
+        return [sentence.upper() for sentence in sentences]
+
+    monkeypatch.setattr(spellcheck, "_correct_batch", correct_batch)
+    monkeypatch.setattr(spellcheck, "spell_batch_size", 2)
+
+    answers = spellcheck.correct_errors_batch(["короткий текст", long_text, " "])
+
+    assert answers == ["КОРОТКИЙ ТЕКСТ", long_text.upper(), ""]
+    # части всех ячеек - общими пакетами по spell_batch_size
+    assert all(len(batch) <= 2 for batch in calls)
+    assert sum(len(batch) for batch in calls) == 1 + len(spellcheck.split_segments(long_text))
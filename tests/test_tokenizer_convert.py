@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+pytest.importorskip("sentencepiece")
+pytest.importorskip("tokenizers")
+pytest.importorskip("transformers")
+
+from transformers import M2M100Tokenizer
+
+from src.tokenizer_convert import convert_tokenizer, verify_tokenizer, sample_texts
+
+
+path_to_tokenizer_slow = os.path.join(os.path.dirname(__file__), "..", "model", "M2M100_tokenizer")
+
+texts = sample_texts + ["  пробелы в начале", "пробелы в конце  ", "\tтабуляция\t", "много   пробелов  внутри",
+                        " Latin text only ", "Смешанный text: ул. Lenina, д. 5", "ё Ё № «кавычки» — тире", "   "]
+
+
+@pytest.fixture(scope="module")
+def tokenizers(tmp_path_factory):
+
+    tokenizer_slow = M2M100Tokenizer.from_pretrained(path_to_tokenizer_slow)
+    tokenizer_fast = convert_tokenizer(path_to_tokenizer_slow, str(tmp_path_factory.mktemp("tokenizer_fast")))
+
+    return tokenizer_slow, tokenizer_fast
+
+
+def test_fast_tokenizer_matches_slow(tokenizers):
+
+    assert verify_tokenizer(*tokenizers, texts) == []
+
+
+def test_padded_batch_matches_slow(tokenizers):
+
+    tokenizer_slow, tokenizer_fast = tokenizers
+
+    ids_slow = tokenizer_slow(texts, padding=True)["input_ids"]
+    ids_fast = tokenizer_fast(texts, padding=True)["input_ids"]
+
+    assert ids_fast == ids_slow
@@ -0,0 +1,75 @@
+import locale
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+try:
+    from src.validator import check_condition_2, check_condition_3_1, check_condition_3_2, check_condition_4, \
+        validate, failing_forms, unreadable_forms
+except locale.Error:
+    pytest.skip("нужна локаль ru_RU (см. src/rules.py)", allow_module_level=True)
+
+
+def test_condition_2():
+
+    assert check_condition_2("09.2015") == (True, "09.2015")
+    assert check_condition_2("01.09.2015") == (False, "09.2015")
+    assert check_condition_2("по настоящее время") == (True, "по настоящее время")
+    assert check_condition_2(None) == (False, None)
+
+
+@pytest.mark.parametrize("value", [datetime(2015, 9, 1), pd.Timestamp("2015-09-01")])
+def test_condition_2_accepts_excel_dates(value):
+
+    assert check_condition_2(value) == (True, "09.2015")
+
+
+@pytest.mark.parametrize("value", ["мать", "тётя", "Жена Ёлкина"])
+def test_condition_3_1_accepts_yo(value):
+
+    assert check_condition_3_1(value) == (True, value)
+
+
+def test_condition_3_1_strips_latin():
+
+    assert check_condition_3_1("мать (mother)") == (False, "мать ")
+
+
+@pytest.mark.parametrize("value", ["Семёнов Пётр Алексеевич", "Семёнова (Ёлкина) Анна Петровна"])
+def test_condition_3_2_accepts_yo(value):
+
+    assert check_condition_3_2(value) == (True, value)
+
+
+def test_condition_3_2_brackets_previous_surnames():
+
+    assert check_condition_3_2("Иванова Петрова Анна Петровна") == (False, "Иванова (Петрова) Анна Петровна")
+
+
+def test_condition_4():
+
+    assert check_condition_4("Московская область, г. Химки")[0]
+    assert check_condition_4("г. Москва, ул. Ленина")[0]
+    assert check_condition_4("г. Химки, Московская область") == (False, "Московская область, г. Химки")
+
+
+def test_unreadable_forms_are_not_failing(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+
+    report = validate(["missing.xlsx"], workdir = str(tmp_path) + "/")
+
+    assert list(report["condition"]) == ["read"]
+    assert failing_forms(report) == []
+    assert unreadable_forms(report) == ["missing.xlsx"]
+
+
+def test_failing_forms_unique_in_order():
+
+    report = pd.DataFrame({"file": ["b.xlsx", "a.xlsx", "b.xlsx", "c.xlsx"],
+                           "condition": ["4", "2", "3.1", "read"]})
+
+    assert failing_forms(report) == ["b.xlsx", "a.xlsx"]
+    assert unreadable_forms(report) == ["c.xlsx"]
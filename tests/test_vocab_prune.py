@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentencepiece")
+pytest.importorskip("tokenizers")
+pytest.importorskip("transformers")
+
+from transformers import M2M100Tokenizer, PreTrainedTokenizerFast
+
+from src.tokenizer_convert import verify_tokenizer, sample_texts
+from src.vocab_prune import select_tokens, save_pruned_tokenizer
+
+
+path_to_tokenizer_full = os.path.join(os.path.dirname(__file__), "..", "model", "M2M100_tokenizer")
+
+# тексты со словами, токенов которых нет в сокращенном словаре
+pruned_texts = ["Латинские слова English words", "новые слова: выдающийся, параллелепипед", "日本語 текст",
+                "ЖЖЖ щщщ ъъъ", "  Фомилию,  имя  "]
+
+
+@pytest.fixture(scope="module")
+def tokenizers(tmp_path_factory):
+
+    "Словарь только из токенов sample_texts"
+
+    tokenizer = M2M100Tokenizer.from_pretrained(path_to_tokenizer_full)
+    kept_ids = select_tokens(tokenizer, sample_texts, observed_only=True)
+
+    path = tmp_path_factory.mktemp("pruned")
+    tokenizer_ru = save_pruned_tokenizer(tokenizer, kept_ids, path_to_tokenizer_full, str(path / "slow"), str(path / "fast"))
+
+    return tokenizer_ru, PreTrainedTokenizerFast.from_pretrained(str(path / "fast"))
+
+
+def test_pruned_fast_tokenizer_matches_slow(tokenizers):
+
+    tokenizer_slow, tokenizer_fast = tokenizers
+
+    assert tokenizer_fast(sample_texts + pruned_texts)["input_ids"] == tokenizer_slow(sample_texts + pruned_texts)["input_ids"]
+    assert verify_tokenizer(tokenizer_slow, tokenizer_fast, sample_texts) == []
+
+
+def test_pruned_pieces_fall_back_to_kept_pieces(tokenizers):
+
+    tokenizer_slow, _ = tokenizers
+
+    # удаленный токен разбивается на оставшиеся, а не заменяется на <unk>
+    ids = tokenizer_slow("параллелепипед")["input_ids"]
+
+    assert tokenizer_slow.unk_token_id not in ids
+    assert tokenizer_slow.decode(ids, skip_special_tokens=True) == "параллелепипед"